@@ -0,0 +1,64 @@
+"""initial schema
+
+Tables as the app created them with create_all before migrations existed.
+Databases from that time already have them and only get the version stamp.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    if "repositories" not in existing:
+        op.create_table(
+            "repositories",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("name", sa.String()),
+            sa.Column("owner", sa.String()),
+            sa.Column("url", sa.String()),
+            sa.Column("platform", sa.String()),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index("ix_repositories_id", "repositories", ["id"])
+        op.create_index("ix_repositories_name", "repositories", ["name"])
+        op.create_index("ix_repositories_owner", "repositories", ["owner"])
+    if "pull_requests" not in existing:
+        op.create_table(
+            "pull_requests",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("repository_id", sa.Integer(), sa.ForeignKey("repositories.id")),
+            sa.Column("pr_number", sa.Integer()),
+            sa.Column("title", sa.String()),
+            sa.Column("description", sa.Text()),
+            sa.Column("status", sa.String()),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("updated_at", sa.DateTime(timezone=True)),
+        )
+        op.create_index("ix_pull_requests_id", "pull_requests", ["id"])
+    if "reviews" not in existing:
+        op.create_table(
+            "reviews",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("pull_request_id", sa.Integer(), sa.ForeignKey("pull_requests.id")),
+            sa.Column("status", sa.String()),
+            sa.Column("summary", sa.Text()),
+            sa.Column("suggestions", sa.JSON()),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index("ix_reviews_id", "reviews", ["id"])
+
+
+def downgrade():
+    op.drop_table("reviews")
+    op.drop_table("pull_requests")
+    op.drop_table("repositories")
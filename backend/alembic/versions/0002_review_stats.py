@@ -0,0 +1,38 @@
+"""review_stats rollup and reviews.duration_seconds
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if "duration_seconds" not in {c["name"] for c in inspector.get_columns("reviews")}:
+        op.add_column("reviews", sa.Column("duration_seconds", sa.Float()))
+    # Reviews finished before this revision have no duration and aren't counted
+    if not inspector.has_table("review_stats"):
+        op.create_table(
+            "review_stats",
+            sa.Column("repository", sa.String(), primary_key=True),
+            sa.Column("status", sa.String(), primary_key=True),
+            sa.Column("duration_bucket", sa.Float(), primary_key=True),
+            sa.Column("review_count", sa.Integer(), nullable=False),
+            sa.Column("suggestion_count", sa.Integer(), nullable=False),
+            sa.Column("duration_sum", sa.Float(), nullable=False),
+            sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+
+
+def downgrade():
+    op.drop_table("review_stats")
+    with op.batch_alter_table("reviews") as batch:
+        batch.drop_column("duration_seconds")
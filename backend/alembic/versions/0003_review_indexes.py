@@ -0,0 +1,33 @@
+"""indexes for /reviews keyset pagination and its joins
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_reviews_created_at_id", "reviews", ["created_at", "id"]),
+    ("ix_reviews_status_created_at_id", "reviews", ["status", "created_at", "id"]),
+    ("ix_reviews_pull_request_id", "reviews", ["pull_request_id"]),
+    ("ix_pull_requests_repository_id_id", "pull_requests", ["repository_id", "id"]),
+]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for name, table, columns in INDEXES:
+        if name not in {index["name"] for index in inspector.get_indexes(table)}:
+            op.create_index(name, table, columns)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,33 @@
+"""feedback table
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if sa.inspect(op.get_bind()).has_table("feedback"):
+        return
+    op.create_table(
+        "feedback",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("review_id", sa.Integer(), sa.ForeignKey("reviews.id"), nullable=False),
+        sa.Column("rating", sa.Integer(), nullable=False),
+        sa.Column("comment", sa.Text()),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("ix_feedback_id", "feedback", ["id"])
+    op.create_index("ix_feedback_review_id", "feedback", ["review_id"])
+
+
+def downgrade():
+    op.drop_table("feedback")
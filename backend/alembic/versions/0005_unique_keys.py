@@ -0,0 +1,68 @@
+"""reviews.completed_at and unique keys for the repository and pull request upserts
+
+crud.upsert_repositories and upsert_pull_requests rely on ON CONFLICT over
+(owner, name) and (repository_id, pr_number). Older databases can hold
+duplicates of either; those are merged into the row with the lowest id first.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+# Keeper of each (owner, name) and (repository_id, pr_number) group
+_FIRST_REPOSITORY = (
+    "SELECT MIN(k.id) FROM repositories k WHERE k.owner = r.owner AND k.name = r.name"
+)
+_FIRST_PULL_REQUEST = (
+    "SELECT MIN(k.id) FROM pull_requests k WHERE k.repository_id = p.repository_id AND k.pr_number = p.pr_number"
+)
+
+
+def _merge_duplicates():
+    op.execute(
+        "UPDATE pull_requests SET repository_id = ("
+        f"SELECT ({_FIRST_REPOSITORY}) FROM repositories r WHERE r.id = pull_requests.repository_id"
+        ") WHERE repository_id IN ("
+        f"SELECT r.id FROM repositories r WHERE r.id > ({_FIRST_REPOSITORY}))"
+    )
+    op.execute(f"DELETE FROM repositories WHERE id IN (SELECT r.id FROM repositories r WHERE r.id > ({_FIRST_REPOSITORY}))")
+    # Merging repositories can make pull requests collide as well
+    op.execute(
+        "UPDATE reviews SET pull_request_id = ("
+        f"SELECT ({_FIRST_PULL_REQUEST}) FROM pull_requests p WHERE p.id = reviews.pull_request_id"
+        ") WHERE pull_request_id IN ("
+        f"SELECT p.id FROM pull_requests p WHERE p.id > ({_FIRST_PULL_REQUEST}))"
+    )
+    op.execute(f"DELETE FROM pull_requests WHERE id IN (SELECT p.id FROM pull_requests p WHERE p.id > ({_FIRST_PULL_REQUEST}))")
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if "completed_at" not in {c["name"] for c in inspector.get_columns("reviews")}:
+        op.add_column("reviews", sa.Column("completed_at", sa.DateTime(timezone=True)))
+
+    _merge_duplicates()
+    for table, name, columns in (
+        ("repositories", "uq_repositories_owner_name", ["owner", "name"]),
+        ("pull_requests", "uq_pull_requests_repository_id_pr_number", ["repository_id", "pr_number"]),
+    ):
+        if name not in {c["name"] for c in inspector.get_unique_constraints(table)}:
+            with op.batch_alter_table(table) as batch:
+                batch.create_unique_constraint(name, columns)
+
+
+def downgrade():
+    with op.batch_alter_table("pull_requests") as batch:
+        batch.drop_constraint("uq_pull_requests_repository_id_pr_number", type_="unique")
+    with op.batch_alter_table("repositories") as batch:
+        batch.drop_constraint("uq_repositories_owner_name", type_="unique")
+    with op.batch_alter_table("reviews") as batch:
+        batch.drop_column("completed_at")
@@ -0,0 +1,114 @@
+"""suggestions table, filled from the reviews.suggestions JSON column, which is dropped
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+from pydantic import ValidationError
+
+from app.schemas import Suggestion
+
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+reviews = sa.table(
+    "reviews",
+    sa.column("id", sa.Integer()),
+    sa.column("pull_request_id", sa.Integer()),
+    sa.column("suggestions", sa.JSON()),
+    sa.column("created_at", sa.DateTime(timezone=True)),
+)
+pull_requests = sa.table("pull_requests", sa.column("id", sa.Integer()), sa.column("repository_id", sa.Integer()))
+suggestions = sa.table(
+    "suggestions",
+    sa.column("id", sa.Integer()),
+    sa.column("review_id", sa.Integer()),
+    sa.column("repository_id", sa.Integer()),
+    sa.column("file", sa.String()),
+    sa.column("line", sa.Integer()),
+    sa.column("severity", sa.String()),
+    sa.column("category", sa.String()),
+    sa.column("comment", sa.Text()),
+    sa.column("created_at", sa.DateTime(timezone=True)),
+)
+
+
+def _move_legacy_suggestions(bind):
+    """Copy reviews.suggestions into the table a batch of reviews at a time; invalid entries are skipped."""
+    last_id = 0
+    moved = 0
+    while True:
+        batch = bind.execute(
+            sa.select(reviews.c.id, reviews.c.suggestions, reviews.c.created_at, pull_requests.c.repository_id)
+            .select_from(reviews.outerjoin(pull_requests, pull_requests.c.id == reviews.c.pull_request_id))
+            .where(reviews.c.id > last_id)
+            .order_by(reviews.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not batch:
+            return moved
+        rows = []
+        for review_id, legacy, created_at, repository_id in batch:
+            if repository_id is None or not isinstance(legacy, list):
+                continue
+            for raw in legacy:
+                try:
+                    suggestion = Suggestion.model_validate(raw)
+                except ValidationError:
+                    continue
+                rows.append({
+                    "review_id": review_id, "repository_id": repository_id, "created_at": created_at,
+                    **suggestion.model_dump(),
+                })
+        if rows:
+            bind.execute(suggestions.insert(), rows)
+        moved += len(rows)
+        last_id = batch[-1][0]
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if not inspector.has_table("suggestions"):
+        op.create_table(
+            "suggestions",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("review_id", sa.Integer(), sa.ForeignKey("reviews.id", ondelete="CASCADE"), nullable=False),
+            sa.Column("repository_id", sa.Integer(), sa.ForeignKey("repositories.id"), nullable=False),
+            sa.Column("file", sa.String(), nullable=False),
+            sa.Column("line", sa.Integer()),
+            sa.Column("severity", sa.String(16), nullable=False),
+            sa.Column("category", sa.String()),
+            sa.Column("comment", sa.Text(), nullable=False),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index("ix_suggestions_review_id", "suggestions", ["review_id"])
+        op.create_index("ix_suggestions_repository_id_file", "suggestions", ["repository_id", "file"])
+        op.create_index("ix_suggestions_repository_id_severity", "suggestions", ["repository_id", "severity"])
+        op.create_index("ix_suggestions_severity", "suggestions", ["severity"])
+
+    if "suggestions" in {c["name"] for c in inspector.get_columns("reviews")}:
+        moved = _move_legacy_suggestions(bind)
+        print(f"Moved {moved} suggestions into the suggestions table")
+        with op.batch_alter_table("reviews") as batch:
+            batch.drop_column("suggestions")
+
+
+def downgrade():
+    bind = op.get_bind()
+    with op.batch_alter_table("reviews") as batch:
+        batch.add_column(sa.Column("suggestions", sa.JSON()))
+    per_review = {}
+    for row in bind.execute(sa.select(suggestions).order_by(suggestions.c.id)).mappings():
+        entry = {k: row[k] for k in ("file", "line", "severity", "category", "comment") if row[k] is not None}
+        per_review.setdefault(row["review_id"], []).append(entry)
+    for review_id, entries in per_review.items():
+        bind.execute(reviews.update().where(reviews.c.id == review_id).values(suggestions=entries))
+    op.drop_table("suggestions")
@@ -0,0 +1,96 @@
+"""review_stats counts by severity, backfilled from the suggestions table
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.crud import duration_bucket
+from app.schemas import SEVERITIES
+
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+review_stats = sa.table(
+    "review_stats",
+    sa.column("repository", sa.String()),
+    sa.column("status", sa.String()),
+    sa.column("duration_bucket", sa.Float()),
+    *(sa.column(f"{severity}_count", sa.Integer()) for severity in SEVERITIES),
+)
+reviews = sa.table(
+    "reviews",
+    sa.column("id", sa.Integer()),
+    sa.column("status", sa.String()),
+    sa.column("duration_seconds", sa.Float()),
+)
+repositories = sa.table(
+    "repositories", sa.column("id", sa.Integer()), sa.column("owner", sa.String()), sa.column("name", sa.String())
+)
+suggestions = sa.table(
+    "suggestions",
+    sa.column("review_id", sa.Integer()),
+    sa.column("repository_id", sa.Integer()),
+    sa.column("severity", sa.String()),
+)
+
+
+def _backfill(bind):
+    """Split the counts of existing rollup rows by severity from the suggestions they were made from."""
+    counts = {}
+    # Reviews without a duration were never folded into the rollup
+    for owner, name, status, duration, severity, count in bind.execute(
+        sa.select(
+            repositories.c.owner, repositories.c.name, reviews.c.status, reviews.c.duration_seconds,
+            suggestions.c.severity, sa.func.count(),
+        )
+        .select_from(
+            suggestions.join(reviews, reviews.c.id == suggestions.c.review_id)
+            .join(repositories, repositories.c.id == suggestions.c.repository_id)
+        )
+        .where(reviews.c.duration_seconds.isnot(None))
+        .group_by(
+            repositories.c.owner, repositories.c.name, reviews.c.status, reviews.c.duration_seconds,
+            suggestions.c.severity,
+        )
+    ):
+        if severity not in SEVERITIES:
+            continue
+        key = (f"{owner}/{name}", status, duration_bucket(duration))
+        row = counts.setdefault(key, dict.fromkeys(SEVERITIES, 0))
+        row[severity] += int(count)
+    for (repository, status, bucket), row in counts.items():
+        bind.execute(
+            review_stats.update()
+            .where(
+                review_stats.c.repository == repository,
+                review_stats.c.status == status,
+                review_stats.c.duration_bucket == bucket,
+            )
+            .values({f"{severity}_count": count for severity, count in row.items()})
+        )
+    return len(counts)
+
+
+def upgrade():
+    bind = op.get_bind()
+    existing = {c["name"] for c in sa.inspect(bind).get_columns("review_stats")}
+    added = [severity for severity in SEVERITIES if f"{severity}_count" not in existing]
+    if not added:
+        return
+    with op.batch_alter_table("review_stats") as batch:
+        for severity in added:
+            batch.add_column(sa.Column(f"{severity}_count", sa.Integer(), nullable=False, server_default="0"))
+    updated = _backfill(bind)
+    print(f"Split {updated} review_stats rows by severity")
+
+
+def downgrade():
+    with op.batch_alter_table("review_stats") as batch:
+        for severity in SEVERITIES:
+            batch.drop_column(f"{severity}_count")
@@ -1,47 +1,386 @@
 import ast
-from typing import List, Dict, Any
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 
-class CodeAnalyzer:
-    def analyze_python(self, code: str) -> Dict[str, Any]:
+from .analyzers import AnalyzerPlugin, get_analyzer, register_analyzer
+from .diff_parser import patch_changed_ranges
+
+LineRange = Tuple[int, int]
+
+
+class IntervalIndex:
+    """
+    Static centered interval tree over (start, end, item) spans, answering
+    "which spans overlap [start, end]" in O(log n + k).
+    """
+
+    def __init__(self, intervals: List[Tuple[int, int, Any]]):
+        self._root = self._build(intervals)
+
+    def _build(self, intervals):
+        if not intervals:
+            return None
+        points = sorted(p for start, end, _ in intervals for p in (start, end))
+        center = points[len(points) // 2]
+        left = [i for i in intervals if i[1] < center]
+        right = [i for i in intervals if i[0] > center]
+        here = [i for i in intervals if i[0] <= center <= i[1]]
+        return (
+            center,
+            sorted(here, key=lambda i: i[0]),
+            sorted(here, key=lambda i: i[1], reverse=True),
+            self._build(left),
+            self._build(right),
+        )
+
+    def overlapping(self, start: int, end: int) -> List[Any]:
+        found = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            center, by_start, by_end, left, right = node
+            if end < center:
+                for s, e, item in by_start:
+                    if s > end:
+                        break
+                    found.append(item)
+                stack.append(left)
+            elif start > center:
+                for s, e, item in by_end:
+                    if e < start:
+                        break
+                    found.append(item)
+                stack.append(right)
+            else:
+                found.extend(item for _, _, item in by_start)
+                stack.append(left)
+                stack.append(right)
+        return found
+
+
+class _DefinitionVisitor(ast.NodeVisitor):
+    """
+    Single pass over a module collecting functions, classes and imports with
+    their line spans, plus the names each definition references.
+    """
+
+    def __init__(self):
+        self.definitions: List[Dict[str, Any]] = []
+        self.imports: List[Dict[str, str]] = []
+        self._stack: List[Dict[str, Any]] = []
+
+    def _definition(self, node, kind: str):
+        entry = {
+            "kind": kind,
+            "name": node.name,
+            "lineno": node.lineno,
+            "end_lineno": getattr(node, "end_lineno", None) or node.lineno,
+            "parent": self._stack[-1]["name"] if self._stack else None,
+            "names": set(),
+        }
+        if kind == "function":
+            entry["args"] = [arg.arg for arg in node.args.args]
+        # Decorators count as part of the definition's span when scoping; lineno stays on the def
+        if node.decorator_list:
+            entry["start"] = min(entry["lineno"], *(d.lineno for d in node.decorator_list))
+        self.definitions.append(entry)
+
+        self._stack.append(entry)
+        self.generic_visit(node)
+        self._stack.pop()
+        if self._stack:
+            self._stack[-1]["names"] |= entry["names"]
+
+    def visit_FunctionDef(self, node):
+        self._definition(node, "function")
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_ClassDef(self, node):
+        self._definition(node, "class")
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self.imports.append({"name": alias.asname or alias.name.split(".")[0], "module": alias.name})
+
+    def visit_ImportFrom(self, node):
+        module = node.module or ""
+        for alias in node.names:
+            self.imports.append({"name": alias.asname or alias.name, "module": f"{module}.{alias.name}"})
+
+    def visit_Name(self, node):
+        if self._stack:
+            self._stack[-1]["names"].add(node.id)
+
+
+class PythonAnalyzer(AnalyzerPlugin):
+    language = "python"
+    extensions = (".py", ".pyi")
+
+    def parse(self, content: str) -> Dict[str, Any]:
         try:
-            tree = ast.parse(code)
+            tree = ast.parse(content)
         except SyntaxError:
             return {"error": "SyntaxError"}
+        visitor = _DefinitionVisitor()
+        visitor.visit(tree)
+        for entry in visitor.definitions:
+            entry["names"] = sorted(entry["names"])
+        return {"symbols": visitor.definitions, "imports": visitor.imports}
+
+
+register_analyzer(PythonAnalyzer())
+
 
-        functions = []
-        classes = []
-        imports = []
-
-        for node in ast.walk(tree):
-            if isinstance(node, ast.FunctionDef):
-                functions.append({
-                    "name": node.name,
-                    "lineno": node.lineno,
-                    "args": [arg.arg for arg in node.args.args]
-                })
-            elif isinstance(node, ast.ClassDef):
-                classes.append({
-                    "name": node.name,
-                    "lineno": node.lineno
-                })
-            elif isinstance(node, ast.Import) or isinstance(node, ast.ImportFrom):
-                # Simplified import extraction
-                if isinstance(node, ast.Import):
-                    for alias in node.names:
-                        imports.append(alias.name)
-                elif isinstance(node, ast.ImportFrom):
-                    module = node.module or ""
-                    for alias in node.names:
-                        imports.append(f"{module}.{alias.name}")
+def _public(entry: Dict[str, Any]) -> Dict[str, Any]:
+    result = {"kind": entry["kind"], "name": entry["name"], "lineno": entry["lineno"], "end_lineno": entry["end_lineno"]}
+    if "args" in entry:
+        result["args"] = entry["args"]
+    if entry.get("parent"):
+        result["parent"] = entry["parent"]
+    return result
 
+
+def scope_structure(structure: Dict[str, Any], changed_ranges: Optional[List[LineRange]] = None) -> Dict[str, Any]:
+    """
+    Turn a plugin's parse result into the analysis output. With `changed_ranges`
+    (new-file line ranges touched by a diff) only the symbols enclosing those
+    lines are kept, along with the top-level symbols and imports they reference
+    directly.
+    """
+    if "error" in structure or "skipped" in structure:
+        return structure
+    symbols = structure["symbols"]
+    if changed_ranges is None:
         return {
-            "functions": functions,
-            "classes": classes,
-            "imports": imports
+            "language": structure.get("language"),
+            "symbols": [_public(s) for s in symbols],
+            "imports": [i["module"] for i in structure["imports"]],
         }
 
-    def analyze(self, filename: str, content: str) -> Dict[str, Any]:
-        if filename.endswith(".py"):
-            return self.analyze_python(content)
-        else:
+    index = IntervalIndex([(s.get("start", s["lineno"]), s["end_lineno"], i) for i, s in enumerate(symbols)])
+    selected = sorted({i for start, end in changed_ranges for i in index.overlapping(start, end)})
+    enclosing = [symbols[i] for i in selected]
+
+    referenced = set()
+    for symbol in enclosing:
+        referenced.update(symbol["names"])
+    selected_names = {symbol["name"] for symbol in enclosing}
+    dependencies = [
+        {"name": s["name"], "kind": s["kind"], "lineno": s["lineno"]}
+        for s in symbols
+        if not s.get("parent") and s["name"] in referenced and s["name"] not in selected_names
+    ]
+    bindings = {i["name"]: i["module"] for i in structure["imports"]}
+
+    return {
+        "language": structure.get("language"),
+        "symbols": [_public(s) for s in enclosing],
+        "imports": sorted({bindings[name] for name in referenced if name in bindings}),
+        "dependencies": dependencies,
+        "changed_ranges": [list(r) for r in changed_ranges],
+    }
+
+
+def _with_python_keys(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Add the functions and classes lists Python analysis returned before symbols."""
+    if "error" in result or "skipped" in result:
+        return result
+    result["functions"] = [
+        {"name": s["name"], "lineno": s["lineno"], "args": s.get("args", [])}
+        for s in result["symbols"] if s["kind"] == "function"
+    ]
+    result["classes"] = [{"name": s["name"], "lineno": s["lineno"]} for s in result["symbols"] if s["kind"] == "class"]
+    return result
+
+
+class CodeAnalyzer:
+    def analyze_python(self, code: str, changed_ranges: Optional[List[LineRange]] = None) -> Dict[str, Any]:
+        return _with_python_keys(scope_structure(self.parse("module.py", code), changed_ranges))
+
+    @staticmethod
+    def supports(filename: str) -> bool:
+        plugin = get_analyzer(filename)
+        return plugin is not None and plugin.available()
+
+    def parse(self, filename: str, content: str) -> Dict[str, Any]:
+        plugin = get_analyzer(filename)
+        structure = plugin.parse(content)
+        structure["language"] = plugin.language
+        return structure
+
+    def analyze(self, filename: str, content: str, changed_ranges: Optional[List[LineRange]] = None) -> Dict[str, Any]:
+        plugin = get_analyzer(filename)
+        if plugin is None:
             return {"message": "Unsupported file type for deep analysis"}
+        result = scope_structure(self.parse(filename, content), changed_ranges)
+        return _with_python_keys(result) if plugin.language == "python" else result
+
+
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", str(os.cpu_count() or 2)))
+ANALYSIS_MAX_FILE_BYTES = int(os.getenv("ANALYSIS_MAX_FILE_BYTES", str(1024 * 1024)))
+# Blob downloads (and the parses queued behind them) in flight per PR
+ANALYSIS_FETCH_CONCURRENCY = int(os.getenv("ANALYSIS_FETCH_CONCURRENCY", "8"))
+ANALYSIS_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", str(30 * 24 * 3600)))
+# Bump when the analyzer output changes so stale cache entries are ignored
+ANALYSIS_VERSION = "6"
+
+
+def parse_source(filename: str, content: str) -> Tuple[Dict[str, Any], float]:
+    """Parse one file and return (structure, seconds spent). Runs inside the process pool."""
+    start = time.perf_counter()
+    try:
+        structure = CodeAnalyzer().parse(filename, content)
+    except Exception as e:
+        structure = {"error": str(e), "language": get_analyzer(filename).language}
+    return structure, time.perf_counter() - start
+
+
+def summarize_analysis(analysis: Dict[str, Any], max_imports: int = 15) -> str:
+    """Compact one-line structural summary of a file for the review prompt."""
+    groups: Dict[str, List[str]] = {}
+    for symbol in analysis.get("symbols", []):
+        label = f"{symbol['name']}({', '.join(symbol['args'])})" if "args" in symbol else symbol["name"]
+        groups.setdefault(symbol["kind"], []).append(f"{label}@{symbol['lineno']}")
+    parts = [f"{_KIND_LABELS.get(kind, kind + 's')}: " + ", ".join(entries) for kind, entries in groups.items()]
+    if analysis.get("dependencies"):
+        parts.append("uses: " + ", ".join(f"{d['name']}@{d['lineno']}" for d in analysis["dependencies"]))
+    if analysis.get("imports"):
+        imports = analysis["imports"]
+        more = f" (+{len(imports) - max_imports} more)" if len(imports) > max_imports else ""
+        parts.append("imports: " + ", ".join(imports[:max_imports]) + more)
+    return "; ".join(parts)
+
+
+_KIND_LABELS = {"class": "classes"}
+
+
+class AnalysisEngine:
+    """
+    Analyzes the files a PR touches at its head revision. Parsing runs in a
+    process pool (AST work is CPU bound and holds the GIL). Full parse results
+    are cached by git blob SHA, shared by every language plugin, so a file that
+    is unchanged between PR revisions is neither downloaded nor parsed again;
+    files over ANALYSIS_MAX_FILE_BYTES are cached as skipped so they aren't
+    downloaded again either. Scoping to the changed lines is cheap and done on
+    every call.
+    """
+
+    def __init__(self, workers: int = ANALYSIS_WORKERS, cache=None):
+        from .redis_client import get_redis
+        from .review_cache import ReviewCache
+
+        self.workers = workers
+        self.cache = cache or ReviewCache(get_redis, ttl=ANALYSIS_CACHE_TTL, prefix="analysis-cache:")
+        self.stats: Dict[str, Dict[str, float]] = {}
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: forking a process that already runs threads (Celery pool, event loop) is unsafe
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _record(self, language: str, size: int, seconds: float, failed: bool):
+        entry = self.stats.setdefault(language, {"files": 0, "bytes": 0, "seconds": 0.0, "errors": 0})
+        entry["files"] += 1
+        entry["bytes"] += size
+        entry["seconds"] += seconds
+        entry["errors"] += int(failed)
+
+    def throughput(self) -> Dict[str, Dict[str, float]]:
+        """Parse throughput per language plugin since the worker started."""
+        return {
+            language: {
+                "files": entry["files"],
+                "errors": entry["errors"],
+                "kb_per_second": round(entry["bytes"] / 1024 / entry["seconds"], 1) if entry["seconds"] else 0.0,
+                "ms_per_file": round(entry["seconds"] * 1000 / entry["files"], 2),
+            }
+            for language, entry in self.stats.items()
+        }
+
+    async def analyze_pr(self, client, owner: str, repo: str, pr_number: int) -> Dict[str, Any]:
+        files = await client.list_pr_files(owner, repo, pr_number)
+        candidates = [
+            f for f in files
+            if f.get("status") != "removed" and f.get("sha") and CodeAnalyzer.supports(f["filename"])
+        ]
+        # Only the definitions around the changed lines are extracted; files
+        # without a patch (too large for the files API) are analyzed in full.
+        ranges = {f["filename"]: patch_changed_ranges(f["patch"]) if f.get("patch") else None for f in candidates}
+        keys = {f["filename"]: f"{ANALYSIS_VERSION}:{f['sha']}" for f in candidates}
+        cached = await asyncio.to_thread(self.cache.get_many, keys.values())
+
+        structures: Dict[str, Dict[str, Any]] = {}
+        timings: Dict[str, float] = {}
+        skipped = 0
+        misses = []
+        for f in candidates:
+            entry = cached.get(keys[f["filename"]])
+            if entry is None or entry.get("skipped") and entry["bytes"] <= ANALYSIS_MAX_FILE_BYTES:
+                # Skipped under a lower size limit than the current one
+                misses.append(f)
+            elif "skipped" in entry:
+                skipped += 1
+            else:
+                structures[f["filename"]] = entry
+
+        fetches = asyncio.Semaphore(ANALYSIS_FETCH_CONCURRENCY)
+
+        async def parse(f):
+            async with fetches:
+                content = await client.get_blob(owner, repo, f["sha"])
+                if len(content) > ANALYSIS_MAX_FILE_BYTES:
+                    marker = {"skipped": "too large", "bytes": len(content), "language": get_analyzer(f["filename"]).language}
+                    return f["filename"], marker, len(content), 0.0
+                loop = asyncio.get_running_loop()
+                structure, elapsed = await loop.run_in_executor(self._executor(), parse_source, f["filename"], content)
+                return f["filename"], structure, len(content), elapsed
+
+        fresh = {}
+        for outcome in await asyncio.gather(*(parse(f) for f in misses), return_exceptions=True):
+            if isinstance(outcome, BaseException):
+                print(f"File analysis failed: {outcome}")
+                continue
+            filename, structure, size, elapsed = outcome
+            if "skipped" in structure:
+                skipped += 1
+                fresh[keys[filename]] = structure
+                continue
+            self._record(structure.get("language", "unknown"), size, elapsed, "error" in structure)
+            structures[filename] = structure
+            timings[filename] = round(elapsed * 1000, 2)
+            # A missing grammar or a crashed worker says nothing about the blob; parse it again next time
+            if "error" not in structure:
+                fresh[keys[filename]] = structure
+        await asyncio.to_thread(self.cache.set_many, fresh)
+
+        return {
+            "files": {filename: scope_structure(structure, ranges[filename]) for filename, structure in structures.items()},
+            "timings_ms": timings,
+            "cache_hits": len(candidates) - len(misses),
+            "parsed": len(timings),
+            "skipped": skipped,
+        }
+
+
+_engine: Optional[AnalysisEngine] = None
+
+
+def get_analysis_engine() -> AnalysisEngine:
+    global _engine
+    if _engine is None:
+        _engine = AnalysisEngine()
+    return _engine
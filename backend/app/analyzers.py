@@ -0,0 +1,258 @@
+import importlib
+import importlib.util
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class AnalyzerPlugin:
+    """
+    Structural analyzer for one language. `parse` returns the uniform shape
+
+        {"symbols": [{"kind", "name", "lineno", "end_lineno", "start"?, "parent", "args"?, "names"}],
+         "imports": [{"name", "module"}]}
+
+    where `names` are the identifiers a symbol references and import `name` is
+    the identifier the import binds locally. `start` is given when the
+    definition's span begins before `lineno` (decorators). Failures return
+    {"error": ...}.
+    """
+
+    language = ""
+    extensions: Tuple[str, ...] = ()
+
+    def available(self) -> bool:
+        return True
+
+    def parse(self, content: str) -> Dict[str, Any]:
+        raise NotImplementedError
+
+
+_registry: Dict[str, AnalyzerPlugin] = {}
+
+
+def register_analyzer(plugin: AnalyzerPlugin):
+    for extension in plugin.extensions:
+        _registry[extension.lower()] = plugin
+
+
+def get_analyzer(filename: str) -> Optional[AnalyzerPlugin]:
+    return _registry.get(os.path.splitext(filename)[1].lower())
+
+
+def registered_languages() -> List[str]:
+    return sorted({plugin.language for plugin in _registry.values()})
+
+
+class TreeSitterAnalyzer(AnalyzerPlugin):
+    """
+    Analyzer backed by a tree-sitter grammar package. Neither tree_sitter nor
+    the grammar is imported until the first file of this language is parsed,
+    so registering plugins costs nothing at worker startup.
+    """
+
+    # node type -> symbol kind
+    symbol_types: Dict[str, str] = {}
+    identifier_types = ("identifier", "type_identifier")
+    import_types: Tuple[str, ...] = ()
+
+    def __init__(self, grammar: str, loader: str = "language"):
+        self.grammar = grammar
+        self.loader = loader
+        self._parser = None
+
+    def available(self) -> bool:
+        return importlib.util.find_spec("tree_sitter") is not None and importlib.util.find_spec(self.grammar) is not None
+
+    def _get_parser(self):
+        if self._parser is None:
+            from tree_sitter import Language, Parser
+
+            module = importlib.import_module(self.grammar)
+            self._parser = Parser(Language(getattr(module, self.loader)()))
+        return self._parser
+
+    def parse(self, content: str) -> Dict[str, Any]:
+        try:
+            parser = self._get_parser()
+        except ImportError as e:
+            return {"error": f"{self.language} grammar not installed: {e}"}
+        # tree-sitter recovers from syntax errors, so partial results are still useful
+        tree = parser.parse(content.encode("utf-8"))
+
+        symbols: List[Dict[str, Any]] = []
+        imports: List[Dict[str, str]] = []
+        # (node, enclosing symbol); children are pushed in reverse to keep source order
+        stack: List[Tuple[Any, Optional[Dict[str, Any]]]] = [(tree.root_node, None)]
+        while stack:
+            node, owner = stack.pop()
+            kind = self.symbol_types.get(node.type)
+            if kind is not None:
+                symbol = self._symbol(node, kind, owner)
+                if symbol is not None:
+                    symbols.append(symbol)
+                    owner = symbol
+            elif node.type in self.import_types:
+                imports.extend({"name": name, "module": module} for name, module in self._imports(node))
+                continue
+            elif owner is not None and node.type in self.identifier_types:
+                owner["names"].add(_text(node))
+            stack.extend((child, owner) for child in reversed(node.children))
+
+        # Fold nested references into their parents, innermost first
+        by_id = {id(s): s for s in symbols}
+        for symbol in reversed(symbols):
+            parent = by_id.get(symbol.pop("_parent_id", None))
+            if parent is not None:
+                parent["names"] |= symbol["names"]
+        for symbol in symbols:
+            symbol["names"] = sorted(symbol["names"])
+        return {"symbols": symbols, "imports": imports}
+
+    def _symbol(self, node, kind: str, owner: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        name_node = node.child_by_field_name("name")
+        if name_node is None:
+            return None
+        symbol = {
+            "kind": kind,
+            "name": _text(name_node),
+            "lineno": name_node.start_point[0] + 1,
+            "end_lineno": node.end_point[0] + 1,
+            "parent": owner["name"] if owner else None,
+            "names": set(),
+            "_parent_id": id(owner) if owner else None,
+        }
+        if node.start_point[0] < name_node.start_point[0]:
+            # Annotations, decorators or modifiers on lines of their own
+            symbol["start"] = node.start_point[0] + 1
+        parameters = node.child_by_field_name("parameters")
+        if parameters is not None:
+            symbol["args"] = [_parameter_name(p) for p in parameters.named_children if p.type != "comment"]
+        return symbol
+
+    def _imports(self, node) -> List[Tuple[str, str]]:
+        raise NotImplementedError
+
+
+def _text(node) -> str:
+    return node.text.decode("utf-8", "replace")
+
+
+def _parameter_name(node) -> str:
+    for field in ("name", "pattern"):
+        child = node.child_by_field_name(field)
+        if child is not None:
+            return _text(child)
+    return _text(node)
+
+
+class GoAnalyzer(TreeSitterAnalyzer):
+    language = "go"
+    extensions = (".go",)
+    symbol_types = {
+        "function_declaration": "function",
+        "method_declaration": "method",
+        "type_spec": "type",
+    }
+    import_types = ("import_declaration",)
+
+    def __init__(self):
+        super().__init__("tree_sitter_go")
+
+    def _imports(self, node):
+        found = []
+        pending = [node]
+        while pending:
+            current = pending.pop()
+            if current.type == "import_spec":
+                path = _text(current.child_by_field_name("path")).strip('"`')
+                alias = current.child_by_field_name("name")
+                found.append((_text(alias) if alias is not None else path.rsplit("/", 1)[-1], path))
+            else:
+                pending.extend(reversed(current.named_children))
+        return found
+
+
+class JavaAnalyzer(TreeSitterAnalyzer):
+    language = "java"
+    extensions = (".java",)
+    symbol_types = {
+        "class_declaration": "class",
+        "interface_declaration": "interface",
+        "enum_declaration": "enum",
+        "record_declaration": "class",
+        "method_declaration": "method",
+        "constructor_declaration": "method",
+    }
+    import_types = ("import_declaration",)
+
+    def __init__(self):
+        super().__init__("tree_sitter_java")
+
+    def _imports(self, node):
+        module = _text(node)[len("import"):].rstrip(";").replace("static ", "", 1).strip()
+        return [(module.rsplit(".", 1)[-1], module)]
+
+
+class TypeScriptAnalyzer(TreeSitterAnalyzer):
+    language = "typescript"
+    extensions = (".ts", ".mts", ".cts")
+    symbol_types = {
+        "function_declaration": "function",
+        "generator_function_declaration": "function",
+        "class_declaration": "class",
+        "abstract_class_declaration": "class",
+        "interface_declaration": "interface",
+        "type_alias_declaration": "type",
+        "enum_declaration": "enum",
+        "method_definition": "method",
+    }
+    import_types = ("import_statement",)
+
+    def __init__(self, loader: str = "language_typescript"):
+        super().__init__("tree_sitter_typescript", loader)
+
+    def _imports(self, node):
+        source = node.child_by_field_name("source")
+        if source is None:
+            return []
+        module = _text(source).strip("'\"")
+        names = []
+        pending = [c for c in node.named_children if c.type == "import_clause"]
+        while pending:
+            current = pending.pop()
+            if current.type == "import_specifier":
+                alias = current.child_by_field_name("alias") or current.child_by_field_name("name")
+                names.append(_text(alias))
+            elif current.type == "identifier":
+                names.append(_text(current))
+            else:
+                pending.extend(reversed(current.named_children))
+        return [(name, module) for name in names] or [(module, module)]
+
+
+class TSXAnalyzer(TypeScriptAnalyzer):
+    language = "tsx"
+    extensions = (".tsx",)
+
+    def __init__(self):
+        super().__init__("language_tsx")
+
+
+class JavaScriptAnalyzer(TypeScriptAnalyzer):
+    """Same import statements as TypeScript, parsed with the JavaScript grammar (JSX included)."""
+
+    language = "javascript"
+    extensions = (".js", ".jsx", ".mjs", ".cjs")
+    symbol_types = {
+        "function_declaration": "function",
+        "generator_function_declaration": "function",
+        "class_declaration": "class",
+        "method_definition": "method",
+    }
+
+    def __init__(self):
+        TreeSitterAnalyzer.__init__(self, "tree_sitter_javascript")
+
+
+for _plugin in (GoAnalyzer(), JavaAnalyzer(), TypeScriptAnalyzer(), TSXAnalyzer(), JavaScriptAnalyzer()):
+    register_analyzer(_plugin)
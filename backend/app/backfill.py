@@ -0,0 +1,359 @@
+"""
+Reviews a repository's existing pull requests in bulk, for onboarding
+repositories without waiting for webhooks.
+
+    python -m app.backfill acme/api acme/web                 # open PRs
+    python -m app.backfill acme/api --state all --limit 500 --concurrency 8
+    python -m app.backfill --installation --publish          # every repository, commenting on open PRs
+
+POST /admin/backfill runs the same thing in a worker as the "backfill_reviews"
+task, which hands over to a fresh task every BACKFILL_TASK_SECONDS.
+
+- PR lists are paged oldest first with conditional requests; each page's
+  ETag and trimmed items are kept in BACKFILL_DIR, so a re-run gets 304s
+  (free against the rate limit) for everything but new pages.
+- Up to `concurrency` PRs are reviewed at once on one event loop; model and
+  GitHub calls underneath go through the shared dispatcher and rate limiter.
+- Finished reviews are written BACKFILL_FLUSH_SIZE at a time with
+  crud.save_reviews, and only then checkpointed: the checkpoint records the
+  head SHA each PR was reviewed at, and PRs whose head hasn't moved since
+  are skipped, so an interrupted run resumes where it was written up to.
+- Comments are only posted with `publish`, and only on open PRs.
+"""
+import argparse
+import asyncio
+import fcntl
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from .analysis import get_analysis_engine, summarize_analysis
+from .collector import get_collector
+from .crud import pull_request_fields, save_reviews
+from .database import SessionLocal
+from .github_service import GitHubClient, close_http_client, get_client_stats
+from .llm import LLMProvider, get_llm_provider
+from .pipeline import ReviewPipeline
+from .publisher import ReviewPublisher
+from .retrieval import REVIEW_CONTEXT, get_review_index_store
+
+BACKFILL_DIR = os.getenv("BACKFILL_DIR", "data/backfill")
+# PRs reviewed at once per backfill
+BACKFILL_CONCURRENCY = int(os.getenv("BACKFILL_CONCURRENCY", "4"))
+# Finished reviews per bulk write (and checkpoint)
+BACKFILL_FLUSH_SIZE = int(os.getenv("BACKFILL_FLUSH_SIZE", "50"))
+# A worker task stops taking new PRs after this long and queues its continuation
+BACKFILL_TASK_SECONDS = float(os.getenv("BACKFILL_TASK_SECONDS", "1800"))
+COLLECT_TRAINING_DATA = os.getenv("COLLECT_TRAINING_DATA", "true").lower() == "true"
+
+PR_STATES = ("open", "closed", "all")
+
+
+def _pr_summary(pr: Dict[str, Any]) -> Dict[str, Any]:
+    # What is kept of each listed PR, in the page cache and for the review
+    return {
+        "number": pr["number"],
+        "title": pr.get("title"),
+        "body": pr.get("body"),
+        "state": pr.get("state"),
+        "merged_at": pr.get("merged_at"),
+        "head_sha": (pr.get("head") or {}).get("sha"),
+    }
+
+
+def _write_json(path: str, value: Any):
+    with open(path + ".tmp", "w") as f:
+        json.dump(value, f)
+    os.replace(path + ".tmp", path)
+
+
+def _read_json(path: str, default: Any) -> Any:
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+
+class BackfillState:
+    """Checkpoint and cached PR list pages of one repository, in BACKFILL_DIR/<owner>__<repo>."""
+
+    def __init__(self, repository: str, root: str = BACKFILL_DIR):
+        self.path = os.path.join(root, repository.replace("/", "__"))
+        os.makedirs(self.path, exist_ok=True)
+        checkpoint = _read_json(os.path.join(self.path, "checkpoint.json"), {})
+        # PR number -> head SHA it was last reviewed (or failed) at
+        self.reviewed: Dict[str, str] = checkpoint.get("reviewed", {})
+        self.failed: Dict[str, str] = checkpoint.get("failed", {})
+        self.etags: Dict[str, Any] = _read_json(os.path.join(self.path, "pages.json"), {})
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def locked(self) -> Iterator[bool]:
+        """Yields False when another backfill of this repository is running."""
+        with open(os.path.join(self.path, "LOCK"), "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def pending(self, pr: Dict[str, Any]) -> bool:
+        return self.reviewed.get(str(pr["number"])) != pr["head_sha"]
+
+    def record(self, reviews: List[Dict[str, Any]]):
+        with self._lock:
+            for review in reviews:
+                number = str(review["pull_request"]["pr_number"])
+                if review["status"] == "completed":
+                    self.reviewed[number] = review["head_sha"]
+                    self.failed.pop(number, None)
+                else:
+                    self.failed[number] = review["head_sha"]
+            self.save()
+
+    def save(self):
+        with self._lock:
+            _write_json(os.path.join(self.path, "checkpoint.json"), {"reviewed": self.reviewed, "failed": self.failed})
+            # Copied first: the listing may add pages meanwhile
+            _write_json(os.path.join(self.path, "pages.json"), dict(self.etags))
+
+
+class Backfill:
+    def __init__(
+        self,
+        client: GitHubClient,
+        llm: LLMProvider,
+        state: str = "open",
+        concurrency: int = BACKFILL_CONCURRENCY,
+        limit: Optional[int] = None,
+        publish: bool = False,
+        analysis: bool = True,
+        flush_size: int = BACKFILL_FLUSH_SIZE,
+        deadline: Optional[float] = None,
+    ):
+        if state not in PR_STATES:
+            raise ValueError(f"state must be one of {PR_STATES}")
+        self.client = client
+        self.llm = llm
+        self.state = state
+        self.concurrency = max(concurrency, 1)
+        self.limit = limit
+        self.publish = publish
+        self.analysis = analysis
+        self.flush_size = max(flush_size, 1)
+        # time.monotonic() after which no new PRs are started
+        self.deadline = deadline
+        self.stats = {
+            "repositories": 0, "busy": 0, "repository_errors": 0, "listed": 0, "skipped": 0, "started": 0,
+            "reviewed": 0, "failed": 0, "suggestions": 0, "pages_not_modified": 0, "complete": True,
+        }
+
+    def _out_of_budget(self) -> bool:
+        if self.limit is not None and self.stats["started"] >= self.limit:
+            return True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.stats["complete"] = False
+            return True
+        return False
+
+    async def installation_repositories(self) -> List[str]:
+        os.makedirs(BACKFILL_DIR, exist_ok=True)
+        path = os.path.join(BACKFILL_DIR, "installation.json")
+        etags = _read_json(path, {})
+        names = [r["full_name"] async for page in self.client.list_installation_repositories(etags) for r in page]
+        _write_json(path, etags)
+        return names
+
+    async def run(self, repositories: List[str]) -> Dict[str, Any]:
+        started = time.monotonic()
+        not_modified = get_client_stats()["not_modified"]
+        for repository in repositories:
+            if self._out_of_budget():
+                break
+            try:
+                await self.run_repository(repository)
+            except Exception as e:
+                # A missing, archived or forbidden repository shouldn't stop the others
+                print(f"Backfill of {repository} failed: {e!r}")
+                self.stats["repository_errors"] += 1
+        if REVIEW_CONTEXT and COLLECT_TRAINING_DATA and self.stats["reviewed"]:
+            # Make the new reviews retrievable; a no-op if an update is already running
+            await asyncio.to_thread(get_review_index_store().update)
+        self.stats["pages_not_modified"] = get_client_stats()["not_modified"] - not_modified
+        self.stats["seconds"] = round(time.monotonic() - started, 1)
+        return self.stats
+
+    async def run_repository(self, repository: str):
+        owner, repo = repository.split("/", 1)
+        state = BackfillState(repository)
+        with state.locked() as acquired:
+            if not acquired:
+                print(f"Backfill of {repository} is already running elsewhere, skipping")
+                self.stats["busy"] += 1
+                return
+            self.stats["repositories"] += 1
+            queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency)
+            finished: List[Dict[str, Any]] = []
+
+            async def flush():
+                batch = finished[:]
+                finished.clear()
+                if batch:
+                    await asyncio.to_thread(self._write, state, batch)
+
+            async def work():
+                while (pr := await queue.get()) is not None:
+                    finished.append(await self.review(owner, repo, pr))
+                    if len(finished) >= self.flush_size:
+                        await flush()
+
+            workers = [asyncio.create_task(work()) for _ in range(self.concurrency)]
+            try:
+                async for page in self.client.list_pull_requests(owner, repo, self.state, state.etags, keep=_pr_summary):
+                    self.stats["listed"] += len(page)
+                    for pr in page:
+                        if not state.pending(pr):
+                            self.stats["skipped"] += 1
+                        elif not self._out_of_budget():
+                            self.stats["started"] += 1
+                            await queue.put(pr)
+                    if self._out_of_budget():
+                        break
+            finally:
+                for _ in workers:
+                    await queue.put(None)
+                await asyncio.gather(*workers)
+                await flush()
+                # Keep the page ETags even if nothing needed reviewing
+                await asyncio.to_thread(state.save)
+
+    async def review(self, owner: str, repo: str, pr: Dict[str, Any]) -> Dict[str, Any]:
+        """Review one PR; never raises, a failure is returned with status "failed"."""
+        repository = f"{owner}/{repo}"
+        number = pr["number"]
+        started = time.monotonic()
+        status, result, publisher = "failed", None, None
+        # (diff, review) of each model call, saved for training once the review has an id
+        batches: List[Any] = []
+        try:
+            file_context = {}
+            if self.analysis:
+                try:
+                    analysis = await get_analysis_engine().analyze_pr(self.client, owner, repo, number)
+                    file_context = {path: summarize_analysis(info) for path, info in analysis["files"].items()}
+                except Exception as e:
+                    print(f"Code analysis of {repository}#{number} failed, reviewing without it: {e}")
+            if self.publish and pr["state"] == "open":
+                publisher = ReviewPublisher(self.client, owner, repo, number, pr["head_sha"])
+                await publisher.start()
+            context_provider = None
+            if REVIEW_CONTEXT:
+                def context_provider(hunks):
+                    return get_review_index_store().context_for(repository, hunks)
+            pipeline = ReviewPipeline(
+                self.llm,
+                on_batch=(lambda diff, review: batches.append((diff, review))) if COLLECT_TRAINING_DATA else None,
+                on_file=publisher.add_file if publisher else None,
+                on_suggestion=publisher.on_suggestion if publisher else None,
+                context_provider=context_provider,
+            )
+            result = await pipeline.run(self.client.stream_pr_diff(owner, repo, number), file_context=file_context)
+            if publisher is not None:
+                await publisher.finish(result)
+            status = "completed"
+        except Exception as e:
+            print(f"Backfill review of {repository}#{number} failed: {e}")
+            if publisher is not None:
+                await publisher.abandon("The review failed.")
+        return {
+            "owner": owner,
+            "repo": repo,
+            "pull_request": pull_request_fields(pr),
+            "head_sha": pr["head_sha"],
+            "status": status,
+            "summary": result["summary"] if result else None,
+            "suggestions": result["suggestions"] if result else [],
+            "duration": time.monotonic() - started,
+            "batches": batches,
+        }
+
+    def _write(self, state: BackfillState, batch: List[Dict[str, Any]]):
+        db = SessionLocal()
+        try:
+            review_ids = save_reviews(db, batch)
+        except Exception as e:
+            # Not checkpointed either, so the next run reviews these again
+            print(f"Failed to write {len(batch)} backfilled reviews: {e}")
+            db.rollback()
+            return
+        finally:
+            db.close()
+        if COLLECT_TRAINING_DATA:
+            collector = get_collector()
+            for review_id, review in zip(review_ids, batch):
+                for diff, batch_review in review["batches"]:
+                    collector.save_interaction(
+                        diff, batch_review, review_id=review_id, repository=f"{review['owner']}/{review['repo']}"
+                    )
+        state.record(batch)
+        for review in batch:
+            self.stats["reviewed" if review["status"] == "completed" else "failed"] += 1
+            self.stats["suggestions"] += len(review["suggestions"])
+        print(f"Backfill: {self.stats['reviewed']} reviewed, {self.stats['failed']} failed so far")
+
+
+async def run_backfill(
+    repositories: Optional[List[str]] = None,
+    installation: bool = False,
+    token: Optional[str] = None,
+    **options,
+) -> Dict[str, Any]:
+    """Backfill the given repositories and/or every repository of the installation; options go to Backfill."""
+    token = token or os.getenv("GITHUB_TOKEN")
+    if not token:
+        raise ValueError("GITHUB_TOKEN is not set")
+    backfill = Backfill(GitHubClient(token), get_llm_provider(), **options)
+    names = list(repositories or [])
+    if installation:
+        names += [name for name in await backfill.installation_repositories() if name not in names]
+    return await backfill.run(names)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Review existing pull requests in bulk")
+    parser.add_argument("repositories", nargs="*", help="owner/repo")
+    parser.add_argument("--installation", action="store_true", help="every repository the token's installation can access")
+    parser.add_argument("--state", choices=PR_STATES, default="open")
+    parser.add_argument("--concurrency", type=int, default=BACKFILL_CONCURRENCY)
+    parser.add_argument("--limit", type=int, help="review at most this many PRs")
+    parser.add_argument("--publish", action="store_true", help="post reviews on open PRs")
+    parser.add_argument("--skip-analysis", action="store_true", help="review without code analysis context")
+    args = parser.parse_args(argv)
+    if not args.repositories and not args.installation:
+        parser.error("give repositories or --installation")
+    if any("/" not in name for name in args.repositories):
+        parser.error("repositories are owner/repo")
+
+    async def backfill():
+        try:
+            return await run_backfill(
+                args.repositories, args.installation, state=args.state, concurrency=args.concurrency,
+                limit=args.limit, publish=args.publish, analysis=not args.skip_analysis,
+            )
+        finally:
+            await close_http_client()
+
+    print(json.dumps(asyncio.run(backfill()), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,38 @@
+"""
+The Celery application on its own, so the API can enqueue reviews by task
+name without importing the worker and everything the review path needs.
+"""
+import os
+
+from celery import Celery
+
+CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
+CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
+
+celery = Celery("app.worker", broker=CELERY_BROKER_URL, backend=CELERY_RESULT_BACKEND)
+# Reviews are I/O bound: a thread pool sharing one event loop keeps many
+# reviews in flight per process instead of one per prefork child.
+celery.conf.worker_pool = os.getenv("CELERY_WORKER_POOL", "threads")
+celery.conf.worker_concurrency = int(os.getenv("CELERY_WORKER_CONCURRENCY", "32"))
+# A review holds its slot for minutes of LLM time: reserve one task per slot
+# and ack only when done, so queued work stays visible to idle workers and
+# priorities decide what runs next.
+celery.conf.worker_prefetch_multiplier = int(os.getenv("CELERY_PREFETCH_MULTIPLIER", "1"))
+celery.conf.task_acks_late = True
+celery.conf.broker_transport_options = {
+    "queue_order_strategy": "priority",
+    "priority_steps": list(range(10)),
+    "sep": ":",
+    "visibility_timeout": int(os.getenv("CELERY_VISIBILITY_TIMEOUT", "3600")),
+}
+# Reviews wait out their debounce in a Redis delay set, not on a worker; beat
+# (`celery beat`, or `worker -B`) moves the due ones onto the queue this often
+REVIEW_DISPATCH_SECONDS = float(os.getenv("REVIEW_DISPATCH_SECONDS", "1"))
+celery.conf.beat_schedule = {
+    "dispatch-delayed-reviews": {
+        "task": "dispatch_delayed_reviews",
+        "schedule": REVIEW_DISPATCH_SECONDS,
+        # Ahead of every review, and dropped rather than piled up if workers are busy
+        "options": {"priority": 0, "expires": max(REVIEW_DISPATCH_SECONDS * 5, 5)},
+    },
+}
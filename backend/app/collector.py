@@ -1,29 +1,121 @@
+import fcntl
 import json
 import os
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from .segment_log import BufferedWriter, Condition, SegmentStore
+
 
 class DataCollector:
+    """
+    Training interactions are kept in a segmented, compressed log under
+    `<data_dir>/log`. Writes are buffered and flushed in the background;
+    reads stream from the log and never load the whole dataset.
+    """
+
     def __init__(self, data_dir: str = "data/fine_tuning"):
         self.data_dir = data_dir
         os.makedirs(data_dir, exist_ok=True)
-        self.file_path = os.path.join(data_dir, "reviews.jsonl")
+        self.store = SegmentStore(os.path.join(data_dir, "log"))
+        self.writer = BufferedWriter(self.store)
+        # Pre-segment data lived in one JSONL file
+        self.legacy_path = os.path.join(data_dir, "reviews.jsonl")
+        self._import_legacy()
+
+    def _import_legacy(self):
+        """
+        Move reviews.jsonl into the log. Progress is saved after every batch,
+        so an import that was interrupted resumes where it stopped (repeating
+        at most the batch in flight); lines that aren't JSON objects are
+        skipped and counted.
+        """
+        importing = self.legacy_path + ".importing"
+        progress_path = importing + ".offset"
+        if not os.path.exists(self.legacy_path) and not os.path.exists(importing):
+            return
+        with open(self.legacy_path + ".lock", "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # another worker is importing
+            if not os.path.exists(importing):
+                try:
+                    os.rename(self.legacy_path, importing)
+                except FileNotFoundError:
+                    return  # another worker already finished
+            offset = 0
+            if os.path.exists(progress_path):
+                with open(progress_path) as f:
+                    offset = int(f.read().strip() or 0)
+
+            imported = skipped = 0
+            batch: List[Dict[str, Any]] = []
+
+            def save_batch():
+                nonlocal batch, imported
+                self.store.append_many(batch)
+                imported += len(batch)
+                batch = []
+                with open(progress_path + ".tmp", "w") as f:
+                    f.write(str(offset))
+                os.replace(progress_path + ".tmp", progress_path)
+
+            with open(importing, "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    offset += len(line)
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        record = None
+                    if not isinstance(record, dict):
+                        skipped += 1
+                        continue
+                    batch.append(record)
+                    if len(batch) >= 1000:
+                        save_batch()
+            save_batch()
+            os.rename(importing, self.legacy_path + ".imported")
+            os.remove(progress_path)
+        print(f"Imported {imported} records from {self.legacy_path} into {self.store.path}, skipped {skipped} malformed lines")
 
-    def save_interaction(self, code_diff: str, review: Dict[str, Any], feedback: Dict[str, Any] = None):
+    def save_interaction(
+        self,
+        code_diff: str,
+        review: Dict[str, Any],
+        feedback: Dict[str, Any] = None,
+        review_id: Optional[int] = None,
+        repository: Optional[str] = None,
+    ):
         entry = {
             "timestamp": datetime.utcnow().isoformat(),
+            "review_id": review_id,
+            "repository": repository,
             "diff": code_diff,
             "review": review,
             "feedback": feedback
         }
-        
-        with open(self.file_path, "a") as f:
-            f.write(json.dumps(entry) + "\n")
+        self.writer.append(entry)
+
+    def iter_dataset(
+        self, where: Optional[List[Condition]] = None, start_offset: int = 0
+    ) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """Stream (offset, entry) pairs, e.g. where=[("feedback.rating", ">=", 4)]."""
+        self.writer.flush()
+        return self.store.iter_records(start_offset, where)
 
     def get_dataset(self):
-        dataset = []
-        if os.path.exists(self.file_path):
-            with open(self.file_path, "r") as f:
-                for line in f:
-                    dataset.append(json.loads(line))
-        return dataset
+        return [entry for _, entry in self.iter_dataset()]
+
+
+_collector: Optional[DataCollector] = None
+
+
+def get_collector() -> DataCollector:
+    global _collector
+    if _collector is None:
+        _collector = DataCollector()
+    return _collector
@@ -0,0 +1,326 @@
+import math
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import case, func
+from sqlalchemy.orm import Session
+
+from .models import PullRequest, Repository, Review, ReviewStat, Suggestion
+from .schemas import SEVERITIES, Suggestion as SuggestionSchema
+
+DURATION_BUCKETS = (1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, math.inf)
+
+
+def _insert(db: Session):
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def duration_bucket(seconds: float) -> float:
+    for bound in DURATION_BUCKETS:
+        if seconds <= bound:
+            return bound
+    return math.inf
+
+
+def _severity_column(severity: str) -> str:
+    return f"{severity}_count"
+
+
+def record_review_stats(db: Session, repository: str, status: str, severities: List[str], duration: float, commit: bool = True):
+    """Fold one finished review into the review_stats rollup with a single upsert."""
+    record_many_review_stats(db, [(repository, status, severities, duration)], commit=commit)
+
+
+def record_many_review_stats(db: Session, reviews: List[Tuple[str, str, List[str], float]], commit: bool = True):
+    """
+    Fold (repository, status, severity of each stored suggestion, duration)
+    of many finished reviews into the rollup, pre-aggregated so each row is
+    upserted once.
+    """
+    counters = ["review_count", "suggestion_count", "duration_sum"] + [_severity_column(s) for s in SEVERITIES]
+    rows: Dict[Tuple[str, str, float], Dict[str, Any]] = {}
+    for repository, status, severities, duration in reviews:
+        bucket = duration_bucket(duration)
+        row = rows.setdefault((repository, status, bucket), {
+            "repository": repository,
+            "status": status,
+            "duration_bucket": bucket,
+            **dict.fromkeys(counters, 0),
+        })
+        row["review_count"] += 1
+        row["suggestion_count"] += len(severities)
+        row["duration_sum"] += duration
+        for severity in severities:
+            row[_severity_column(severity)] += 1
+    if rows:
+        insert = _insert(db)
+        stmt = insert(ReviewStat).values(list(rows.values()))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ReviewStat.repository, ReviewStat.status, ReviewStat.duration_bucket],
+            set_={
+                **{name: getattr(ReviewStat, name) + getattr(stmt.excluded, name) for name in counters},
+                "updated_at": func.now(),
+            },
+        )
+        db.execute(stmt)
+    if commit:
+        db.commit()
+
+
+def upsert_repositories(db: Session, repositories: List[Dict[str, Any]]) -> Dict[Tuple[str, str], int]:
+    """
+    Insert or update many repositories in one INSERT ... ON CONFLICT statement.
+    Returns their ids keyed by (owner, name).
+    """
+    rows = {}
+    for repo in repositories:
+        rows[(repo["owner"], repo["name"])] = {
+            "owner": repo["owner"],
+            "name": repo["name"],
+            "url": repo.get("url"),
+            "platform": repo.get("platform", "github"),
+        }
+    if not rows:
+        return {}
+
+    insert = _insert(db)
+    stmt = insert(Repository).values(list(rows.values()))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Repository.owner, Repository.name],
+        set_={"url": func.coalesce(stmt.excluded.url, Repository.url)},
+    ).returning(Repository.id, Repository.owner, Repository.name)
+    return {(owner, name): repo_id for repo_id, owner, name in db.execute(stmt)}
+
+
+def upsert_pull_requests(db: Session, pull_requests: List[Dict[str, Any]]) -> Dict[Tuple[int, int], int]:
+    """
+    Insert or update many pull requests in one statement; fields passed as None
+    keep their stored value. Returns ids keyed by (repository_id, pr_number).
+    """
+    rows = {}
+    for pr in pull_requests:
+        rows[(pr["repository_id"], pr["pr_number"])] = {
+            "repository_id": pr["repository_id"],
+            "pr_number": pr["pr_number"],
+            "title": pr.get("title"),
+            "description": pr.get("description"),
+            "status": pr.get("status"),
+        }
+    if not rows:
+        return {}
+
+    insert = _insert(db)
+    stmt = insert(PullRequest).values(list(rows.values()))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[PullRequest.repository_id, PullRequest.pr_number],
+        set_={
+            "title": func.coalesce(stmt.excluded.title, PullRequest.title),
+            "description": func.coalesce(stmt.excluded.description, PullRequest.description),
+            "status": func.coalesce(stmt.excluded.status, PullRequest.status),
+            "updated_at": func.now(),
+        },
+    ).returning(PullRequest.id, PullRequest.repository_id, PullRequest.pr_number)
+    return {(repo_id, number): pr_id for pr_id, repo_id, number in db.execute(stmt)}
+
+
+def pull_request_fields(pr: Dict[str, Any]) -> Dict[str, Any]:
+    """Map a GitHub pull request payload onto PullRequest columns."""
+    status = pr.get("state")
+    if pr.get("merged") or pr.get("merged_at"):
+        status = "merged"
+    return {
+        "pr_number": pr["number"],
+        "title": pr.get("title"),
+        "description": pr.get("body"),
+        "status": status,
+    }
+
+
+def start_review(db: Session, owner: str, repo: str, pr_number: int, url: Optional[str] = None) -> int:
+    """
+    Make sure the repository and PR rows exist and open a pending review for
+    them: single-row upserts, one review per transaction. Batched writes are
+    for save_reviews (backfill).
+    """
+    repo_id = upsert_repositories(db, [{"owner": owner, "name": repo, "url": url}])[(owner, repo)]
+    pr_id = upsert_pull_requests(db, [{"repository_id": repo_id, "pr_number": pr_number}])[(repo_id, pr_number)]
+    review = Review(pull_request_id=pr_id, status="pending")
+    db.add(review)
+    db.commit()
+    return review.id
+
+
+def finish_review(
+    db: Session,
+    review_id: int,
+    repository: str,
+    status: str,
+    summary: Optional[str],
+    suggestions: List[Dict[str, Any]],
+    duration: float,
+    pull_request: Optional[Dict[str, Any]] = None,
+):
+    """Close out a pending review and fold it into the rollup in one transaction."""
+    repository_id = (
+        db.query(PullRequest.repository_id)
+        .join(Review, Review.pull_request_id == PullRequest.id)
+        .filter(Review.id == review_id)
+        .scalar()
+    )
+    if pull_request is not None and repository_id is not None:
+        upsert_pull_requests(db, [dict(pull_request, repository_id=repository_id)])
+    db.query(Review).filter(Review.id == review_id).update({
+        "status": status,
+        "summary": summary,
+        "duration_seconds": duration,
+        "completed_at": datetime.now(timezone.utc),
+    })
+    # Only suggestions that pass validation are stored, and only those are counted
+    rows = suggestion_rows(review_id, repository_id, suggestions)
+    if rows and repository_id is not None:
+        db.execute(_insert(db)(Suggestion), rows)
+    record_review_stats(db, repository, status, [row["severity"] for row in rows], duration, commit=False)
+    db.commit()
+
+
+def save_reviews(db: Session, reviews: List[Dict[str, Any]]) -> List[int]:
+    """
+    Write many finished reviews in one transaction: repositories and pull
+    requests with one upsert each, then the reviews, their suggestions and the
+    rollup. Each review has owner, repo, pull_request (pull_request_fields),
+    status, summary, suggestions and duration. Returns the review ids in order.
+    """
+    if not reviews:
+        return []
+    repo_ids = upsert_repositories(db, [
+        {"owner": r["owner"], "name": r["repo"], "url": f"https://github.com/{r['owner']}/{r['repo']}"} for r in reviews
+    ])
+    pr_ids = upsert_pull_requests(db, [
+        dict(r["pull_request"], repository_id=repo_ids[(r["owner"], r["repo"])]) for r in reviews
+    ])
+    completed_at = datetime.now(timezone.utc)
+    review_rows = []
+    for r in reviews:
+        repository_id = repo_ids[(r["owner"], r["repo"])]
+        review_rows.append({
+            "pull_request_id": pr_ids[(repository_id, r["pull_request"]["pr_number"])],
+            "status": r["status"],
+            "summary": r["summary"],
+            "duration_seconds": r["duration"],
+            "completed_at": completed_at,
+        })
+    review_ids = list(db.scalars(
+        _insert(db)(Review).returning(Review.id, sort_by_parameter_order=True), review_rows
+    ))
+    rows = []
+    stats = []
+    for review_id, r in zip(review_ids, reviews):
+        stored = suggestion_rows(review_id, repo_ids[(r["owner"], r["repo"])], r["suggestions"])
+        rows.extend(stored)
+        stats.append((f"{r['owner']}/{r['repo']}", r["status"], [row["severity"] for row in stored], r["duration"]))
+    if rows:
+        db.execute(_insert(db)(Suggestion), rows)
+    record_many_review_stats(db, stats, commit=False)
+    db.commit()
+    return review_ids
+
+
+def suggestion_rows(review_id: Optional[int], repository_id: Optional[int], suggestions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Validated suggestions table rows; invalid suggestions are skipped."""
+    rows = []
+    for raw in suggestions:
+        try:
+            suggestion = SuggestionSchema.model_validate(raw)
+        except ValidationError:
+            continue
+        rows.append({"review_id": review_id, "repository_id": repository_id, **suggestion.model_dump()})
+    return rows
+
+
+def _bucket_label(bound: float) -> str:
+    return "+Inf" if math.isinf(bound) else f"{bound:g}"
+
+
+def get_metrics_summary(db: Session) -> Dict[str, Any]:
+    """Dashboard metrics computed from the rollup table, independent of the number of reviews."""
+    totals = db.query(
+        func.coalesce(func.sum(ReviewStat.review_count), 0),
+        func.coalesce(func.sum(ReviewStat.suggestion_count), 0),
+        func.coalesce(func.sum(ReviewStat.duration_sum), 0.0),
+        *(func.coalesce(func.sum(getattr(ReviewStat, _severity_column(s))), 0) for s in SEVERITIES),
+    ).one()
+    total_reviews, issues_found, duration_sum = int(totals[0]), int(totals[1]), float(totals[2])
+    by_severity = {severity: int(count) for severity, count in zip(SEVERITIES, totals[3:])}
+
+    histogram = dict.fromkeys((_bucket_label(b) for b in DURATION_BUCKETS), 0)
+    for bound, count in db.query(ReviewStat.duration_bucket, func.sum(ReviewStat.review_count)).group_by(ReviewStat.duration_bucket):
+        histogram[_bucket_label(bound)] = int(count)
+
+    by_repository = {
+        repository: {"reviews": int(count), "issues": int(issues)}
+        for repository, count, issues in db.query(
+            ReviewStat.repository, func.sum(ReviewStat.review_count), func.sum(ReviewStat.suggestion_count)
+        ).group_by(ReviewStat.repository)
+    }
+    by_status = {
+        status: int(count)
+        for status, count in db.query(ReviewStat.status, func.sum(ReviewStat.review_count)).group_by(ReviewStat.status)
+    }
+
+    avg = duration_sum / total_reviews if total_reviews else 0.0
+    return {
+        "total_reviews": total_reviews,
+        "issues_found": issues_found,
+        "avg_review_time": f"{avg:.1f}s",
+        "duration_histogram": histogram,
+        "by_repository": by_repository,
+        "by_status": by_status,
+        "by_severity": by_severity,
+    }
+
+
+def _severity_counts():
+    return [func.count().label("total")] + [
+        func.sum(case((Suggestion.severity == severity, 1), else_=0)).label(severity) for severity in SEVERITIES
+    ]
+
+
+def _issue_counts(row) -> Dict[str, Any]:
+    return {"total": int(row.total), "by_severity": {severity: int(getattr(row, severity) or 0) for severity in SEVERITIES}}
+
+
+def get_issue_summary(db: Session, owner: Optional[str] = None, name: Optional[str] = None, limit: int = 20) -> Dict[str, Any]:
+    """
+    Suggestion counts per repository and for the files with the most of them,
+    broken down by severity, aggregated in SQL from the suggestions table.
+    With owner/name, only that repository's files are listed.
+    """
+    repositories = (
+        db.query(Repository.owner, Repository.name, *_severity_counts())
+        .join(Suggestion, Suggestion.repository_id == Repository.id)
+        .group_by(Repository.id, Repository.owner, Repository.name)
+        .order_by(func.count().desc())
+    )
+    files = (
+        db.query(Repository.owner, Repository.name, Suggestion.file, *_severity_counts())
+        .join(Repository, Repository.id == Suggestion.repository_id)
+        .group_by(Suggestion.repository_id, Repository.owner, Repository.name, Suggestion.file)
+        .order_by(func.count().desc())
+    )
+    if name is not None:
+        filters = [Repository.name == name] + ([Repository.owner == owner] if owner is not None else [])
+        repositories = repositories.filter(*filters)
+        files = files.filter(*filters)
+    return {
+        "repositories": [
+            {"repository": f"{row.owner}/{row.name}", **_issue_counts(row)} for row in repositories.limit(limit)
+        ],
+        "files": [
+            {"repository": f"{row.owner}/{row.name}", "file": row.file, **_issue_counts(row)} for row in files.limit(limit)
+        ],
+    }
@@ -0,0 +1,215 @@
+import hashlib
+import re
+from dataclasses import dataclass, field
+from typing import AsyncIterable, AsyncIterator, Callable, Iterable, Iterator, List, Optional, Set, Tuple
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@dataclass
+class Hunk:
+    path: str
+    file_header: str
+    header: str
+    new_start: int
+    new_count: int
+    lines: List[str] = field(default_factory=list)
+
+    @property
+    def text(self) -> str:
+        return "\n".join([self.header] + self.lines)
+
+    @property
+    def new_range(self) -> Tuple[int, int]:
+        return self.new_start, self.new_start + max(self.new_count, 1) - 1
+
+    def changed_ranges(self) -> List[Tuple[int, int]]:
+        return changed_ranges(self.new_start, self.lines)
+
+    def fingerprint(self) -> str:
+        """
+        Content hash of the hunk that survives rebases: line numbers from the
+        @@ header and whitespace-only differences don't change the key.
+        """
+        digest = hashlib.sha256(self.path.encode())
+        for line in self.lines:
+            digest.update(b"\n")
+            digest.update(_WHITESPACE.sub(" ", line).strip().encode())
+        return digest.hexdigest()
+
+
+def changed_ranges(new_start: int, lines: Iterable[str]) -> List[Tuple[int, int]]:
+    """
+    New-file line ranges touched by a hunk body. Added lines count as-is; a
+    deletion marks the line it was removed in front of.
+    """
+    ranges: List[Tuple[int, int]] = []
+    line_no = new_start
+    for line in lines:
+        if line.startswith("+"):
+            touched, line_no = line_no, line_no + 1
+        elif line.startswith("-"):
+            touched = line_no
+        else:
+            if not line.startswith("\\"):
+                line_no += 1
+            continue
+        if ranges and ranges[-1][1] >= touched - 1:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], touched))
+        else:
+            ranges.append((touched, touched))
+    return ranges
+
+
+def patch_changed_ranges(patch: str) -> List[Tuple[int, int]]:
+    """Changed line ranges of a single-file patch, as returned by the PR files API."""
+    ranges: List[Tuple[int, int]] = []
+    new_start, body = None, []
+    for line in patch.splitlines() + ["@@"]:
+        if line.startswith("@@"):
+            if new_start is not None:
+                ranges.extend(changed_ranges(new_start, body))
+            match = HUNK_HEADER.match(line)
+            new_start, body = (int(match.group(3)), []) if match else (None, [])
+        elif new_start is not None:
+            body.append(line)
+    return ranges
+
+
+class DiffParser:
+    """
+    Incremental unified diff parser (GitHub's .diff media type). Lines are fed
+    one at a time and completed hunks are handed back as soon as they end, so
+    only the hunk currently being read is held in memory.
+
+    `include` decides per file path whether its hunks are kept at all; hunks
+    longer than `max_hunk_lines` are truncated and files stop contributing
+    hunks after `max_file_lines` changed lines (0 disables either limit).
+    """
+
+    def __init__(
+        self,
+        include: Optional[Callable[[str], bool]] = None,
+        max_hunk_lines: int = 0,
+        max_file_lines: int = 0,
+    ):
+        self.include = include
+        self.max_hunk_lines = max_hunk_lines
+        self.max_file_lines = max_file_lines
+        self.skipped_files: Set[str] = set()
+        self.truncated_hunks = 0
+        self._file_header: List[str] = []
+        self._old_path = self._new_path = ""
+        self._file_lines = 0
+        self._skip_file = False
+        self._hunk: Optional[Hunk] = None
+
+    def feed(self, line: str) -> Optional[Hunk]:
+        line = line.rstrip("\r\n")
+        hunk = self._hunk
+
+        if line.startswith("diff --git "):
+            self._hunk = None
+            self._file_header = [line]
+            self._old_path = self._new_path = ""
+            self._file_lines = 0
+            self._skip_file = False
+            return hunk
+        if hunk is None and line.startswith("--- "):
+            self._file_header.append(line)
+            self._old_path = line[4:]
+            return None
+        if hunk is None and line.startswith("+++ "):
+            self._file_header.append(line)
+            self._new_path = line[4:]
+            return None
+        if line.startswith("@@"):
+            match = HUNK_HEADER.match(line)
+            if not match:
+                return None
+            self._hunk = self._start_hunk(line, match)
+            return hunk
+        if hunk is not None:
+            if self.max_hunk_lines and len(hunk.lines) >= self.max_hunk_lines:
+                if len(hunk.lines) == self.max_hunk_lines:
+                    hunk.lines.append("\\ (hunk truncated)")
+                    self.truncated_hunks += 1
+            else:
+                hunk.lines.append(line)
+        elif self._file_header and not self._skip_file:
+            self._file_header.append(line)
+        return None
+
+    def close(self) -> Optional[Hunk]:
+        hunk, self._hunk = self._hunk, None
+        return hunk
+
+    def _start_hunk(self, header: str, match: "re.Match") -> Optional[Hunk]:
+        path = self._new_path if self._new_path != "/dev/null" else self._old_path
+        if path.startswith(("a/", "b/")):
+            path = path[2:]
+        if self._skip_file:
+            return None
+
+        new_start = int(match.group(3))
+        new_count = int(match.group(4)) if match.group(4) is not None else 1
+        old_count = int(match.group(2)) if match.group(2) is not None else 1
+        self._file_lines += new_count + old_count
+        if (self.include is not None and not self.include(path)) or (
+            self.max_file_lines and self._file_lines > self.max_file_lines
+        ):
+            self._skip_file = True
+            self.skipped_files.add(path)
+            return None
+
+        return Hunk(
+            path=path,
+            file_header="\n".join(self._file_header),
+            header=header,
+            new_start=new_start,
+            new_count=new_count,
+        )
+
+
+def iter_hunks(lines: Iterable[str], parser: Optional[DiffParser] = None) -> Iterator[Hunk]:
+    parser = parser or DiffParser()
+    for line in lines:
+        hunk = parser.feed(line)
+        if hunk:
+            yield hunk
+    hunk = parser.close()
+    if hunk:
+        yield hunk
+
+
+async def aiter_hunks(lines: AsyncIterable[str], parser: Optional[DiffParser] = None) -> AsyncIterator[Hunk]:
+    parser = parser or DiffParser()
+    async for line in lines:
+        hunk = parser.feed(line)
+        if hunk:
+            yield hunk
+    hunk = parser.close()
+    if hunk:
+        yield hunk
+
+
+def estimate_tokens(hunk: Hunk) -> int:
+    # ~4 characters per token is close enough for budgeting prompts
+    return (len(hunk.header) + sum(len(line) + 1 for line in hunk.lines)) // 4 + 1
+
+
+def split_hunks(diff: str) -> List[Hunk]:
+    return list(iter_hunks(diff.splitlines()))
+
+
+def render_diff(hunks: Iterable[Hunk]) -> str:
+    """Reassemble hunks into a unified diff, emitting each file header once."""
+    out = []
+    current = None
+    for hunk in hunks:
+        if hunk.file_header != current:
+            current = hunk.file_header
+            out.append(current)
+        out.append(hunk.text)
+    return "\n".join(out) + "\n"
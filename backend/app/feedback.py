@@ -0,0 +1,243 @@
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import exc, insert
+
+from .collector import DataCollector
+from .database import SessionLocal
+from .models import Feedback, Review
+from .retrieval import REVIEW_INDEX_REJECT_RATING, reject_reviews
+
+FEEDBACK_BATCH_SIZE = int(os.getenv("FEEDBACK_BATCH_SIZE", "200"))
+FEEDBACK_FLUSH_MS = int(os.getenv("FEEDBACK_FLUSH_MS", "250"))
+FEEDBACK_QUEUE_SIZE = int(os.getenv("FEEDBACK_QUEUE_SIZE", "10000"))
+# Wait before retrying a batch that failed on a connection error
+FEEDBACK_RETRY_SECONDS = float(os.getenv("FEEDBACK_RETRY_SECONDS", "5"))
+# Retries of a batch that failed on a connection error before it is split up
+FEEDBACK_MAX_RETRIES = int(os.getenv("FEEDBACK_MAX_RETRIES", "3"))
+# Records that could not be written, one JSON object per line
+FEEDBACK_DEAD_LETTER_PATH = os.getenv("FEEDBACK_DEAD_LETTER_PATH", "data/feedback_dead_letter.jsonl")
+# Feedback matched against the collector log per scan of it
+FEEDBACK_JOIN_SIZE = int(os.getenv("FEEDBACK_JOIN_SIZE", "100000"))
+
+# Errors worth retrying the whole batch for; anything else is down to the records
+_TRANSIENT_ERRORS = (exc.OperationalError, exc.InterfaceError, exc.TimeoutError, OSError)
+
+
+def write_feedback(records: List[Dict[str, Any]]) -> int:
+    """Insert a batch of feedback in one statement, dropping records for unknown reviews."""
+    db = SessionLocal()
+    try:
+        review_ids = {r["review_id"] for r in records}
+        known = {review_id for (review_id,) in db.query(Review.id).filter(Review.id.in_(review_ids))}
+        rows = [r for r in records if r["review_id"] in known]
+        if len(rows) < len(records):
+            print(f"Dropped {len(records) - len(rows)} feedback records for unknown reviews")
+        if rows:
+            db.execute(insert(Feedback), rows)
+            db.commit()
+            rejected = [r["review_id"] for r in rows if r["rating"] <= REVIEW_INDEX_REJECT_RATING]
+            if rejected:
+                # The rows are committed; a failure here must not make the queue write them again
+                try:
+                    reject_reviews(rejected)
+                except Exception as e:
+                    print(f"Failed to drop rejected reviews from the index: {e}")
+        return len(rows)
+    finally:
+        db.close()
+
+
+class FeedbackQueue:
+    """
+    Buffers feedback submitted to the API and writes it from a background
+    task, FEEDBACK_BATCH_SIZE records or FEEDBACK_FLUSH_MS after the first
+    queued record at a time, so the endpoint never waits on the database.
+    A batch that fails on a connection error is retried every
+    FEEDBACK_RETRY_SECONDS, up to FEEDBACK_MAX_RETRIES times, before anything
+    else is written; meanwhile the queue fills up and submit() starts
+    refusing feedback. Once out of retries the batch goes to
+    FEEDBACK_DEAD_LETTER_PATH. A batch that fails for any other reason is
+    bisected: the halves that write are kept and the records that fail on
+    their own are dead-lettered.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = FEEDBACK_BATCH_SIZE,
+        flush_ms: int = FEEDBACK_FLUSH_MS,
+        max_size: int = FEEDBACK_QUEUE_SIZE,
+        retry_seconds: float = FEEDBACK_RETRY_SECONDS,
+        max_retries: int = FEEDBACK_MAX_RETRIES,
+        dead_letter_path: str = FEEDBACK_DEAD_LETTER_PATH,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.max_size = max_size
+        self.retry_seconds = retry_seconds
+        self.max_retries = max_retries
+        self.dead_letter_path = dead_letter_path
+        self.stats = {"queued": 0, "written": 0, "batches": 0, "failed": 0, "dead_lettered": 0}
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # Batch the last write failed on, written before anything newer
+        self._retry: List[Dict[str, Any]] = []
+        self._attempts = 0
+
+    def start(self):
+        self._queue = asyncio.Queue(self.max_size)
+        self._task = asyncio.create_task(self._run())
+
+    def submit(self, record: Dict[str, Any]) -> bool:
+        """Queue a record; False when the queue is full (or not started)."""
+        if self._queue is None:
+            return False
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            return False
+        self.stats["queued"] += 1
+        return True
+
+    async def _run(self):
+        while True:
+            if self._retry:
+                batch, self._retry = self._retry, []
+            else:
+                batch = [await self._queue.get()]
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+            error = await self._flush(batch)
+            if error is None:
+                self._attempts = 0
+            elif isinstance(error, _TRANSIENT_ERRORS) and self._attempts < self.max_retries:
+                self._attempts += 1
+                self._retry = batch
+                await asyncio.sleep(self.retry_seconds)
+            else:
+                self._attempts = 0
+                await self._salvage(batch, error)
+
+    async def _flush(self, batch: List[Dict[str, Any]]) -> Optional[Exception]:
+        """Write a batch; the error when it failed, else None."""
+        try:
+            self.stats["written"] += await asyncio.to_thread(write_feedback, batch)
+            self.stats["batches"] += 1
+            return None
+        except Exception as e:
+            self.stats["failed"] += len(batch)
+            print(f"Failed to write {len(batch)} feedback records: {e}")
+            return e
+
+    async def _salvage(self, batch: List[Dict[str, Any]], error: Exception):
+        """Write what can be written of a failed batch and dead-letter the rest."""
+        if isinstance(error, _TRANSIENT_ERRORS):
+            # The database is unreachable, not the records at fault
+            dead = [(record, repr(error)) for record in batch]
+        else:
+            dead = await self._split(batch, error)
+        if dead:
+            try:
+                await asyncio.to_thread(self._dead_letter, dead)
+                self.stats["dead_lettered"] += len(dead)
+                print(f"Dead-lettered {len(dead)} feedback records to {self.dead_letter_path}")
+            except OSError as e:
+                print(f"Lost {len(dead)} feedback records, dead-letter file not writable: {e}")
+
+    async def _split(self, batch: List[Dict[str, Any]], error: Exception) -> List[Tuple[Dict[str, Any], str]]:
+        if len(batch) == 1:
+            return [(batch[0], repr(error))]
+        dead = []
+        middle = len(batch) // 2
+        for half in (batch[:middle], batch[middle:]):
+            half_error = await self._flush(half)
+            if half_error is not None:
+                dead.extend(await self._split(half, half_error))
+        return dead
+
+    def _dead_letter(self, dead: List[Tuple[Dict[str, Any], str]]):
+        directory = os.path.dirname(self.dead_letter_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+            for record, error in dead:
+                f.write(json.dumps({"record": record, "error": error}) + "\n")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        pending, self._retry = self._retry, []
+        while self._queue is not None and not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            error = await self._flush(batch)
+            if error is not None:
+                # No time left to retry: keep what writes and dead-letter the rest
+                await self._salvage(batch, error)
+
+
+def iter_training_rows(
+    collector: DataCollector, min_rating: int = 4, after_id: int = 0, join_size: int = FEEDBACK_JOIN_SIZE
+) -> Iterator[Tuple[int, Iterator[Dict[str, Any]]]]:
+    """
+    Join feedback with the reviews it rates and the diffs they were given.
+    Feedback with id > `after_id` and rating >= `min_rating` is loaded up to
+    `join_size` records at a time and matched in one scan of the collector
+    log; each yields (last feedback id, rows), and the rows must be consumed
+    before the next group is read. Each row is {"diff", "review", "feedback"};
+    a review contributes one row per reviewed batch of hunks.
+    """
+    while True:
+        by_review: Dict[int, List[Dict[str, Any]]] = {}
+        loaded = 0
+        db = SessionLocal()
+        try:
+            while loaded < join_size:
+                page = (
+                    db.query(Feedback.id, Feedback.review_id, Feedback.rating, Feedback.comment)
+                    .join(Review, Review.id == Feedback.review_id)
+                    .filter(Feedback.id > after_id, Feedback.rating >= min_rating, Review.status == "completed")
+                    .order_by(Feedback.id)
+                    .limit(min(1000, join_size - loaded))
+                    .all()
+                )
+                if not page:
+                    break
+                for feedback_id, review_id, rating, comment in page:
+                    by_review.setdefault(review_id, []).append(
+                        {"rating": rating, "comment": comment, "review_id": review_id}
+                    )
+                loaded += len(page)
+                after_id = page[-1][0]
+        finally:
+            db.close()
+        if not loaded:
+            return
+        yield after_id, _join_rows(collector, by_review)
+        if loaded < join_size:
+            return
+
+
+def _join_rows(collector: DataCollector, by_review: Dict[int, List[Dict[str, Any]]]) -> Iterator[Dict[str, Any]]:
+    for _, entry in collector.iter_dataset(where=[("review_id", "in", set(by_review))]):
+        for feedback in by_review[entry["review_id"]]:
+            yield {"diff": entry["diff"], "review": entry["review"], "feedback": feedback}
+
+
+feedback_queue = FeedbackQueue()
@@ -1,34 +1,324 @@
+import asyncio
 import httpx
 import os
-from typing import Dict, Any, List
+import threading
+import time
+import weakref
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Callable, Dict, Any, List, Optional
+
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+GITHUB_MAX_CONNECTIONS = int(os.getenv("GITHUB_MAX_CONNECTIONS", "20"))
+GITHUB_MAX_KEEPALIVE = int(os.getenv("GITHUB_MAX_KEEPALIVE", "10"))
+GITHUB_KEEPALIVE_EXPIRY = float(os.getenv("GITHUB_KEEPALIVE_EXPIRY", "30"))
+GITHUB_REQUESTS_PER_SECOND = float(os.getenv("GITHUB_REQUESTS_PER_SECOND", "10"))
+GITHUB_BURST = int(os.getenv("GITHUB_BURST", "20"))
+GITHUB_MAX_RETRIES = int(os.getenv("GITHUB_MAX_RETRIES", "3"))
+# Longest a throttled request waits before its retry, whatever the headers say
+GITHUB_MAX_RETRY_SECONDS = float(os.getenv("GITHUB_MAX_RETRY_SECONDS", "300"))
+
+try:
+    import h2  # noqa: F401
+    HTTP2_ENABLED = os.getenv("GITHUB_HTTP2", "true").lower() == "true"
+except ImportError:
+    HTTP2_ENABLED = False
+
+
+class RateLimiter:
+    """
+    Process-wide token bucket for GitHub API calls.
+
+    The refill rate starts at GITHUB_REQUESTS_PER_SECOND and is lowered to
+    whatever the X-RateLimit-Remaining / X-RateLimit-Reset headers say we can
+    sustain until the window resets. Retry-After (secondary rate limits) pauses
+    the bucket entirely and halves the rate; successful responses recover it
+    gradually. Reservations are computed under a thread lock so the limiter is
+    safe to share between event loops and Celery threads.
+    """
+
+    def __init__(self, rate: float = GITHUB_REQUESTS_PER_SECOND, burst: int = GITHUB_BURST):
+        self.base_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.remaining: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take one token and return how long the caller must wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+            return max(wait, self.paused_until - now)
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.rate = max(self.rate / 2, 0.1)
+
+    def update(self, headers: httpx.Headers):
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset = headers.get("X-RateLimit-Reset")
+        with self._lock:
+            # Additive recovery towards the configured rate after a backoff
+            rate = min(self.base_rate, self.rate + self.base_rate * 0.1)
+            if remaining is not None and reset is not None:
+                self.remaining = int(remaining)
+                window = max(float(reset) - time.time(), 1.0)
+                if self.remaining <= 0:
+                    self.paused_until = max(self.paused_until, time.monotonic() + window)
+                else:
+                    rate = min(rate, self.remaining / window)
+            self.rate = max(rate, 0.1)
+
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, float] = {
+            "requests": 0,
+            "connections_opened": 0,
+            "connections_reused": 0,
+            "throttle_waits": 0,
+            "throttle_wait_seconds": 0.0,
+            "rate_limited": 0,
+            "retries": 0,
+            "not_modified": 0,
+        }
+
+    def incr(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] += value
+
+
+rate_limiter = RateLimiter()
+stats = _Stats()
+
+# httpx clients are bound to the event loop they were first used on, so the
+# pool is shared per loop (one per worker process in practice).
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+
+def get_http_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            http2=HTTP2_ENABLED,
+            limits=httpx.Limits(
+                max_connections=GITHUB_MAX_CONNECTIONS,
+                max_keepalive_connections=GITHUB_MAX_KEEPALIVE,
+                keepalive_expiry=GITHUB_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(30.0, connect=10.0),
+        )
+        _clients[loop] = client
+    return client
+
+
+async def close_http_client():
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def get_client_stats() -> Dict[str, Any]:
+    with stats._lock:
+        result = dict(stats.counters)
+    result["current_rate"] = round(rate_limiter.rate, 3)
+    result["rate_limit_remaining"] = rate_limiter.remaining
+    return result
+
+
+def _retry_after(value: str) -> Optional[float]:
+    """Retry-After as seconds from now: either delay-seconds or an HTTP-date. None if it doesn't parse."""
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def _retry_delay(response: httpx.Response, attempt: int) -> Optional[float]:
+    """Seconds to wait before retrying a throttled response, or None if it isn't one."""
+    if response.status_code not in (403, 429):
+        return None
+    retry_after = _retry_after(response.headers.get("Retry-After", ""))
+    if retry_after is not None:
+        return min(retry_after, GITHUB_MAX_RETRY_SECONDS)
+    if response.headers.get("X-RateLimit-Remaining") == "0":
+        reset = response.headers.get("X-RateLimit-Reset")
+        if reset is not None:
+            return min(max(float(reset) - time.time(), 1.0), GITHUB_MAX_RETRY_SECONDS)
+    if response.status_code == 429 or "rate limit" in response.text.lower():
+        # Secondary limits without a hint: GitHub asks for at least a minute
+        return min(60.0, 2.0 ** (attempt + 2))
+    return None
+
 
 class GitHubClient:
     def __init__(self, token: str):
         self.token = token
-        self.base_url = "https://api.github.com"
+        self.base_url = GITHUB_API_URL
         self.headers = {
             "Authorization": f"Bearer {token}",
             "Accept": "application/vnd.github.v3+json"
         }
 
+    async def _throttle(self):
+        wait = rate_limiter.reserve()
+        if wait > 0:
+            stats.incr("throttle_waits")
+            stats.incr("throttle_wait_seconds", wait)
+            await asyncio.sleep(wait)
+
+    async def _request(self, method: str, url: str, stream: bool = False, **kwargs) -> httpx.Response:
+        """
+        Send a request through the rate limiter, retrying throttled responses.
+        With `stream`, the body isn't read and the caller must close the response.
+        """
+        client = get_http_client()
+        kwargs.setdefault("headers", self.headers)
+        for attempt in range(GITHUB_MAX_RETRIES + 1):
+            await self._throttle()
+            opened = []
+
+            async def trace(event_name: str, info: Dict[str, Any]):
+                if event_name == "connection.connect_tcp.complete":
+                    opened.append(event_name)
+
+            request = client.build_request(method, url, extensions={"trace": trace}, **kwargs)
+            response = await client.send(request, stream=stream)
+            stats.incr("requests")
+            stats.incr("connections_opened" if opened else "connections_reused")
+            rate_limiter.update(response.headers)
+
+            if stream and response.status_code in (403, 429):
+                await response.aread()  # _retry_delay looks at the error message
+            delay = _retry_delay(response, attempt)
+            if delay is None or attempt == GITHUB_MAX_RETRIES:
+                break
+            stats.incr("rate_limited")
+            stats.incr("retries")
+            rate_limiter.pause(delay)
+            if stream:
+                await response.aclose()
+        # 304 only comes back for conditional requests, whose callers handle it
+        if response.status_code != 304 and response.is_error:
+            if stream:
+                await response.aclose()
+            response.raise_for_status()
+        return response
+
+    async def list_pages(
+        self,
+        url: str,
+        params: Optional[Dict[str, Any]] = None,
+        etags: Optional[Dict[str, Any]] = None,
+        items_key: Optional[str] = None,
+        keep: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Yield a paginated list 100 items per page. With `etags`, a dict of
+        {page url: {"etag", "items"}} kept between runs, pages are requested
+        conditionally and a 304 (which doesn't count against the rate limit)
+        reuses the stored items. `keep` trims items before they are stored.
+        """
+        for page in range(1, 10_000):
+            page_params = dict(params or {}, per_page=100, page=page)
+            key = str(httpx.URL(url, params=page_params))
+            cached = etags.get(key) if etags is not None else None
+            headers = self.headers
+            if cached:
+                headers = dict(self.headers, **{"If-None-Match": cached["etag"]})
+            response = await self._request("GET", url, params=page_params, headers=headers)
+            if response.status_code == 304 and cached:
+                stats.incr("not_modified")
+                items = cached["items"]
+            else:
+                body = response.json()
+                items = body[items_key] if items_key else body
+                if keep is not None:
+                    items = [keep(item) for item in items]
+                if etags is not None and response.headers.get("ETag"):
+                    etags[key] = {"etag": response.headers["ETag"], "items": items}
+            yield items
+            if len(items) < 100:
+                break
+
+    def list_pull_requests(
+        self, owner: str, repo: str, state: str = "open", etags: Optional[Dict[str, Any]] = None, keep=None
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """PRs oldest first, so new ones only change the last page and earlier pages stay cacheable."""
+        url = f"{self.base_url}/repos/{owner}/{repo}/pulls"
+        params = {"state": state, "sort": "created", "direction": "asc"}
+        return self.list_pages(url, params, etags, keep=keep)
+
+    def list_installation_repositories(self, etags: Optional[Dict[str, Any]] = None) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Repositories the installation token has access to."""
+        url = f"{self.base_url}/installation/repositories"
+        return self.list_pages(url, etags=etags, items_key="repositories", keep=lambda r: {"full_name": r["full_name"]})
+
+    async def get_pull_request(self, owner: str, repo: str, pr_number: int) -> Dict[str, Any]:
+        url = f"{self.base_url}/repos/{owner}/{repo}/pulls/{pr_number}"
+        response = await self._request("GET", url)
+        return response.json()
+
+    async def list_pr_files(self, owner: str, repo: str, pr_number: int, max_pages: int = 30) -> List[Dict[str, Any]]:
+        """Changed files of a PR (GitHub caps this at 3000 files, 100 per page)."""
+        url = f"{self.base_url}/repos/{owner}/{repo}/pulls/{pr_number}/files"
+        files: List[Dict[str, Any]] = []
+        for page in range(1, max_pages + 1):
+            response = await self._request("GET", url, params={"per_page": 100, "page": page})
+            batch = response.json()
+            files.extend(batch)
+            if len(batch) < 100:
+                break
+        return files
+
+    async def get_blob(self, owner: str, repo: str, sha: str) -> str:
+        url = f"{self.base_url}/repos/{owner}/{repo}/git/blobs/{sha}"
+        headers = self.headers.copy()
+        headers["Accept"] = "application/vnd.github.raw"
+
+        response = await self._request("GET", url, headers=headers)
+        return response.text
+
     async def get_pr_diff(self, owner: str, repo: str, pr_number: int) -> str:
         url = f"{self.base_url}/repos/{owner}/{repo}/pulls/{pr_number}"
         headers = self.headers.copy()
         headers["Accept"] = "application/vnd.github.v3.diff"
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers)
-            response.raise_for_status()
-            return response.text
+
+        response = await self._request("GET", url, headers=headers)
+        return response.text
+
+    async def stream_pr_diff(self, owner: str, repo: str, pr_number: int) -> AsyncIterator[str]:
+        """Yield the PR diff line by line without buffering the whole body."""
+        url = f"{self.base_url}/repos/{owner}/{repo}/pulls/{pr_number}"
+        headers = self.headers.copy()
+        headers["Accept"] = "application/vnd.github.v3.diff"
+
+        response = await self._request("GET", url, stream=True, headers=headers)
+        try:
+            async for line in response.aiter_lines():
+                yield line
+        finally:
+            await response.aclose()
 
     async def post_comment(self, owner: str, repo: str, pr_number: int, body: str):
         url = f"{self.base_url}/repos/{owner}/{repo}/issues/{pr_number}/comments"
         data = {"body": body}
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, headers=self.headers, json=data)
-            response.raise_for_status()
-            return response.json()
+
+        response = await self._request("POST", url, json=data)
+        return response.json()
 
     async def post_review_comment(self, owner: str, repo: str, pr_number: int, body: str, commit_id: str, path: str, line: int):
         url = f"{self.base_url}/repos/{owner}/{repo}/pulls/{pr_number}/comments"
@@ -39,8 +329,27 @@ class GitHubClient:
             "line": line,
             "side": "RIGHT"
         }
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, headers=self.headers, json=data)
-            response.raise_for_status()
-            return response.json()
+
+        response = await self._request("POST", url, json=data)
+        return response.json()
+
+    async def update_comment(self, owner: str, repo: str, comment_id: int, body: str):
+        url = f"{self.base_url}/repos/{owner}/{repo}/issues/comments/{comment_id}"
+        response = await self._request("PATCH", url, json={"body": body})
+        return response.json()
+
+    async def create_review(
+        self, owner: str, repo: str, pr_number: int, commit_id: str, comments: List[Dict[str, Any]], body: str = ""
+    ):
+        """Post several inline comments as one review (one API call instead of one per comment)."""
+        url = f"{self.base_url}/repos/{owner}/{repo}/pulls/{pr_number}/reviews"
+        data = {
+            "commit_id": commit_id,
+            "event": "COMMENT",
+            "body": body,
+            "comments": [
+                {"path": c["path"], "line": c["line"], "side": "RIGHT", "body": c["body"]} for c in comments
+            ],
+        }
+        response = await self._request("POST", url, json=data)
+        return response.json()
@@ -1,92 +1,498 @@
+import asyncio
+import json
 import os
-from typing import List, Dict, Any
-import openai
-import google.generativeai as genai
+import re
+import threading
+import time
+import weakref
+from typing import AsyncIterator, Callable, Iterator, List, Dict, Any, Optional, Tuple
 
-class LLMProvider:
-    def generate_review(self, code_diff: str, context: str = "") -> Dict[str, Any]:
-        raise NotImplementedError
+from pydantic import ValidationError
 
-class OpenAIProvider(LLMProvider):
-    def __init__(self, api_key: str):
-        self.client = openai.OpenAI(api_key=api_key)
+from .schemas import Suggestion
+from .telemetry import record_llm_call, record_llm_usage
 
-    def generate_review(self, code_diff: str, context: str = "") -> Dict[str, Any]:
-        prompt = f"""
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+
+_FENCE = re.compile(r"```[A-Za-z]*[ \t]*\n?(.*?)(?:```|$)", re.S)
+_DANGLING_KEY = re.compile(r'[{,]\s*"(?:[^"\\]|\\.)*"\s*$')
+_PARTIAL_LITERAL = re.compile(r"([:\[,]\s*)[A-Za-z]+$")
+_decoder = json.JSONDecoder()
+
+def _repair_json(text: str) -> str:
+    """
+    Close what a cut-off or sloppy JSON document left open: drop trailing
+    commas and mismatched closers, escape raw newlines in strings, end an
+    open string, drop a key without a value, then close the open arrays and
+    objects. Stops after the first complete top-level value.
+    """
+    out: List[str] = []
+    closers: List[str] = []
+    in_string = escape = False
+    for c in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_string = False
+            elif c == "\n":
+                c = "\\n"
+            out.append(c)
+        elif c == '"':
+            in_string = True
+            out.append(c)
+        elif c in "{[":
+            closers.append("}" if c == "{" else "]")
+            out.append(c)
+        elif c in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            if closers and closers[-1] == c:
+                closers.pop()
+                out.append(c)
+                if not closers:
+                    break
+        else:
+            out.append(c)
+    if in_string:
+        if escape:
+            out.pop()
+        out.append('"')
+    repaired = "".join(out).rstrip()
+    dangling = _DANGLING_KEY.search(repaired)
+    if closers and closers[-1] == "}" and dangling:
+        repaired = repaired[:dangling.start() + 1].rstrip()
+    literal = _PARTIAL_LITERAL.search(repaired)
+    if literal and repaired[literal.end(1):] not in ("true", "false", "null"):
+        repaired = repaired[:literal.end(1)] + "null"
+    if repaired.endswith(","):
+        repaired = repaired[:-1]
+    elif repaired.endswith(":"):
+        repaired += " null"
+    return repaired + "".join(reversed(closers))
+
+def _decode_lenient(text: str) -> Tuple[Any, bool]:
+    """loads_lenient(), plus whether the JSON was complete as written (no repair needed)."""
+    try:
+        return json.loads(text), True
+    except ValueError:
+        pass
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1)
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return None, False
+    text = text[min(starts):]
+    for complete, candidate in ((True, text), (False, _repair_json(text))):
+        try:
+            return _decoder.raw_decode(candidate)[0], complete
+        except ValueError:
+            continue
+    return None, False
+
+def loads_lenient(text: str) -> Any:
+    """
+    json.loads for model output. Tolerates Markdown code fences, prose
+    around the JSON, trailing commas and output cut off mid-document (see
+    _repair_json). Returns None when there is no JSON to be found.
+    """
+    return _decode_lenient(text)[0]
+
+def to_suggestion(raw: Any) -> Optional[Dict[str, Any]]:
+    """Validate one suggestion from model output; None if it can't be used."""
+    if not isinstance(raw, dict):
+        return None
+    try:
+        return Suggestion.model_validate(raw).model_dump(exclude_none=True)
+    except ValidationError:
+        return None
+
+def parse_review(raw: Any) -> Dict[str, Any]:
+    """
+    Normalize a provider response into {"summary": str, "suggestions": list}
+    of validated suggestions (see schemas.Suggestion). Invalid suggestions are
+    dropped one by one; text without any JSON becomes the summary.
+
+    Errors, output without a review object and JSON that had to be repaired
+    (usually cut off at the token limit) also get "partial": True; callers
+    must not cache those.
+    """
+    complete = True
+    if isinstance(raw, str):
+        parsed, complete = _decode_lenient(raw)
+        if parsed is None:
+            return {"summary": raw.strip(), "suggestions": [], "partial": True}
+        raw = parsed
+    if isinstance(raw, list):
+        raw = {"suggestions": raw}
+    if not isinstance(raw, dict):
+        return {"summary": str(raw), "suggestions": [], "partial": True}
+    if raw.get("partial") or raw.get("error") or not ("summary" in raw or "suggestions" in raw):
+        complete = False
+    suggestions = raw.get("suggestions") or []
+    if not isinstance(suggestions, list):
+        suggestions = [suggestions]
+    summary = raw.get("summary") or raw.get("error") or ""
+    review = {
+        "summary": summary if isinstance(summary, str) else json.dumps(summary),
+        "suggestions": [s for s in map(to_suggestion, suggestions) if s is not None],
+    }
+    if not complete:
+        review["partial"] = True
+    return review
+
+class SuggestionStream:
+    """
+    Incremental parser for a streamed review. Feed it the model's output as it
+    arrives; each object in the top-level "suggestions" array is returned as
+    soon as its closing brace is seen, without waiting for the rest.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.suggestions: List[Dict[str, Any]] = []
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._key: Optional[str] = None
+        self._in_suggestions = False
+        self._object_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        self.text += chunk
+        text = self.text
+        found = []
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._key = text[self._string_start + 1:i]
+            elif c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c in "{[":
+                self._depth += 1
+                if c == "[" and self._depth == 2 and self._key == "suggestions":
+                    self._in_suggestions = True
+                elif c == "{" and self._depth == 3 and self._in_suggestions:
+                    self._object_start = i
+            elif c in "}]":
+                if c == "}" and self._depth == 3 and self._object_start is not None:
+                    suggestion = to_suggestion(loads_lenient(text[self._object_start:i + 1]))
+                    if suggestion is not None:
+                        found.append(suggestion)
+                    self._object_start = None
+                elif c == "]" and self._depth == 2:
+                    self._in_suggestions = False
+                self._depth = max(self._depth - 1, 0)
+        self._pos = len(text)
+        self.suggestions.extend(found)
+        return found
+
+    def result(self) -> Dict[str, Any]:
+        review = parse_review(self.text)
+        if len(review["suggestions"]) < len(self.suggestions):
+            # Output was cut off or malformed after some suggestions were complete
+            review = {"summary": "", "suggestions": list(self.suggestions), "partial": True}
+        return review
+
+# Part of the review cache key: bump it when the prompt changes so reviews
+# written for the old one aren't reused
+REVIEW_PROMPT_VERSION = "2"
+
+def build_review_prompt(code_diff: str, context: str = "") -> str:
+    return f"""
         You are an expert code reviewer. Review the following code diff and provide suggestions.
         Context: {context}
         
         Diff:
         {code_diff}
         
-        Return a JSON response with a summary and a list of suggestions (file, line, comment).
+        Return a JSON object of the form
+        {{"summary": "...", "suggestions": [{{"file": "path", "line": 12, "severity": "minor", "comment": "..."}}]}}
+        where severity is one of info, minor, major, critical.
         """
-        response = self.client.chat.completions.create(
-            model="gpt-4-turbo-preview",
+
+class LLMProvider:
+    name = "unknown"
+
+    def ready(self) -> bool:
+        """Whether the provider can take calls now; the router skips providers that can't."""
+        return True
+
+    def version(self) -> str:
+        """The provider and model behind it; reviews are cached per version."""
+        return self.name
+
+    def generate_review(self, code_diff: str, context: str = "") -> Dict[str, Any]:
+        """The review as parse_review() returns it."""
+        raise NotImplementedError
+
+    async def agenerate_review(self, code_diff: str, context: str = "") -> Dict[str, Any]:
+        # Providers without a native async client run on the default executor
+        return await asyncio.to_thread(self.generate_review, code_diff, context)
+
+    async def astream_review(self, code_diff: str, context: str = "") -> AsyncIterator[str]:
+        """Yield the review text as it is generated; without streaming support it arrives in one piece."""
+        raw = await self.agenerate_review(code_diff, context)
+        yield raw if isinstance(raw, str) else json.dumps(raw)
+
+class OpenAIProvider(LLMProvider):
+    name = "openai"
+    model = "gpt-4-turbo-preview"
+
+    def __init__(self, api_key: str):
+        import openai
+
+        self.client = openai.OpenAI(api_key=api_key)
+        self.async_client = openai.AsyncOpenAI(api_key=api_key)
+
+    def version(self) -> str:
+        return f"{self.name}:{self.model}"
+
+    def _request(self, code_diff: str, context: str) -> Dict[str, Any]:
+        return dict(
+            model=self.model,
             messages=[{"role": "system", "content": "You are a helpful code reviewer."},
-                      {"role": "user", "content": prompt}],
+                      {"role": "user", "content": build_review_prompt(code_diff, context)}],
             response_format={"type": "json_object"}
         )
+
+    def _content(self, response) -> str:
+        if response.usage is not None:
+            record_llm_usage(self.name, response.usage.prompt_tokens, response.usage.completion_tokens)
         return response.choices[0].message.content
 
+    def generate_review(self, code_diff: str, context: str = "") -> Dict[str, Any]:
+        response = self.client.chat.completions.create(**self._request(code_diff, context))
+        return parse_review(self._content(response))
+
+    async def agenerate_review(self, code_diff: str, context: str = "") -> Dict[str, Any]:
+        response = await self.async_client.chat.completions.create(**self._request(code_diff, context))
+        return parse_review(self._content(response))
+
+    async def astream_review(self, code_diff: str, context: str = "") -> AsyncIterator[str]:
+        stream = await self.async_client.chat.completions.create(
+            **self._request(code_diff, context), stream=True, stream_options={"include_usage": True}
+        )
+        async for chunk in stream:
+            if chunk.usage is not None:
+                record_llm_usage(self.name, chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
 class GeminiProvider(LLMProvider):
+    name = "gemini"
+
     def __init__(self, api_key: str):
+        import google.generativeai as genai
+
         genai.configure(api_key=api_key)
         self.model = genai.GenerativeModel('gemini-pro')
 
-    def generate_review(self, code_diff: str, context: str = "") -> Dict[str, Any]:
-        prompt = f"""
-        You are an expert code reviewer. Review the following code diff and provide suggestions.
-        Context: {context}
-        
-        Diff:
-        {code_diff}
-        
-        Return a JSON response with a summary and a list of suggestions (file, line, comment).
-        """
-        response = self.model.generate_content(prompt)
+    def version(self) -> str:
+        return f"{self.name}:{self.model.model_name}"
+
+    def _text(self, response) -> str:
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            record_llm_usage(self.name, usage.prompt_token_count, usage.candidates_token_count)
         return response.text
 
+    def generate_review(self, code_diff: str, context: str = "") -> Dict[str, Any]:
+        response = self.model.generate_content(build_review_prompt(code_diff, context))
+        return parse_review(self._text(response))
+
+    async def agenerate_review(self, code_diff: str, context: str = "") -> Dict[str, Any]:
+        response = await self.model.generate_content_async(build_review_prompt(code_diff, context))
+        return parse_review(self._text(response))
+
+    async def astream_review(self, code_diff: str, context: str = "") -> AsyncIterator[str]:
+        response = await self.model.generate_content_async(build_review_prompt(code_diff, context), stream=True)
+        usage = None
+        async for chunk in response:
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            if chunk.parts:
+                yield chunk.text
+        if usage is not None:
+            record_llm_usage(self.name, usage.prompt_token_count, usage.candidates_token_count)
+
 class LocalLLMProvider(LLMProvider):
+    """Thin client for the process-wide LocalModelServer, which loads the model once per worker."""
+
+    name = "local"
+
     def __init__(self, model_path: str = "models/local_finetuned"):
-        try:
-            from peft import PeftModel, PeftConfig
-            from transformers import AutoModelForCausalLM, AutoTokenizer
-            import torch
-            
-            config = PeftConfig.from_pretrained(model_path)
-            base_model = AutoModelForCausalLM.from_pretrained(
-                config.base_model_name_or_path,
-                return_dict=True,
-                load_in_4bit=True,
-                device_map='auto'
-            )
-            self.model = PeftModel.from_pretrained(base_model, model_path)
-            self.tokenizer = AutoTokenizer.from_pretrained(config.base_model_name_or_path)
-        except Exception as e:
-            print(f"Failed to load local model: {e}")
-            self.model = None
+        from .local_server import get_local_server
+
+        self.server = get_local_server(os.getenv("LOCAL_MODEL_PATH", model_path))
+
+    def ready(self) -> bool:
+        return self.server.ready
+
+    def version(self) -> str:
+        return f"{self.name}:{self.server.model_path}"
+
+    def _prompt(self, code_diff: str, context: str) -> str:
+        return f"Review this code:\n{code_diff}\nContext: {context}"
 
     def generate_review(self, code_diff: str, context: str = "") -> Dict[str, Any]:
-        if not self.model:
-            return {"error": "Local model not loaded"}
-            
-        prompt = f"Review this code:\n{code_diff}\nContext: {context}"
-        inputs = self.tokenizer(prompt, return_tensors="pt").to("cuda")
-        
-        outputs = self.model.generate(**inputs, max_new_tokens=200)
-        return self.tokenizer.decode(outputs[0], skip_special_tokens=True)
+        if not self.server.ready:
+            return parse_review({"error": "Local model not loaded"})
+        return parse_review(self.server.generate(self._prompt(code_diff, context)))
+
+    async def agenerate_review(self, code_diff: str, context: str = "") -> Dict[str, Any]:
+        if not self.server.ready:
+            return parse_review({"error": "Local model not loaded"})
+        request = self.server.submit(self._prompt(code_diff, context))
+        text = await asyncio.wrap_future(request.future)
+        record_llm_usage(self.name, request.input_length, request.output_tokens)
+        return parse_review(text)
+
+    def stream_review(self, code_diff: str, context: str = "") -> Iterator[str]:
+        return self.server.stream(self._prompt(code_diff, context))
+
+    async def astream_review(self, code_diff: str, context: str = "") -> AsyncIterator[str]:
+        if not self.server.ready:
+            yield json.dumps({"error": "Local model not loaded"})
+            return
+        request = self.server.submit(self._prompt(code_diff, context))
+        pieces = iter(request)
+        while True:
+            # Tokens come from the scheduler thread through a blocking queue
+            piece = await asyncio.to_thread(next, pieces, None)
+            if piece is None:
+                break
+            yield piece
+        request.result()
+        record_llm_usage(self.name, request.input_length, request.output_tokens)
+
+
+class ReviewDispatcher:
+    """
+    Bounds the number of model calls in flight per process. Every review
+    running on the worker's event loop goes through the same dispatcher, so
+    LLM_MAX_CONCURRENCY caps the total regardless of how many tasks are active.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def review(self, provider: LLMProvider, code_diff: str, context: str = "") -> Any:
+        async with self._semaphore():
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            start = time.perf_counter()
+            try:
+                return await provider.agenerate_review(code_diff, context)
+            finally:
+                record_llm_call(provider.name, time.perf_counter() - start)
+                self.in_flight -= 1
+                self.completed += 1
+
+    async def stream(self, provider: LLMProvider, code_diff: str, context: str = "") -> AsyncIterator[str]:
+        """Like review(), yielding the output as the provider streams it; the slot is held until it ends."""
+        async with self._semaphore():
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            start = time.perf_counter()
+            try:
+                async for chunk in provider.astream_review(code_diff, context):
+                    yield chunk
+            finally:
+                record_llm_call(provider.name, time.perf_counter() - start)
+                self.in_flight -= 1
+                self.completed += 1
+
+
+dispatcher = ReviewDispatcher()
+
+# name -> factory; a provider's SDK is only imported when its factory runs
+_providers: Dict[str, Callable[[], LLMProvider]] = {}
+
+
+def register_provider(name: str, factory: Callable[[], LLMProvider]):
+    _providers[name] = factory
+
+
+def registered_providers() -> List[str]:
+    return sorted(_providers)
+
+
+register_provider("openai", lambda: OpenAIProvider(os.environ["OPENAI_API_KEY"]))
+register_provider("gemini", lambda: GeminiProvider(os.environ["GEMINI_API_KEY"]))
+register_provider("local", LocalLLMProvider)
+
+
+def _router() -> LLMProvider:
+    from .router import ProviderRouter
+
+    return ProviderRouter.from_env()
+
+
+register_provider("router", _router)
+
+
+def build_provider(name: str) -> LLMProvider:
+    if name not in _providers:
+        raise ValueError(f"Unknown LLM provider {name!r}, expected one of {registered_providers()}")
+    return _providers[name]()
+
+
+def configured_provider() -> str:
+    """LLM_PROVIDER if set, the router if LLM_ROUTER_PROVIDERS is, otherwise the first of local/OpenAI/Gemini that is configured."""
+    name = os.getenv("LLM_PROVIDER")
+    if name:
+        return name
+    if os.getenv("LLM_ROUTER_PROVIDERS"):
+        return "router"
+    if os.getenv("USE_LOCAL_LLM", "false").lower() == "true":
+        return "local"
+    if os.getenv("OPENAI_API_KEY"):
+        return "openai"
+    if os.getenv("GEMINI_API_KEY"):
+        return "gemini"
+    raise ValueError("No LLM provider configured")
+
+
+_provider: Optional[LLMProvider] = None
+_provider_lock = threading.Lock()
+
 
 def get_llm_provider() -> LLMProvider:
-    openai_key = os.getenv("OPENAI_API_KEY")
-    gemini_key = os.getenv("GEMINI_API_KEY")
-    use_local = os.getenv("USE_LOCAL_LLM", "false").lower() == "true"
-    
-    if use_local:
-        return LocalLLMProvider()
-    elif openai_key:
-        return OpenAIProvider(openai_key)
-    elif gemini_key:
-        return GeminiProvider(gemini_key)
-    else:
-        raise ValueError("No LLM provider configured")
+    """The configured provider, built once per process so SDK clients and their connection pools are reused."""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = build_provider(configured_provider())
+    return _provider
+
+
+def reset_llm_provider():
+    global _provider
+    _provider = None
@@ -0,0 +1,374 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, Iterator, List, Optional
+
+LOCAL_MODEL_PATH = os.getenv("LOCAL_MODEL_PATH", "models/local_finetuned")
+LOCAL_DEVICE = os.getenv("LOCAL_DEVICE", "auto")
+LOCAL_MAX_BATCH_SIZE = int(os.getenv("LOCAL_MAX_BATCH_SIZE", "8"))
+LOCAL_BATCH_WAIT_MS = int(os.getenv("LOCAL_BATCH_WAIT_MS", "10"))
+LOCAL_MAX_NEW_TOKENS = int(os.getenv("LOCAL_MAX_NEW_TOKENS", "200"))
+# Prompts whose token lengths differ by more than this factor go into separate
+# batches so short prompts don't pay for padding up to long ones.
+LOCAL_PADDING_RATIO = float(os.getenv("LOCAL_PADDING_RATIO", "1.5"))
+
+_DONE = object()
+
+
+def detect_device() -> str:
+    import torch
+
+    if LOCAL_DEVICE != "auto":
+        return LOCAL_DEVICE
+    if torch.cuda.is_available():
+        return "cuda"
+    if getattr(torch.backends, "mps", None) is not None and torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+class GenerationRequest:
+    def __init__(self, prompt: str, max_new_tokens: int):
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.future: Future = Future()
+        self.submitted_at = time.monotonic()
+        self.first_token_at: Optional[float] = None
+        self.input_length = 0
+        self.output_tokens = 0
+        self.generated: List[int] = []
+        self._tokens: "queue.Queue" = queue.Queue()
+        self._text = ""
+
+    def _emit(self, text: str):
+        # Hold back partially decoded multi-byte characters until they complete
+        if text.endswith("\ufffd"):
+            return
+        if len(text) > len(self._text):
+            if self.first_token_at is None:
+                self.first_token_at = time.monotonic()
+            self._tokens.put(text[len(self._text):])
+            self._text = text
+
+    def _finish(self, error: Optional[BaseException] = None):
+        self._tokens.put(_DONE)
+        if error is not None:
+            self.future.set_exception(error)
+        else:
+            self.future.set_result(self._text)
+
+    def __iter__(self) -> Iterator[str]:
+        while True:
+            piece = self._tokens.get()
+            if piece is _DONE:
+                break
+            yield piece
+
+    def result(self, timeout: Optional[float] = None) -> str:
+        return self.future.result(timeout)
+
+
+class LocalModelServer:
+    """
+    Keeps the fine-tuned model resident for the lifetime of the worker process
+    and serves generation requests from a single scheduler thread.
+
+    Batching is continuous: up to LOCAL_MAX_BATCH_SIZE requests decode
+    together, one token per step over a shared KV cache. Before every step,
+    queued requests are admitted into the free rows: their prompts are
+    prefilled in length buckets, left-padded, and merged into the running
+    cache. A request leaves as soon as it hits EOS or its token limit, and
+    its row is free for the next one. When idle, the first request waits up
+    to LOCAL_BATCH_WAIT_MS for company. Tokens are streamed back to each
+    request as they are produced. The merging assumes a plain per-layer KV
+    cache, as Llama-family models use, not a sliding-window one.
+    """
+
+    def __init__(
+        self,
+        model_path: str = LOCAL_MODEL_PATH,
+        max_batch_size: int = LOCAL_MAX_BATCH_SIZE,
+        batch_wait_ms: int = LOCAL_BATCH_WAIT_MS,
+    ):
+        self.model_path = model_path
+        self.max_batch_size = max_batch_size
+        self.batch_wait = batch_wait_ms / 1000
+        self.device: Optional[str] = None
+        self.model = None
+        self.tokenizer = None
+        self.error: Optional[str] = None
+        self.stats: Dict[str, float] = {"requests": 0, "batches": 0, "generated_tokens": 0, "padding_tokens": 0}
+        self._queue: "queue.Queue[GenerationRequest]" = queue.Queue()
+        self._started = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.model is not None
+
+    def start(self) -> bool:
+        with self._lock:
+            if self._started.is_set():
+                return self.ready
+            try:
+                self._load()
+            except Exception as e:
+                print(f"Failed to load local model: {e}")
+                self.error = str(e)
+            self._started.set()
+            if self.ready:
+                threading.Thread(target=self._serve, name="local-llm-server", daemon=True).start()
+                self.warmup()
+        return self.ready
+
+    def _load(self):
+        from peft import PeftModel, PeftConfig
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        import torch
+
+        self.device = detect_device()
+        config = PeftConfig.from_pretrained(self.model_path)
+        kwargs = {"return_dict": True}
+        if self.device == "cuda":
+            try:
+                from transformers import BitsAndBytesConfig
+                import bitsandbytes  # noqa: F401
+
+                kwargs["quantization_config"] = BitsAndBytesConfig(load_in_4bit=True)
+                kwargs["device_map"] = "auto"
+            except ImportError:
+                kwargs["torch_dtype"] = torch.float16
+        else:
+            kwargs["torch_dtype"] = torch.float16 if self.device == "mps" else torch.float32
+
+        start = time.monotonic()
+        base_model = AutoModelForCausalLM.from_pretrained(config.base_model_name_or_path, **kwargs)
+        model = PeftModel.from_pretrained(base_model, self.model_path)
+        if "device_map" not in kwargs:
+            model = model.to(self.device)
+        model.eval()
+
+        tokenizer = AutoTokenizer.from_pretrained(config.base_model_name_or_path)
+        tokenizer.padding_side = "left"
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+
+        self.model, self.tokenizer = model, tokenizer
+        print(f"Local model loaded on {self.device} in {time.monotonic() - start:.1f}s")
+
+    def warmup(self):
+        self.submit("Review this code:\npass", max_new_tokens=1).result()
+
+    def submit(self, prompt: str, max_new_tokens: int = LOCAL_MAX_NEW_TOKENS) -> GenerationRequest:
+        request = GenerationRequest(prompt, max_new_tokens)
+        if not self.ready:
+            request._finish(RuntimeError(self.error or "Local model not loaded"))
+            return request
+        self.stats["requests"] += 1
+        self._queue.put(request)
+        return request
+
+    def generate(self, prompt: str, max_new_tokens: int = LOCAL_MAX_NEW_TOKENS) -> str:
+        return self.submit(prompt, max_new_tokens).result()
+
+    def stream(self, prompt: str, max_new_tokens: int = LOCAL_MAX_NEW_TOKENS) -> Iterator[str]:
+        return iter(self.submit(prompt, max_new_tokens))
+
+    def _admit(self, running: int) -> List[GenerationRequest]:
+        """
+        Queued requests that fit next to `running` ones. With nothing running
+        this blocks for a first request and waits up to LOCAL_BATCH_WAIT_MS
+        for company; otherwise it only takes what is already queued, so the
+        decode loop never stalls.
+        """
+        admitted: List[GenerationRequest] = []
+        if not running:
+            admitted.append(self._queue.get())
+        deadline = time.monotonic() + (self.batch_wait if not running else 0)
+        while running + len(admitted) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                admitted.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return admitted
+
+    def _buckets(self, batch: List[GenerationRequest]) -> List[List[GenerationRequest]]:
+        for request in batch:
+            request.input_length = len(self.tokenizer(request.prompt).input_ids)
+        batch.sort(key=lambda r: r.input_length)
+        buckets: List[List[GenerationRequest]] = []
+        for request in batch:
+            if buckets and request.input_length <= buckets[-1][0].input_length * LOCAL_PADDING_RATIO:
+                buckets[-1].append(request)
+            else:
+                buckets.append([request])
+        return buckets
+
+    def _serve(self):
+        running: Optional[_Running] = None
+        while True:
+            admitted = self._admit(len(running.requests) if running else 0)
+            try:
+                buckets = self._buckets(admitted) if admitted else []
+            except Exception as e:
+                for request in admitted:
+                    request._finish(e)
+                buckets = []
+            for bucket in buckets:
+                try:
+                    running = _Running.merge(running, self._prefill(bucket))
+                except Exception as e:
+                    print(f"Local generation failed: {e}")
+                    for request in bucket:
+                        if not request.future.done():
+                            request._finish(e)
+            if running is None:
+                continue
+            try:
+                running = self._decode(running)
+            except Exception as e:
+                print(f"Local generation failed: {e}")
+                for request in running.requests:
+                    if not request.future.done():
+                        request._finish(e)
+                running = None
+
+    def _forward(self, input_ids, attention_mask, past_key_values):
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)[:, -input_ids.shape[1]:]
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=past_key_values,
+            use_cache=True,
+        )
+        return outputs.logits[:, -1, :].argmax(dim=-1), outputs.past_key_values
+
+    def _prefill(self, bucket: List[GenerationRequest]) -> Optional["_Running"]:
+        """Run the prompts of a bucket, left-padded, and emit their first tokens."""
+        import torch
+
+        encoded = self.tokenizer([r.prompt for r in bucket], return_tensors="pt", padding=True).to(self.model.device)
+        self.stats["batches"] += 1
+        self.stats["padding_tokens"] += int((encoded.attention_mask == 0).sum())
+        with torch.inference_mode():
+            next_tokens, cache = self._forward(encoded.input_ids, encoded.attention_mask, None)
+        return self._accept(_Running(bucket, cache, encoded.attention_mask, next_tokens))
+
+    def _decode(self, running: "_Running") -> Optional["_Running"]:
+        """One decode step for every running request."""
+        import torch
+
+        attention_mask = torch.cat([running.attention_mask, torch.ones_like(running.next_tokens)[:, None]], dim=-1)
+        with torch.inference_mode():
+            next_tokens, cache = self._forward(running.next_tokens[:, None], attention_mask, running.cache)
+        return self._accept(_Running(running.requests, cache, attention_mask, next_tokens))
+
+    def _accept(self, running: "_Running") -> Optional["_Running"]:
+        """Stream the tokens just produced and drop requests that finished."""
+        tokenizer = self.tokenizer
+        keep = []
+        for i, request in enumerate(running.requests):
+            token = int(running.next_tokens[i])
+            if token != tokenizer.eos_token_id:
+                request.generated.append(token)
+                request.output_tokens += 1
+                self.stats["generated_tokens"] += 1
+                request._emit(tokenizer.decode(request.generated, skip_special_tokens=True))
+            if token == tokenizer.eos_token_id or len(request.generated) >= request.max_new_tokens:
+                request._finish()
+            else:
+                keep.append(i)
+        return running.select(keep)
+
+
+class _Running:
+    """
+    Requests decoding together: their KV cache, left-padded to a common
+    length, the matching attention mask, and the token each request produced
+    last, which is fed in at the next step. The cache is only unpacked when
+    requests join or leave.
+    """
+
+    def __init__(self, requests: List[GenerationRequest], cache, attention_mask, next_tokens):
+        self.requests = requests
+        self.cache = cache
+        self.attention_mask = attention_mask
+        self.next_tokens = next_tokens
+
+    def select(self, keep: List[int]) -> Optional["_Running"]:
+        """The rows in `keep`, without the leading columns none of them attend to."""
+        if not keep:
+            return None
+        if len(keep) == len(self.requests):
+            return self
+        import torch
+
+        rows = torch.tensor(keep, device=self.attention_mask.device)
+        attention_mask = self.attention_mask[rows]
+        start = int(attention_mask.any(dim=0).int().argmax())
+        return _Running(
+            [self.requests[i] for i in keep],
+            _build_cache([(k[rows, :, start:], v[rows, :, start:]) for k, v in _cache_layers(self.cache)]),
+            attention_mask[:, start:],
+            self.next_tokens[rows],
+        )
+
+    @staticmethod
+    def merge(running: Optional["_Running"], joining: Optional["_Running"]) -> Optional["_Running"]:
+        """Add freshly prefilled requests to the running ones, left-padding the shorter cache."""
+        if running is None or joining is None:
+            return running or joining
+        import torch
+        import torch.nn.functional as F
+
+        length = max(running.attention_mask.shape[1], joining.attention_mask.shape[1])
+
+        def pad(group: "_Running"):
+            extra = length - group.attention_mask.shape[1]
+            return (
+                [(F.pad(k, (0, 0, extra, 0)), F.pad(v, (0, 0, extra, 0))) for k, v in _cache_layers(group.cache)],
+                F.pad(group.attention_mask, (extra, 0)),
+            )
+
+        (layers, mask), (joining_layers, joining_mask) = pad(running), pad(joining)
+        return _Running(
+            running.requests + joining.requests,
+            _build_cache([(torch.cat([k, jk]), torch.cat([v, jv])) for (k, v), (jk, jv) in zip(layers, joining_layers)]),
+            torch.cat([mask, joining_mask]),
+            torch.cat([running.next_tokens, joining.next_tokens]),
+        )
+
+
+def _cache_layers(cache) -> List[tuple]:
+    """(key, value) per layer of a model's KV cache, whichever form this transformers version returns."""
+    if isinstance(cache, tuple):
+        return [(layer[0], layer[1]) for layer in cache]
+    if hasattr(cache, "layers"):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    return list(zip(cache.key_cache, cache.value_cache))
+
+
+def _build_cache(layers: List[tuple]):
+    from transformers import DynamicCache
+
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(tuple(layers))
+    return DynamicCache(layers)
+
+
+_servers: Dict[str, LocalModelServer] = {}
+_servers_lock = threading.Lock()
+
+
+def get_local_server(model_path: str = LOCAL_MODEL_PATH) -> LocalModelServer:
+    """Process-wide server for `model_path`, loading the model on first use."""
+    with _servers_lock:
+        server = _servers.get(model_path)
+        if server is None:
+            server = _servers[model_path] = LocalModelServer(model_path)
+    server.start()
+    return server
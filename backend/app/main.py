@@ -1,7 +1,13 @@
 from fastapi import FastAPI, Request, BackgroundTasks, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from .worker import process_review
+from .celery_app import celery
+from .webhooks import REVIEW_DEBOUNCE_SECONDS, is_duplicate_delivery, set_latest_review, verify_signature
+from .telemetry import CONTENT_TYPE, WEBHOOK_SECONDS, render_metrics
+from .scheduling import cancel_review, mark_dequeued, mark_queued, queue_stats, review_priority, schedule_review, tenant_key
+import json
 import os
+import time
+import uuid
 
 app = FastAPI(title="AI Code Reviewer API")
 
@@ -12,6 +18,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 @app.get("/")
@@ -24,26 +31,75 @@ def health_check():
 
 @app.post("/webhook")
 async def webhook(request: Request):
-    payload = await request.json()
+    start = time.perf_counter()
+    try:
+        return await _handle_webhook(request)
+    finally:
+        event = "pull_request" if request.headers.get("X-GitHub-Event") == "pull_request" else "other"
+        WEBHOOK_SECONDS.labels(event).observe(time.perf_counter() - start)
+
+async def _handle_webhook(request: Request):
+    # Cheap checks on headers and the raw body come before any JSON parsing
+    body = await request.body()
+    if not verify_signature(body, request.headers.get("X-Hub-Signature-256")):
+        raise HTTPException(status_code=401, detail="Invalid signature")
+
     event = request.headers.get("X-GitHub-Event")
+    if event != "pull_request":
+        return {"message": "Event ignored"}
+    if is_duplicate_delivery(request.headers.get("X-GitHub-Delivery")):
+        return {"message": "Duplicate delivery ignored"}
+
+    payload = json.loads(body)
+    action = payload.get("action")
+    if action in ["opened", "synchronize"]:
+        pr = payload.get("pull_request")
+        repo = payload.get("repository")
+        installation = payload.get("installation")
 
-    if event == "pull_request":
-        action = payload.get("action")
-        if action in ["opened", "synchronize"]:
-            pr = payload.get("pull_request")
-            repo = payload.get("repository")
-            installation = payload.get("installation")
-            
-            if pr and repo:
-                process_review.delay(
-                    owner=repo["owner"]["login"],
+        if pr and repo:
+            owner = repo["owner"]["login"]
+            head_sha = (pr.get("head") or {}).get("sha")
+            task_id = str(uuid.uuid4())
+            # Follows the review through the worker's logs, metrics and spans
+            trace_id = uuid.uuid4().hex
+            # Bursts of pushes collapse onto the newest head: earlier tasks are
+            # dropped if still delayed, revoked if queued, or stop at their next
+            # checkpoint if running.
+            superseded = set_latest_review(owner, repo["name"], pr["number"], task_id, head_sha)
+            installation_id = installation["id"] if installation else 0
+            tenant = tenant_key(owner, installation_id)
+            if superseded:
+                cancel_review(superseded)
+                celery.control.revoke(superseded)
+                mark_dequeued(tenant, superseded, started=False)
+            # Small PRs jump ahead of large ones, and a tenant with a deep
+            # backlog yields to everyone else
+            received_at = time.time()
+            backlog = mark_queued(tenant, task_id, received_at + REVIEW_DEBOUNCE_SECONDS)
+            priority = review_priority(pr.get("additions", 0) + pr.get("deletions", 0), backlog)
+            # Held on the delay set for the debounce, then sent to the priority
+            # queue by name: the API doesn't import the worker and its SDKs
+            schedule_review(
+                task_id,
+                dict(
+                    owner=owner,
                     repo=repo["name"],
                     pr_number=pr["number"],
-                    installation_id=installation["id"] if installation else 0
-                )
-                return {"message": "Review processing started"}
-    
-from .collector import DataCollector
+                    installation_id=installation_id,
+                    head_sha=head_sha,
+                    trace_id=trace_id,
+                    received_at=received_at,
+                    tenant=tenant,
+                ),
+                priority,
+                REVIEW_DEBOUNCE_SECONDS,
+            )
+            print(f"Queued review of {owner}/{repo['name']}#{pr['number']} priority={priority} trace={trace_id}")
+            return {"message": "Review processing started", "trace_id": trace_id}
+    return {"message": "Event ignored"}
+
+from .feedback import feedback_queue
 from pydantic import BaseModel
 
 # ... existing imports
@@ -53,47 +109,159 @@ class Feedback(BaseModel):
     rating: int # 1-5
     comment: str
 
-collector = DataCollector()
+@app.on_event("startup")
+async def start_feedback_queue():
+    feedback_queue.start()
+
+@app.on_event("shutdown")
+async def stop_feedback_queue():
+    await feedback_queue.stop()
 
 @app.post("/feedback")
-def submit_feedback(feedback: Feedback):
-    # In a real app, we'd link this to the specific review in DB
-    # For now, we just log it
-    collector.save_interaction(code_diff="<lookup_diff>", review={"id": feedback.review_id}, feedback=feedback.dict())
+async def submit_feedback(feedback: Feedback):
+    # Queued and written to the feedback table in batches off the request path
+    try:
+        review_id = int(feedback.review_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid review id")
+    if not 1 <= feedback.rating <= 5:
+        raise HTTPException(status_code=400, detail="Rating must be between 1 and 5")
+    if not feedback_queue.submit({"review_id": review_id, "rating": feedback.rating, "comment": feedback.comment}):
+        raise HTTPException(status_code=503, detail="Feedback queue is full, try again later")
     return {"message": "Feedback received"}
 
 
-from sqlalchemy.orm import Session
-from fastapi import Depends
+from sqlalchemy import literal, tuple_
+from sqlalchemy.orm import Session, contains_eager
+from fastapi import Depends, Response
+from datetime import datetime
+from typing import Optional
+import base64
 from .database import get_db
-from .models import Review, PullRequest as PRModel
+from .models import Review, PullRequest as PRModel, Repository as RepoModel
+from .crud import get_issue_summary, get_metrics_summary
+
+METRICS_CACHE_TTL = float(os.getenv("METRICS_CACHE_TTL", "5"))
+_metrics_cache = {"expires": 0.0, "value": None}
 
 @app.get("/metrics")
 def get_metrics(db: Session = Depends(get_db)):
-    total_reviews = db.query(Review).count()
-    # Simplified issues count (assuming JSON suggestions list)
-    # In real app, we'd query inside the JSON or have a separate counter
-    issues_found = 0 
-    reviews = db.query(Review).all()
-    for r in reviews:
-        if r.suggestions:
-            issues_found += len(r.suggestions)
-            
-    return {
-        "total_reviews": total_reviews,
-        "issues_found": issues_found,
-        "avg_review_time": "1.2s" # Placeholder for now
-    }
+    # Served from the review_stats rollup; the dashboard polls, so keep a short-lived copy
+    now = time.monotonic()
+    if _metrics_cache["value"] is None or now >= _metrics_cache["expires"]:
+        _metrics_cache["value"] = get_metrics_summary(db)
+        _metrics_cache["expires"] = now + METRICS_CACHE_TTL
+    return _metrics_cache["value"]
+
+ISSUES_LIMIT_MAX = 100
+
+@app.get("/metrics/issues")
+def get_issues(repo: Optional[str] = None, limit: int = 20, db: Session = Depends(get_db)):
+    # Suggestion counts by severity per repository and for the files with the most
+    owner, name = repo.split("/", 1) if repo and "/" in repo else (None, repo)
+    return get_issue_summary(db, owner, name, max(1, min(limit, ISSUES_LIMIT_MAX)))
+
+@app.get("/metrics/prometheus")
+def prometheus_metrics():
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE)
+
+@app.get("/queue")
+def get_queue():
+    # Queued and running reviews and queue wait per installation
+    return {"tenants": queue_stats()}
+
+REVIEWS_PAGE_MAX = 100
+
+def _encode_cursor(review: Review) -> str:
+    raw = f"{review.created_at.isoformat()}|{review.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def _decode_cursor(cursor: str):
+    try:
+        created_at, review_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(review_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 @app.get("/reviews")
-def get_recent_reviews(limit: int = 5, db: Session = Depends(get_db)):
-    reviews = db.query(Review).order_by(Review.created_at.desc()).limit(limit).all()
+def get_recent_reviews(
+    response: Response,
+    limit: int = 5,
+    cursor: Optional[str] = None,
+    repo: Optional[str] = None,
+    status: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    # Reviews, PRs and repositories come back in one query; the next page
+    # starts after the last (created_at, id) seen and is returned in X-Next-Cursor.
+    limit = max(1, min(limit, REVIEWS_PAGE_MAX))
+    query = (
+        db.query(Review)
+        .outerjoin(Review.pull_request)
+        .outerjoin(PRModel.repository)
+        .options(contains_eager(Review.pull_request).contains_eager(PRModel.repository))
+    )
+    if repo:
+        if "/" in repo:
+            owner, name = repo.split("/", 1)
+            query = query.filter(RepoModel.owner == owner, RepoModel.name == name)
+        else:
+            query = query.filter(RepoModel.name == repo)
+    if status:
+        query = query.filter(Review.status == status)
+    if cursor:
+        created_at, review_id = _decode_cursor(cursor)
+        query = query.filter(
+            tuple_(Review.created_at, Review.id) < tuple_(literal(created_at, Review.created_at.type), literal(review_id))
+        )
+
+    reviews = query.order_by(Review.created_at.desc(), Review.id.desc()).limit(limit + 1).all()
+    if len(reviews) > limit:
+        reviews = reviews[:limit]
+        response.headers["X-Next-Cursor"] = _encode_cursor(reviews[-1])
+
     result = []
     for r in reviews:
         result.append({
+            "id": r.id,
             "repository": r.pull_request.repository.name if r.pull_request and r.pull_request.repository else "unknown",
             "pr_number": r.pull_request.pr_number if r.pull_request else 0,
             "status": r.status,
             "date": r.created_at.strftime("%Y-%m-%d")
         })
     return result
+
+
+from fastapi import Header
+from typing import List
+import hmac
+from .scheduling import LOWEST_PRIORITY
+
+# Required as X-Admin-Token on /admin endpoints, which are disabled without it
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+class BackfillRequest(BaseModel):
+    repositories: List[str] = []
+    installation: bool = False
+    state: str = "open" # open, closed, all
+    limit: Optional[int] = None
+    concurrency: Optional[int] = None
+    publish: bool = False
+    analysis: bool = True
+
+@app.post("/admin/backfill")
+def start_backfill(request: BackfillRequest, x_admin_token: Optional[str] = Header(None)):
+    # Reviews existing PRs in a worker task, resuming from earlier runs' checkpoints
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=503, detail="Admin endpoints are disabled; set ADMIN_TOKEN")
+    if not hmac.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    if not request.repositories and not request.installation:
+        raise HTTPException(status_code=400, detail="Give repositories or installation")
+    if any("/" not in name for name in request.repositories):
+        raise HTTPException(status_code=400, detail="Repositories are owner/repo")
+    if request.state not in ("open", "closed", "all"):
+        raise HTTPException(status_code=400, detail="State must be open, closed or all")
+    options = request.model_dump(exclude_none=True)
+    task = celery.send_task("backfill_reviews", kwargs=options, priority=LOWEST_PRIORITY)
+    return {"message": "Backfill started", "task_id": task.id}
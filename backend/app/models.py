@@ -1,10 +1,13 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, JSON
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, Float, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
 
 class Repository(Base):
     __tablename__ = "repositories"
+    __table_args__ = (
+        UniqueConstraint("owner", "name", name="uq_repositories_owner_name"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
@@ -17,6 +20,10 @@ class Repository(Base):
 
 class PullRequest(Base):
     __tablename__ = "pull_requests"
+    __table_args__ = (
+        Index("ix_pull_requests_repository_id_id", "repository_id", "id"),
+        UniqueConstraint("repository_id", "pr_number", name="uq_pull_requests_repository_id_pr_number"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     repository_id = Column(Integer, ForeignKey("repositories.id"))
@@ -32,12 +39,69 @@ class PullRequest(Base):
 
 class Review(Base):
     __tablename__ = "reviews"
+    __table_args__ = (
+        # Keyset pagination for /reviews walks (created_at, id) newest first
+        Index("ix_reviews_created_at_id", "created_at", "id"),
+        Index("ix_reviews_status_created_at_id", "status", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    pull_request_id = Column(Integer, ForeignKey("pull_requests.id"))
+    pull_request_id = Column(Integer, ForeignKey("pull_requests.id"), index=True)
     status = Column(String) # pending, completed, failed
     summary = Column(Text)
-    suggestions = Column(JSON) # List of suggestions
+    duration_seconds = Column(Float)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    completed_at = Column(DateTime(timezone=True))
 
     pull_request = relationship("PullRequest", back_populates="reviews")
+    suggestions = relationship("Suggestion", back_populates="review", order_by="Suggestion.id")
+
+class Suggestion(Base):
+    """One review comment. repository_id is copied from the pull request so per-repository aggregates need no joins."""
+    __tablename__ = "suggestions"
+    __table_args__ = (
+        Index("ix_suggestions_repository_id_file", "repository_id", "file"),
+        Index("ix_suggestions_repository_id_severity", "repository_id", "severity"),
+        Index("ix_suggestions_severity", "severity"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    review_id = Column(Integer, ForeignKey("reviews.id", ondelete="CASCADE"), index=True, nullable=False)
+    repository_id = Column(Integer, ForeignKey("repositories.id"), nullable=False)
+    file = Column(String, nullable=False)
+    line = Column(Integer)
+    severity = Column(String(16), nullable=False) # info, minor, major, critical
+    category = Column(String)
+    comment = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    review = relationship("Review", back_populates="suggestions")
+
+class ReviewStat(Base):
+    """Review counters rolled up at write time, one row per (repository, status, duration bucket)."""
+    __tablename__ = "review_stats"
+
+    repository = Column(String, primary_key=True) # owner/name
+    status = Column(String, primary_key=True)
+    duration_bucket = Column(Float, primary_key=True) # upper bound in seconds
+    review_count = Column(Integer, nullable=False, default=0)
+    suggestion_count = Column(Integer, nullable=False, default=0)
+    duration_sum = Column(Float, nullable=False, default=0.0)
+    # suggestion_count split by severity
+    info_count = Column(Integer, nullable=False, default=0)
+    minor_count = Column(Integer, nullable=False, default=0)
+    major_count = Column(Integer, nullable=False, default=0)
+    critical_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class Feedback(Base):
+    """Dashboard rating of a finished review."""
+    __tablename__ = "feedback"
+
+    id = Column(Integer, primary_key=True, index=True)
+    review_id = Column(Integer, ForeignKey("reviews.id"), index=True, nullable=False)
+    rating = Column(Integer, nullable=False) # 1-5
+    comment = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    review = relationship("Review")
@@ -0,0 +1,324 @@
+import asyncio
+import os
+import time
+from fnmatch import fnmatch
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .diff_parser import DiffParser, Hunk, aiter_hunks, estimate_tokens, render_diff
+from .llm import LLMProvider, SuggestionStream, dispatcher, parse_review
+from .review_cache import (
+    ReviewCache, assign_suggestions, get_review_cache, hunk_cache_key, rebase_suggestions, review_cache_namespace,
+)
+from .telemetry import record_stage, stage
+
+DEFAULT_EXCLUDE_GLOBS = ",".join([
+    "*.lock", "package-lock.json", "pnpm-lock.yaml", "go.sum",
+    "vendor/*", "*/vendor/*", "node_modules/*", "*/node_modules/*", "third_party/*",
+    "dist/*", "build/*", "*.min.js", "*.min.css", "*.map", "*.svg",
+    "*_pb2.py", "*.pb.go", "*.generated.*", "*.snap",
+])
+
+REVIEW_INCLUDE_GLOBS = os.getenv("REVIEW_INCLUDE_GLOBS", "")
+REVIEW_EXCLUDE_GLOBS = os.getenv("REVIEW_EXCLUDE_GLOBS", DEFAULT_EXCLUDE_GLOBS)
+REVIEW_MAX_HUNK_LINES = int(os.getenv("REVIEW_MAX_HUNK_LINES", "400"))
+REVIEW_MAX_FILE_LINES = int(os.getenv("REVIEW_MAX_FILE_LINES", "5000"))
+REVIEW_BATCH_TOKENS = int(os.getenv("REVIEW_BATCH_TOKENS", "6000"))
+REVIEW_MAX_CONCURRENCY = int(os.getenv("REVIEW_MAX_CONCURRENCY", "4"))
+REVIEW_LOOKUP_BATCH = int(os.getenv("REVIEW_LOOKUP_BATCH", "64"))
+REVIEW_STREAMING = os.getenv("REVIEW_STREAMING", "true").lower() == "true"
+
+# (path, suggestions for the file, new-file line ranges of its hunks)
+FileCallback = Callable[[str, List[Dict[str, Any]], List[Tuple[int, int]]], Awaitable[None]]
+
+
+def _split_globs(value: str) -> List[str]:
+    return [g.strip() for g in value.split(",") if g.strip()]
+
+
+class PathFilter:
+    def __init__(self, include: Optional[List[str]] = None, exclude: Optional[List[str]] = None):
+        self.include = include if include is not None else _split_globs(REVIEW_INCLUDE_GLOBS)
+        self.exclude = exclude if exclude is not None else _split_globs(REVIEW_EXCLUDE_GLOBS)
+
+    def __call__(self, path: str) -> bool:
+        name = path.rsplit("/", 1)[-1]
+        if self.include and not any(fnmatch(path, g) or fnmatch(name, g) for g in self.include):
+            return False
+        return not any(fnmatch(path, g) or fnmatch(name, g) for g in self.exclude)
+
+
+class ReviewPipeline:
+    """
+    Streams a diff through the parser, resolves hunks from the review cache,
+    packs the remaining ones into prompts of at most `token_budget` tokens and
+    reviews up to `max_concurrency` batches at a time. Parsing pauses while all
+    slots are busy, so memory stays bounded by the in-flight batches rather
+    than the size of the diff.
+
+    `context_provider`, when given, is called (in a thread) with the hunks of
+    each batch and returns extra prompt context for that batch, e.g. earlier
+    reviews of similar changes.
+
+    With `on_file`, each file is handed over as soon as all of its hunks have
+    been parsed and every batch containing them is reviewed, while later files
+    are still in flight, with the suggestions for the hunks reviewed in this
+    run; suggestions reused from the cache are only in the result. With
+    streaming, `on_suggestion` sees every suggestion as soon as the model has
+    finished writing it.
+    """
+
+    def __init__(
+        self,
+        provider: LLMProvider,
+        cache: Optional[ReviewCache] = None,
+        path_filter: Optional[PathFilter] = None,
+        token_budget: int = REVIEW_BATCH_TOKENS,
+        max_concurrency: int = REVIEW_MAX_CONCURRENCY,
+        max_hunk_lines: int = REVIEW_MAX_HUNK_LINES,
+        max_file_lines: int = REVIEW_MAX_FILE_LINES,
+        on_batch: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+        on_file: Optional[FileCallback] = None,
+        on_suggestion: Optional[Callable[[Dict[str, Any]], None]] = None,
+        stream: bool = REVIEW_STREAMING,
+        context_provider: Optional[Callable[[List[Hunk]], str]] = None,
+    ):
+        self.provider = provider
+        self.cache = cache or get_review_cache()
+        self.path_filter = path_filter or PathFilter()
+        self.token_budget = token_budget
+        self.max_concurrency = max_concurrency
+        self.max_hunk_lines = max_hunk_lines
+        self.max_file_lines = max_file_lines
+        # Called with (diff, parsed review) for every batch the model reviewed
+        self.on_batch = on_batch
+        self.on_file = on_file
+        self.on_suggestion = on_suggestion
+        self.stream = stream
+        self.context_provider = context_provider
+
+    async def run(
+        self,
+        lines: AsyncIterable[str],
+        context: str = "",
+        file_context: Optional[Dict[str, str]] = None,
+    ) -> Dict[str, Any]:
+        """
+        `context` is sent with every batch; `file_context` maps paths to extra
+        context that is only included in batches containing that file.
+        """
+        parser = DiffParser(self.path_filter, self.max_hunk_lines, self.max_file_lines)
+        # Retrieved context changes the prompt, so it gets its own cache entries
+        namespace = review_cache_namespace(self.provider, context + ("\0retrieval" if self.context_provider else ""))
+        slots = asyncio.Semaphore(self.max_concurrency)
+        tasks: List[asyncio.Task] = []
+        suggestions: List[Dict[str, Any]] = []
+        window: List[Hunk] = []
+        batch: List[Hunk] = []
+        batch_tokens = 0
+        counts = {"hunks": 0, "hits": 0}
+        # path -> hunk ranges, suggestions so far, batches still open, fully parsed
+        files: Dict[str, Dict[str, Any]] = {}
+        file_tasks: List[asyncio.Task] = []
+        open_path: Optional[str] = None
+
+        def file_state(path: str) -> Dict[str, Any]:
+            return files.setdefault(path, {"ranges": [], "suggestions": [], "pending": 0, "parsed": False, "done": False})
+
+        def maybe_finish(path: str):
+            state = files[path]
+            if self.on_file is None or state["done"] or not state["parsed"] or state["pending"]:
+                return
+            state["done"] = True
+            file_tasks.append(asyncio.create_task(self._emit_file(path, state)))
+
+        def mark_parsed(path: Optional[str]):
+            if path is not None:
+                file_state(path)["parsed"] = True
+                maybe_finish(path)
+
+        async def review(hunks: List[Hunk]):
+            paths = dict.fromkeys(h.path for h in hunks)
+            try:
+                result = await self._review_batch(
+                    hunks, await self._with_retrieved(hunks, _batch_context(hunks)), slots, namespace
+                )
+                for suggestion in result[1]:
+                    if suggestion.get("file") in paths:
+                        files[suggestion["file"]]["suggestions"].append(suggestion)
+                return result
+            finally:
+                for path in paths:
+                    files[path]["pending"] -= 1
+                    maybe_finish(path)
+
+        async def dispatch(hunks: List[Hunk]):
+            await slots.acquire()
+            tasks.append(asyncio.create_task(review(hunks)))
+
+        def _batch_context(hunks: List[Hunk]) -> str:
+            if not file_context:
+                return context
+            paths = dict.fromkeys(h.path for h in hunks)
+            extra = [f"{path}: {file_context[path]}" for path in paths if file_context.get(path)]
+            return "\n".join([context] + extra if context else extra)
+
+        async def resolve(hunks: List[Hunk]):
+            nonlocal batch, batch_tokens, open_path
+            keys = [hunk_cache_key(namespace, h) for h in hunks]
+            with stage("cache_lookup"):
+                cached = await asyncio.to_thread(self.cache.get_many, keys)
+            for hunk, key in zip(hunks, keys):
+                counts["hunks"] += 1
+                # A diff lists each file's hunks together, so a new path closes the previous file
+                if hunk.path != open_path:
+                    mark_parsed(open_path)
+                    open_path = hunk.path
+                state = file_state(hunk.path)
+                state["ranges"].append(hunk.new_range)
+                if key in cached:
+                    counts["hits"] += 1
+                    # Only in the result: on_file already saw these with the review that wrote them
+                    suggestions.extend(rebase_suggestions(hunk, cached[key]))
+                    continue
+                tokens = estimate_tokens(hunk)
+                if batch and batch_tokens + tokens > self.token_budget:
+                    await dispatch(batch)
+                    batch, batch_tokens = [], 0
+                if all(h.path != hunk.path for h in batch):
+                    state["pending"] += 1
+                batch.append(hunk)
+                batch_tokens += tokens
+
+        fetch_seconds = 0.0
+
+        async def timed(lines: AsyncIterable[str]):
+            # Time spent waiting on GitHub for the next chunk of the diff
+            nonlocal fetch_seconds
+            iterator = lines.__aiter__()
+            while True:
+                start = time.perf_counter()
+                try:
+                    line = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    fetch_seconds += time.perf_counter() - start
+                yield line
+
+        try:
+            async for hunk in aiter_hunks(timed(lines), parser):
+                window.append(hunk)
+                if len(window) >= REVIEW_LOOKUP_BATCH:
+                    await resolve(window)
+                    window = []
+            if window:
+                await resolve(window)
+            if batch:
+                await dispatch(batch)
+        except BaseException:
+            # The diff couldn't be read to the end: stop the batches already sent
+            for task in tasks + file_tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, *file_tasks, return_exceptions=True)
+            raise
+        mark_parsed(open_path)
+        record_stage("diff_fetch", fetch_seconds)
+
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.gather(*file_tasks)
+        failures = [r for r in results if isinstance(r, BaseException)]
+        for failure in failures:
+            print(f"Review batch failed: {failure!r}")
+        if failures and len(failures) == len(results):
+            raise failures[0]
+
+        summaries = []
+        for result in results:
+            if isinstance(result, BaseException):
+                continue
+            summary, batch_suggestions = result
+            if summary:
+                summaries.append(summary)
+            suggestions.extend(batch_suggestions)
+        suggestions.sort(key=lambda s: (s.get("file", ""), s["line"] if isinstance(s.get("line"), int) else 0))
+
+        if not counts["hunks"]:
+            summary = "No reviewable changes (all files were filtered out or the diff was empty)."
+        elif not tasks:
+            summary = "No new changes to review since the last revision."
+        else:
+            summary = "\n\n".join(summaries)
+        if failures:
+            summary += (
+                f"\n\n_Partial review: {len(failures)} of {len(tasks)} batches of changes could not be reviewed. "
+                "Push again to retry them._"
+            )
+
+        hits = counts["hits"]
+        return {
+            "summary": summary,
+            "partial": bool(failures),
+            "suggestions": suggestions,
+            "cache": {
+                "hunks": counts["hunks"],
+                "hits": hits,
+                "misses": counts["hunks"] - hits,
+                "hit_ratio": round(hits / counts["hunks"], 3) if counts["hunks"] else 0.0,
+            },
+            "stats": {
+                "batches": len(tasks),
+                "failed_batches": len(failures),
+                "skipped_files": sorted(parser.skipped_files),
+                "truncated_hunks": parser.truncated_hunks,
+            },
+        }
+
+    async def _with_retrieved(self, hunks: List[Hunk], context: str) -> str:
+        if self.context_provider is None:
+            return context
+        try:
+            with stage("retrieval"):
+                retrieved = await asyncio.to_thread(self.context_provider, hunks)
+        except Exception as e:
+            print(f"Context retrieval failed, reviewing without it: {e}")
+            return context
+        if not retrieved:
+            return context
+        return f"{context}\n{retrieved}" if context else retrieved
+
+    async def _emit_file(self, path: str, state: Dict[str, Any]):
+        suggestions = sorted(state["suggestions"], key=lambda s: s["line"] if isinstance(s.get("line"), int) else 0)
+        try:
+            await self.on_file(path, suggestions, state["ranges"])
+        except Exception as e:
+            print(f"File callback failed for {path}: {e}")
+
+    async def _review_batch(self, hunks: List[Hunk], context: str, slots: asyncio.Semaphore, namespace: str):
+        try:
+            with stage("prompt_build"):
+                diff = render_diff(hunks)
+            if self.stream:
+                parser = SuggestionStream()
+                async for chunk in dispatcher.stream(self.provider, diff, context):
+                    for suggestion in parser.feed(chunk):
+                        if self.on_suggestion is not None:
+                            self.on_suggestion(suggestion)
+                review = parser.result()
+            else:
+                review = parse_review(await dispatcher.review(self.provider, diff, context))
+            if self.on_batch is not None:
+                self.on_batch(diff, review)
+            assigned = assign_suggestions(hunks, review["suggestions"])
+            unassigned = assigned.pop(-1)
+
+            fresh: Dict[str, List[Dict[str, Any]]] = {}
+            suggestions = []
+            for i, hunk in enumerate(hunks):
+                fresh.setdefault(hunk_cache_key(namespace, hunk), []).extend(assigned[i])
+                suggestions.extend(rebase_suggestions(hunk, assigned[i]))
+            # Errors and cut-off output are shown but not cached, so the next push retries them
+            if not review.get("partial"):
+                await asyncio.to_thread(self.cache.set_many, fresh)
+            return review["summary"], suggestions + unassigned
+        finally:
+            slots.release()
@@ -0,0 +1,169 @@
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .github_service import GitHubClient
+from .telemetry import record_stage
+
+REVIEW_INLINE_COMMENTS = os.getenv("REVIEW_INLINE_COMMENTS", "true").lower() == "true"
+# Files finishing within this window of each other share one reviews API call
+REVIEW_POST_WINDOW_MS = int(os.getenv("REVIEW_POST_WINDOW_MS", "500"))
+# Minimum time between progress edits of the summary comment
+REVIEW_PROGRESS_SECONDS = float(os.getenv("REVIEW_PROGRESS_SECONDS", "10"))
+REVIEW_MAX_COMMENTS_PER_POST = int(os.getenv("REVIEW_MAX_COMMENTS_PER_POST", "50"))
+
+
+def _key(suggestion: Dict[str, Any]) -> Tuple[str, Any, str]:
+    return suggestion.get("file", ""), suggestion.get("line"), suggestion.get("comment", "")
+
+
+def _body(suggestion: Dict[str, Any]) -> str:
+    severity = suggestion.get("severity")
+    comment = suggestion.get("comment", "")
+    return f"**{severity}**: {comment}" if severity else comment
+
+
+def format_review_comment(review_result, inline: Iterable[Dict[str, Any]] = ()) -> str:
+    """Summary comment; suggestions already posted inline are only counted."""
+    posted = {_key(s) for s in inline}
+    remaining = [s for s in review_result["suggestions"] if _key(s) not in posted]
+    lines = ["## AI Code Review", "", review_result["summary"]]
+    if posted:
+        lines += ["", f"{len(posted)} suggestions were posted as inline comments."]
+    if remaining:
+        lines += ["", "### Suggestions", ""]
+        for s in remaining:
+            location = s.get("file", "")
+            if s.get("line"):
+                location += f":{s['line']}"
+            lines.append(f"- `{location}`: {_body(s)}")
+    return "\n".join(lines)
+
+
+class ReviewPublisher:
+    """
+    Publishes a review while it is still running. The summary comment is
+    created up front and edited in place; each file's suggestions go out as
+    inline comments as soon as the pipeline reports the file complete, with
+    files that finish close together batched into one pull request review.
+    Only suggestions on lines inside the diff can be inline comments (GitHub
+    rejects the whole review otherwise); the rest stay in the summary.
+    """
+
+    def __init__(
+        self,
+        client: GitHubClient,
+        owner: str,
+        repo: str,
+        pr_number: int,
+        commit_id: Optional[str],
+        should_post: Optional[Callable[[], Awaitable[bool]]] = None,
+        inline: bool = REVIEW_INLINE_COMMENTS,
+    ):
+        self.client = client
+        self.owner = owner
+        self.repo = repo
+        self.pr_number = pr_number
+        self.commit_id = commit_id
+        self.should_post = should_post
+        self.inline = inline and bool(commit_id)
+        self.comment_id: Optional[int] = None
+        self.posted: List[Dict[str, Any]] = []
+        self.stats = {"files": 0, "streamed": 0, "reviews": 0, "edits": 0}
+        self.started = time.monotonic()
+        self.first_feedback: Optional[float] = None
+        self._pending: List[Dict[str, Any]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._last_edit = 0.0
+        self._posting = asyncio.Lock()
+
+    async def start(self):
+        try:
+            comment = await self.client.post_comment(self.owner, self.repo, self.pr_number, self._progress())
+            self.comment_id = comment.get("id")
+            self._last_edit = time.monotonic()
+        except Exception as e:
+            print(f"Failed to create summary comment: {e}")
+
+    def on_suggestion(self, suggestion: Dict[str, Any]):
+        self.stats["streamed"] += 1
+
+    async def add_file(self, path: str, suggestions: List[Dict[str, Any]], ranges: List[Tuple[int, int]]):
+        self.stats["files"] += 1
+        if self.inline:
+            for s in suggestions:
+                line = s.get("line")
+                if isinstance(line, int) and any(start <= line <= end for start, end in ranges):
+                    self._pending.append(s)
+        if self._pending and self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+        if self.comment_id is not None and time.monotonic() - self._last_edit >= REVIEW_PROGRESS_SECONDS:
+            await self._edit(self._progress())
+
+    async def _flush_later(self):
+        await asyncio.sleep(REVIEW_POST_WINDOW_MS / 1000)
+        self._flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        """Post every inline comment that is waiting for the batching window."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        async with self._posting:
+            batch, self._pending = self._pending, []
+            if batch and (self.should_post is None or await self.should_post()):
+                await self._post(batch)
+
+    async def _post(self, batch: List[Dict[str, Any]]):
+        for start in range(0, len(batch), REVIEW_MAX_COMMENTS_PER_POST):
+            chunk = batch[start:start + REVIEW_MAX_COMMENTS_PER_POST]
+            comments = [{"path": s["file"], "line": s["line"], "body": _body(s)} for s in chunk]
+            paths = ", ".join(f"`{path}`" for path in dict.fromkeys(c["path"] for c in comments))
+            try:
+                await self.client.create_review(
+                    self.owner, self.repo, self.pr_number, self.commit_id, comments, body=f"AI review of {paths}"
+                )
+            except Exception as e:
+                print(f"Failed to post {len(chunk)} inline comments: {e}")
+                continue
+            self.posted.extend(chunk)
+            self.stats["reviews"] += 1
+            if self.first_feedback is None:
+                self.first_feedback = time.monotonic() - self.started
+                record_stage("first_feedback", self.first_feedback)
+
+    async def finish(self, review_result: Dict[str, Any]):
+        await self.flush()
+        body = format_review_comment(review_result, self.posted)
+        if self.comment_id is None:
+            await self.client.post_comment(self.owner, self.repo, self.pr_number, body)
+        else:
+            await self._edit(body)
+        if self.first_feedback is None:
+            self.first_feedback = time.monotonic() - self.started
+            record_stage("first_feedback", self.first_feedback)
+
+    async def abandon(self, message: str):
+        """Close out the summary comment of a review that won't finish."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        self._pending = []
+        if self.comment_id is not None:
+            try:
+                await self._edit(f"## AI Code Review\n\n{message}")
+            except Exception as e:
+                print(f"Failed to update summary comment: {e}")
+
+    def _progress(self) -> str:
+        done = f"{self.stats['files']} files reviewed" if self.stats["files"] else "Reviewing"
+        found = f", {self.stats['streamed']} suggestions so far" if self.stats["streamed"] else ""
+        inline = f" ({len(self.posted)} posted inline)" if self.posted else ""
+        return f"## AI Code Review\n\n_Review in progress: {done}{found}{inline}. This comment will be updated._"
+
+    async def _edit(self, body: str):
+        self._last_edit = time.monotonic()
+        self.stats["edits"] += 1
+        await self.client.update_comment(self.owner, self.repo, self.comment_id, body)
@@ -0,0 +1,54 @@
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import redis
+
+REDIS_URL = os.getenv("REDIS_URL", os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"))
+# How long Redis is left alone after it could not be reached
+REDIS_RETRY_SECONDS = float(os.getenv("REDIS_RETRY_SECONDS", "30"))
+
+_redis: Optional["redis.Redis"] = None
+# time.monotonic() before which Redis is not tried again
+_retry_at = 0.0
+_lock = threading.Lock()
+
+
+def get_redis() -> Optional["redis.Redis"]:
+    """
+    Shared Redis connection, or None while Redis isn't reachable. A failed
+    connection is retried after REDIS_RETRY_SECONDS; callers use their
+    in-process fallback until then.
+    """
+    global _redis, _retry_at
+    if _redis is not None or time.monotonic() < _retry_at:
+        return _redis
+    with _lock:
+        if _redis is None and time.monotonic() >= _retry_at:
+            try:
+                import redis
+
+                client = redis.Redis.from_url(REDIS_URL, socket_timeout=2)
+                client.ping()
+                _redis = client
+            except Exception as e:
+                print(f"Redis unavailable, using in-process fallback for {REDIS_RETRY_SECONDS:g}s: {e}")
+                _retry_at = time.monotonic() + REDIS_RETRY_SECONDS
+    return _redis
+
+
+def redis_failed(error: Exception):
+    """
+    Report a failed Redis command. A lost connection or timeout drops the
+    shared connection, so callers stop waiting on it until the next retry;
+    other errors only fail the call that raised them.
+    """
+    global _redis, _retry_at
+    import redis
+
+    if isinstance(error, (redis.ConnectionError, redis.TimeoutError)):
+        with _lock:
+            _redis = None
+            _retry_at = time.monotonic() + REDIS_RETRY_SECONDS
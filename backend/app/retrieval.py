@@ -0,0 +1,650 @@
+"""
+Retrieval of earlier reviews as prompt context.
+
+Every reviewed hunk that drew suggestions becomes an entry in its
+repository's index: an embedding of the changed lines plus the suggestions
+themselves. When a new batch is reviewed, each hunk is looked up and the
+suggestions made on the most similar past hunks are added to the prompt,
+within a token budget, so the model sees how this repository has been
+reviewed before.
+
+    python -m app.retrieval update              # index new collector records
+    python -m app.retrieval query owner/repo < change.diff
+"""
+import argparse
+import fcntl
+import json
+import math
+import os
+import re
+import sys
+import threading
+import zlib
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import func
+
+from .database import SessionLocal
+from .diff_parser import Hunk, split_hunks
+from .models import Feedback, PullRequest, Repository, Review
+from .review_cache import assign_suggestions
+
+REVIEW_CONTEXT = os.getenv("REVIEW_CONTEXT", "true").lower() == "true"
+REVIEW_CONTEXT_TOKENS = int(os.getenv("REVIEW_CONTEXT_TOKENS", "600"))
+# Past hunks considered per hunk under review
+REVIEW_CONTEXT_K = int(os.getenv("REVIEW_CONTEXT_K", "3"))
+REVIEW_CONTEXT_MIN_SCORE = float(os.getenv("REVIEW_CONTEXT_MIN_SCORE", "0.35"))
+REVIEW_INDEX_DIR = os.getenv("REVIEW_INDEX_DIR", "data/review_index")
+REVIEW_INDEX_DIM = int(os.getenv("REVIEW_INDEX_DIM", "256"))
+REVIEW_INDEX_NPROBE = int(os.getenv("REVIEW_INDEX_NPROBE", "8"))
+# Rows added since the last compaction are scanned exactly; past this many they're folded into the lists
+REVIEW_INDEX_TAIL_MAX = int(os.getenv("REVIEW_INDEX_TAIL_MAX", "20000"))
+# Smaller indexes have no centroids and are scanned exactly
+REVIEW_INDEX_IVF_MIN = int(os.getenv("REVIEW_INDEX_IVF_MIN", "50000"))
+REVIEW_INDEX_MAX_OPEN = int(os.getenv("REVIEW_INDEX_MAX_OPEN", "64"))
+# Reviews with any rating at or below this are left out of retrieval
+REVIEW_INDEX_REJECT_RATING = int(os.getenv("REVIEW_INDEX_REJECT_RATING", "2"))
+
+_TOKEN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+|[^\sA-Za-z0-9_]{1,3}")
+_SUBWORD = re.compile(r"[A-Z]?[a-z0-9]+|[A-Z]+(?![a-z])")
+_UNSAFE = re.compile(r"[^A-Za-z0-9._-]")
+_EMPTY_MANIFEST = {"generation": 0, "count": 0, "nlist": 0, "trained_on": 0}
+
+
+class HashingEmbedder:
+    """
+    Embeds a hunk without a model: identifiers of the changed lines, their
+    sub-words (camelCase / snake_case parts) and adjacent token pairs, plus
+    the file extension and directories, are hashed into `dim` signed buckets
+    with sublinear term weights and L2-normalized. Similarity is lexical,
+    which is what matters for "this repository has seen this kind of change".
+    """
+
+    def __init__(self, dim: int = REVIEW_INDEX_DIM):
+        import numpy as np
+
+        self.np = np
+        self.dim = dim
+
+    @staticmethod
+    def features(path: str, lines: Iterable[str]) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+
+        def add(feature: str):
+            counts[feature] = counts.get(feature, 0) + 1
+
+        name = path.rsplit("/", 1)[-1]
+        if "." in name:
+            add("ext:" + name.rsplit(".", 1)[-1].lower())
+        for part in path.split("/")[:-1]:
+            add("dir:" + part.lower())
+        for line in lines:
+            if line[:1] not in ("+", "-"):
+                continue
+            tokens = [t.lower() for t in _TOKEN.findall(line[1:])]
+            for i, token in enumerate(tokens):
+                add(token)
+                if i:
+                    add(tokens[i - 1] + " " + token)
+            for word in re.findall(r"[A-Za-z_][A-Za-z0-9_]*", line[1:]):
+                parts = _SUBWORD.findall(word)
+                if len(parts) > 1:
+                    for part in parts:
+                        add("w:" + part.lower())
+        return counts
+
+    def embed(self, items: Sequence[Tuple[str, Iterable[str]]]):
+        """(path, hunk lines) pairs to a float32 matrix of unit rows (zero rows for empty hunks)."""
+        np = self.np
+        out = np.zeros((len(items), self.dim), dtype=np.float32)
+        for row, (path, lines) in enumerate(items):
+            for feature, count in self.features(path, lines).items():
+                h = zlib.crc32(feature.encode())
+                weight = 1.0 + math.log(count)
+                out[row, h % self.dim] += weight if h & 0x80000000 else -weight
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        np.divide(out, norms, out=out, where=norms > 0)
+        return out
+
+
+def _nearest(np, vectors, centroids, chunk: int = 65536):
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk):
+        labels[start:start + chunk] = np.argmax(np.asarray(vectors[start:start + chunk]) @ centroids.T, axis=1)
+    return labels
+
+
+def _kmeans(np, vectors, k: int, iterations: int = 10, sample: int = 100_000):
+    """Spherical k-means on a sample of `vectors`; returns unit centroids."""
+    rng = np.random.default_rng(0)
+    if len(vectors) > sample:
+        data = np.asarray(vectors[np.sort(rng.choice(len(vectors), sample, replace=False))])
+    else:
+        data = np.asarray(vectors)
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _nearest(np, data, centroids)
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=k)
+        filled = np.nonzero(counts)[0]
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+        centroids[filled] = np.add.reduceat(data[order], starts, axis=0)
+        empty = np.nonzero(counts == 0)[0]
+        if len(empty):
+            centroids[empty] = data[rng.choice(len(data), len(empty), replace=False)]
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        np.divide(centroids, norms, out=centroids, where=norms > 0)
+    return centroids
+
+
+class VectorIndex:
+    """
+    Inverted-file (IVF) nearest-neighbour index over unit vectors, scored by
+    inner product and memory-mapped from files under `path`. The main part is
+    grouped by nearest k-means centroid, so a query only scans its `nprobe`
+    closest lists; rows added since the last compaction sit in an append-only
+    tail that is scanned exactly. Compaction folds the tail in as a new
+    generation of files, retraining the centroids whenever the index has
+    doubled since they were trained.
+
+    Processes share an index through the files: writers serialize on a file
+    lock, readers pick up appended rows and new generations on `refresh()`.
+    """
+
+    def __init__(self, path: str, dim: int = REVIEW_INDEX_DIM):
+        import numpy as np
+
+        self.np = np
+        self.path = path
+        self.dim = dim
+        os.makedirs(path, exist_ok=True)
+        self.manifest: Dict[str, int] = dict(_EMPTY_MANIFEST)
+        self.vectors = self.ids = self.offsets = self.centroids = None
+        self.tail_vectors = self.tail_ids = None
+        self.tail_count = 0
+        self._refresh_lock = threading.Lock()
+        self.refresh()
+
+    def __len__(self) -> int:
+        return self.manifest["count"] + self.tail_count
+
+    def _file(self, name: str, generation: Optional[int] = None) -> str:
+        generation = self.manifest["generation"] if generation is None else generation
+        return os.path.join(self.path, f"g{generation}.{name}")
+
+    @contextmanager
+    def locked(self):
+        """Exclusive write access across threads and processes."""
+        with open(os.path.join(self.path, "LOCK"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def refresh(self):
+        np = self.np
+        with self._refresh_lock:
+            for attempt in range(3):
+                try:
+                    self._refresh(np)
+                    return
+                except FileNotFoundError:
+                    # A compaction replaced the generation between reading the manifest and its files
+                    if attempt == 2:
+                        raise
+
+    def _refresh(self, np):
+        try:
+            with open(os.path.join(self.path, "manifest.json")) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = dict(_EMPTY_MANIFEST)
+        if manifest != self.manifest:
+            generation, count, nlist = manifest["generation"], manifest["count"], manifest["nlist"]
+            centroids = offsets = None
+            if nlist:
+                centroids = np.fromfile(self._file("centroids.f32", generation), dtype=np.float32).reshape(nlist, self.dim)
+                offsets = np.fromfile(self._file("offsets.i64", generation), dtype=np.int64)
+            vectors = ids = None
+            if count:
+                vectors = np.memmap(self._file("vectors.f32", generation), dtype=np.float32, mode="r", shape=(count, self.dim))
+                ids = np.memmap(self._file("ids.i64", generation), dtype=np.int64, mode="r", shape=(count,))
+            self.manifest = manifest
+            self.vectors, self.ids, self.centroids, self.offsets = vectors, ids, centroids, offsets
+            self.tail_count = -1
+        try:
+            # ids are written after vectors, so their length is the number of complete rows
+            tail = os.path.getsize(self._file("tail.ids.i64")) // 8
+        except FileNotFoundError:
+            tail = 0
+        if tail != self.tail_count:
+            self.tail_vectors = self.tail_ids = None
+            if tail:
+                self.tail_vectors = np.memmap(self._file("tail.vectors.f32"), dtype=np.float32, mode="r", shape=(tail, self.dim))
+                self.tail_ids = np.memmap(self._file("tail.ids.i64"), dtype=np.int64, mode="r", shape=(tail,))
+            self.tail_count = tail
+
+    def append(self, vectors, ids: Iterable[int]):
+        """Add rows to the tail. The caller holds `locked()`."""
+        np = self.np
+        self.refresh()
+        path = self._file("tail.vectors.f32")
+        if os.path.exists(path):
+            # Vectors of an interrupted append that never got their ids
+            os.truncate(path, self.tail_count * self.dim * 4)
+        with open(path, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self._file("tail.ids.i64"), "ab") as f:
+            f.write(np.asarray(list(ids), dtype=np.int64).tobytes())
+        self.refresh()
+        if self.tail_count > REVIEW_INDEX_TAIL_MAX:
+            self.compact()
+
+    def add(self, vectors, ids: Iterable[int]):
+        with self.locked():
+            self.append(vectors, ids)
+
+    def compact(self):
+        """Fold the tail into a new generation of the main index. The caller holds `locked()`."""
+        np = self.np
+        self.refresh()
+        parts = [(v, i) for v, i in ((self.vectors, self.ids), (self.tail_vectors, self.tail_ids)) if v is not None]
+        if not parts:
+            return
+        vectors = np.concatenate([np.asarray(v) for v, _ in parts])
+        ids = np.concatenate([np.asarray(i) for _, i in parts])
+        previous = self.manifest["generation"]
+        generation = previous + 1
+        manifest = {"generation": generation, "count": len(ids), "nlist": 0, "trained_on": self.manifest["trained_on"]}
+        order = None
+        if len(ids) >= REVIEW_INDEX_IVF_MIN:
+            centroids = self.centroids
+            if centroids is None or len(ids) >= 2 * manifest["trained_on"]:
+                nlist = min(max(int(math.sqrt(len(ids))), 16), 4096)
+                centroids = _kmeans(np, vectors, nlist)
+                manifest["trained_on"] = len(ids)
+            labels = _nearest(np, vectors, centroids)
+            order = np.argsort(labels, kind="stable")
+            offsets = np.searchsorted(labels[order], np.arange(len(centroids) + 1)).astype(np.int64)
+            centroids.astype(np.float32).tofile(self._file("centroids.f32", generation))
+            offsets.tofile(self._file("offsets.i64", generation))
+            manifest["nlist"] = len(centroids)
+
+        with open(self._file("vectors.f32", generation), "wb") as f:
+            for start in range(0, len(ids), 65536):
+                chunk = slice(start, start + 65536)
+                f.write((vectors[chunk] if order is None else vectors[order[chunk]]).tobytes())
+        (ids if order is None else ids[order]).tofile(self._file("ids.i64", generation))
+        manifest_path = os.path.join(self.path, "manifest.json")
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+        for name in os.listdir(self.path):
+            if name.startswith(f"g{previous}."):
+                os.remove(os.path.join(self.path, name))
+        self.refresh()
+
+    def search(self, queries, k: int, nprobe: int = REVIEW_INDEX_NPROBE) -> List[List[Tuple[int, float]]]:
+        """Top `k` (id, score) pairs for each row of `queries`, best first."""
+        np = self.np
+        self.refresh()
+        queries = np.asarray(queries, dtype=np.float32)
+        vectors, ids, offsets, centroids = self.vectors, self.ids, self.offsets, self.centroids
+        tail_vectors, tail_ids = self.tail_vectors, self.tail_ids
+        found: List[List[Tuple[Any, Any]]] = [[] for _ in range(len(queries))]
+        everyone = np.arange(len(queries))
+
+        def scan(rows, row_ids, members):
+            scores = np.asarray(rows) @ queries[members].T
+            if len(scores) > k:
+                top = np.argpartition(-scores, k - 1, axis=0)[:k]
+                scores = np.take_along_axis(scores, top, axis=0)
+                selected = np.asarray(row_ids)[top]
+            else:
+                selected = np.repeat(np.asarray(row_ids)[:, None], len(members), axis=1)
+            for column, query in enumerate(members):
+                found[query].append((scores[:, column], selected[:, column]))
+
+        if vectors is not None:
+            if centroids is None:
+                scan(vectors, ids, everyone)
+            else:
+                nprobe = min(nprobe, len(centroids))
+                probes = np.argpartition(-(queries @ centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+                for label in np.unique(probes):
+                    start, end = offsets[label], offsets[label + 1]
+                    if start < end:
+                        scan(vectors[start:end], ids[start:end], np.nonzero((probes == label).any(axis=1))[0])
+        if tail_vectors is not None:
+            scan(tail_vectors, tail_ids, everyone)
+
+        results = []
+        for parts in found:
+            if not parts:
+                results.append([])
+                continue
+            scores = np.concatenate([s for s, _ in parts])
+            row_ids = np.concatenate([i for _, i in parts])
+            top = np.argsort(-scores, kind="stable")[:k]
+            results.append([(int(row_ids[i]), float(scores[i])) for i in top])
+        return results
+
+
+class EntryLog:
+    """Append-only JSON records addressed by row number: `<path>.jsonl` plus an offsets file."""
+
+    def __init__(self, path: str):
+        self.data_path = path + ".jsonl"
+        self.index_path = path + ".idx"
+
+    def __len__(self) -> int:
+        try:
+            return os.path.getsize(self.index_path) // 8
+        except FileNotFoundError:
+            return 0
+
+    def append(self, entries: List[Dict[str, Any]]) -> int:
+        """Store entries and return the id of the first. The caller holds the index lock."""
+        first = len(self)
+        offsets = array("q")
+        chunks = []
+        with open(self.data_path, "ab") as f:
+            position = f.tell()
+            for entry in entries:
+                data = json.dumps(entry).encode() + b"\n"
+                offsets.append(position)
+                chunks.append(data)
+                position += len(data)
+            f.write(b"".join(chunks))
+        with open(self.index_path, "ab") as f:
+            f.write(offsets.tobytes())
+        return first
+
+    def get(self, ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        ids = list(ids)
+        if not ids:
+            return {}
+        entries = {}
+        with open(self.index_path, "rb") as index, open(self.data_path, "rb") as data:
+            for entry_id in ids:
+                index.seek(entry_id * 8)
+                offset = array("q", index.read(8))
+                data.seek(offset[0])
+                entries[entry_id] = json.loads(data.readline())
+        return entries
+
+
+class ReviewIndex:
+    """The vector index and entry records of one repository."""
+
+    def __init__(self, path: str, dim: int = REVIEW_INDEX_DIM):
+        self.vectors = VectorIndex(path, dim)
+        self.entries = EntryLog(os.path.join(path, "entries"))
+
+    def add(self, vectors, entries: List[Dict[str, Any]]):
+        with self.vectors.locked():
+            first = self.entries.append(entries)
+            self.vectors.append(vectors, range(first, first + len(entries)))
+
+
+def review_entries(diff: str, review: Dict[str, Any], review_id: Optional[int] = None) -> List[Tuple[Hunk, Dict[str, Any]]]:
+    """Index entries for the hunks of a reviewed batch that drew suggestions."""
+    hunks = split_hunks(diff)
+    if not hunks:
+        return []
+    assigned = assign_suggestions(hunks, review.get("suggestions") or [])
+    entries = []
+    for i, hunk in enumerate(hunks):
+        comments = [str(s["comment"]).strip()[:400] for s in assigned[i] if s.get("comment")]
+        if not comments:
+            continue
+        changed = next((line[1:].strip() for line in hunk.lines if line[:1] == "+" and line[1:].strip()), "")
+        entries.append((hunk, {
+            "review_id": review_id,
+            "path": hunk.path,
+            "fingerprint": hunk.fingerprint(),
+            "snippet": changed[:100],
+            "suggestions": comments,
+        }))
+    return entries
+
+
+def _review_info(review_ids: Set[int]) -> Tuple[Dict[int, str], Dict[int, int]]:
+    """Repository and lowest rating of each review."""
+    if not review_ids:
+        return {}, {}
+    db = SessionLocal()
+    try:
+        repositories = {
+            review_id: f"{owner}/{name}"
+            for review_id, owner, name in db.query(Review.id, Repository.owner, Repository.name)
+            .join(PullRequest, PullRequest.id == Review.pull_request_id)
+            .join(Repository, Repository.id == PullRequest.repository_id)
+            .filter(Review.id.in_(review_ids))
+        }
+        ratings = dict(
+            db.query(Feedback.review_id, func.min(Feedback.rating))
+            .filter(Feedback.review_id.in_(review_ids))
+            .group_by(Feedback.review_id)
+        )
+        return repositories, ratings
+    except Exception as e:
+        print(f"Failed to look up reviews for indexing: {e}")
+        return {}, {}
+    finally:
+        db.close()
+
+
+def reject_reviews(review_ids: Iterable[int], root: str = REVIEW_INDEX_DIR):
+    """Hide the suggestions of poorly rated reviews from retrieval."""
+    review_ids = array("q", review_ids)
+    if not review_ids:
+        return
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, "rejected.i64"), "ab") as f:
+        f.write(review_ids.tobytes())
+
+
+class ReviewIndexStore:
+    """
+    One ReviewIndex per repository under `root`, so retrieval surfaces the
+    repository's own conventions. Indexes are opened on first use and the
+    least recently used are dropped past REVIEW_INDEX_MAX_OPEN. New reviews
+    reach the indexes through `update()`, which consumes the collector log
+    from where the previous update stopped.
+    """
+
+    def __init__(self, root: str = REVIEW_INDEX_DIR, embedder: Optional[HashingEmbedder] = None, dim: int = REVIEW_INDEX_DIM):
+        self.root = root
+        self.dim = dim
+        self.embedder = embedder or HashingEmbedder(dim)
+        self._open: "OrderedDict[str, ReviewIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._rejected: Set[int] = set()
+        self._rejected_bytes = 0
+        self._updater: Optional[threading.Thread] = None
+
+    def path_for(self, repository: str) -> str:
+        return os.path.join(self.root, *(_UNSAFE.sub("_", part) or "_" for part in repository.split("/", 1)))
+
+    def index_for(self, repository: str, create: bool = False) -> Optional[ReviewIndex]:
+        with self._lock:
+            index = self._open.get(repository)
+            if index is not None:
+                self._open.move_to_end(repository)
+                return index
+            path = self.path_for(repository)
+            if not create and not os.path.isdir(path):
+                return None
+            index = self._open[repository] = ReviewIndex(path, self.dim)
+            while len(self._open) > REVIEW_INDEX_MAX_OPEN:
+                self._open.popitem(last=False)
+            return index
+
+    def rejected(self) -> Set[int]:
+        path = os.path.join(self.root, "rejected.i64")
+        try:
+            size = os.path.getsize(path) // 8 * 8
+        except FileNotFoundError:
+            return self._rejected
+        if size > self._rejected_bytes:
+            with open(path, "rb") as f:
+                f.seek(self._rejected_bytes)
+                self._rejected.update(array("q", f.read(size - self._rejected_bytes)))
+            self._rejected_bytes = size
+        return self._rejected
+
+    def add(self, repository: str, entries: List[Tuple[Hunk, Dict[str, Any]]]):
+        if not entries:
+            return
+        vectors = self.embedder.embed([(hunk.path, hunk.lines) for hunk, _ in entries])
+        self.index_for(repository, create=True).add(vectors, [entry for _, entry in entries])
+
+    def search(
+        self, repository: str, hunks: List[Hunk], k: int = REVIEW_CONTEXT_K, min_score: float = REVIEW_CONTEXT_MIN_SCORE
+    ) -> List[List[Tuple[Dict[str, Any], float]]]:
+        """Up to `k` (entry, score) matches per hunk from earlier reviews, best first."""
+        index = self.index_for(repository)
+        if index is None or not len(index.vectors) or not hunks:
+            return [[] for _ in hunks]
+        # Over-fetch: identical hunks and rejected reviews are dropped below
+        hits = index.vectors.search(self.embedder.embed([(h.path, h.lines) for h in hunks]), 2 * k)
+        entries = index.entries.get({i for row in hits for i, score in row if score >= min_score})
+        rejected = self.rejected()
+        results = []
+        for hunk, row in zip(hunks, hits):
+            fingerprint = hunk.fingerprint()
+            matches = []
+            for entry_id, score in row:
+                entry = entries.get(entry_id)
+                if entry is None or entry.get("fingerprint") == fingerprint or entry.get("review_id") in rejected:
+                    continue
+                matches.append((entry, score))
+            results.append(matches[:k])
+        return results
+
+    def context_for(self, repository: str, hunks: List[Hunk], token_budget: int = REVIEW_CONTEXT_TOKENS) -> str:
+        """Prompt context with the most relevant earlier suggestions, within `token_budget` (~4 characters a token)."""
+        matches = sorted(
+            (match for row in self.search(repository, hunks) for match in row), key=lambda m: m[1], reverse=True
+        )
+        header = "Suggestions from earlier reviews of similar changes in this repository:"
+        lines, seen = [], set()
+        used = len(header) // 4 + 1
+        for entry, _ in matches:
+            for comment in entry["suggestions"]:
+                if comment in seen:
+                    continue
+                snippet = f" (`{entry['snippet']}`)" if entry.get("snippet") else ""
+                line = f"- {entry['path']}{snippet}: {comment}"
+                cost = len(line) // 4 + 1
+                if used + cost > token_budget:
+                    return "\n".join([header] + lines) if lines else ""
+                seen.add(comment)
+                lines.append(line)
+                used += cost
+        return "\n".join([header] + lines) if lines else ""
+
+    def update(self, collector=None, batch_size: int = 500) -> Optional[Dict[str, int]]:
+        """
+        Index collector records appended since the last update. Returns counts,
+        or None when another process is already updating.
+        """
+        from .collector import get_collector
+
+        collector = collector or get_collector()
+        os.makedirs(self.root, exist_ok=True)
+        state_path = os.path.join(self.root, "state.json")
+        with open(os.path.join(self.root, "UPDATE.lock"), "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            offset = 0
+            if os.path.exists(state_path):
+                with open(state_path) as f:
+                    offset = json.load(f)["offset"]
+            stats = {"records": 0, "entries": 0, "skipped": 0}
+            pending: List[Dict[str, Any]] = []
+
+            def commit(offset: int):
+                self._index_records(pending, stats)
+                pending.clear()
+                with open(state_path + ".tmp", "w") as f:
+                    json.dump({"offset": offset}, f)
+                os.replace(state_path + ".tmp", state_path)
+
+            for record_offset, record in collector.iter_dataset(start_offset=offset):
+                pending.append(record)
+                offset = record_offset + 1
+                if len(pending) >= batch_size:
+                    commit(offset)
+            if pending:
+                commit(offset)
+            return stats
+
+    def _index_records(self, records: List[Dict[str, Any]], stats: Dict[str, int]):
+        repositories, ratings = _review_info({r["review_id"] for r in records if r.get("review_id") is not None})
+        by_repository: Dict[str, List[Tuple[Hunk, Dict[str, Any]]]] = {}
+        for record in records:
+            stats["records"] += 1
+            review_id = record.get("review_id")
+            repository = record.get("repository") or repositories.get(review_id)
+            rating = (record.get("feedback") or {}).get("rating") or ratings.get(review_id)
+            if not repository or not isinstance(record.get("review"), dict) or (
+                rating is not None and rating <= REVIEW_INDEX_REJECT_RATING
+            ):
+                stats["skipped"] += 1
+                continue
+            by_repository.setdefault(repository, []).extend(review_entries(record.get("diff") or "", record["review"], review_id))
+        for repository, entries in by_repository.items():
+            self.add(repository, entries)
+            stats["entries"] += len(entries)
+
+    def update_in_background(self):
+        """Start an update in a daemon thread unless this process already has one running."""
+        with self._lock:
+            if self._updater is not None and self._updater.is_alive():
+                return
+            self._updater = threading.Thread(target=self._update_quietly, name="review-index-update", daemon=True)
+            self._updater.start()
+
+    def _update_quietly(self):
+        try:
+            stats = self.update()
+            if stats and stats["entries"]:
+                print(f"Review index updated: {stats}")
+        except Exception as e:
+            print(f"Review index update failed: {e}")
+
+
+_store: Optional[ReviewIndexStore] = None
+_store_lock = threading.Lock()
+
+
+def get_review_index_store() -> ReviewIndexStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ReviewIndexStore()
+        return _store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain and query the review retrieval index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("update", help="index collector records added since the last update")
+    query = commands.add_parser("query", help="print the prompt context retrieved for a diff on stdin")
+    query.add_argument("repository", help="owner/repo")
+    query.add_argument("--tokens", type=int, default=REVIEW_CONTEXT_TOKENS)
+    args = parser.parse_args()
+
+    store = get_review_index_store()
+    if args.command == "update":
+        print(store.update() or "Another process is updating the index")
+    else:
+        print(store.context_for(args.repository, split_hunks(sys.stdin.read()), args.tokens))
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+from .diff_parser import Hunk
+from .llm import REVIEW_PROMPT_VERSION, LLMProvider
+from .redis_client import get_redis, redis_failed
+
+REVIEW_CACHE_TTL = int(os.getenv("REVIEW_CACHE_TTL", str(7 * 24 * 3600)))
+REVIEW_CACHE_SIZE = int(os.getenv("REVIEW_CACHE_SIZE", "10000"))
+REVIEW_CACHE_PREFIX = "review-cache:"
+
+
+class ReviewCache:
+    """
+    Suggestions per hunk fingerprint. Entries live in Redis with a sliding TTL
+    (refreshed on every hit, so with an allkeys-lru maxmemory policy cold hunks
+    are evicted first); without Redis, or when a Redis call fails, an
+    in-process LRU of REVIEW_CACHE_SIZE entries is used instead. `redis` is
+    a client or a function returning one per call, e.g. get_redis, so the
+    cache follows Redis going away and coming back.
+    """
+
+    def __init__(self, redis=None, ttl: int = REVIEW_CACHE_TTL, max_entries: int = REVIEW_CACHE_SIZE, prefix: str = REVIEW_CACHE_PREFIX):
+        self.redis = redis
+        self.prefix = prefix
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _client(self):
+        return self.redis() if callable(self.redis) else self.redis
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+        redis = self._client()
+        if redis is not None:
+            try:
+                values = redis.mget([self.prefix + k for k in keys])
+                found = {k: json.loads(v) for k, v in zip(keys, values) if v is not None}
+                if found:
+                    pipe = redis.pipeline(transaction=False)
+                    for k in found:
+                        pipe.expire(self.prefix + k, self.ttl)
+                    pipe.execute()
+                return found
+            except Exception as e:
+                print(f"Review cache read failed, reading the local cache: {e}")
+                redis_failed(e)
+
+        now = time.time()
+        found = {}
+        with self._lock:
+            for k in keys:
+                entry = self._local.get(k)
+                if entry is None:
+                    continue
+                expires, value = entry
+                if expires < now:
+                    del self._local[k]
+                    continue
+                self._local.move_to_end(k)
+                found[k] = value
+        return found
+
+    def set_many(self, items: Dict[str, Any]):
+        if not items:
+            return
+        redis = self._client()
+        if redis is not None:
+            try:
+                pipe = redis.pipeline(transaction=False)
+                for k, v in items.items():
+                    pipe.set(self.prefix + k, json.dumps(v), ex=self.ttl)
+                pipe.execute()
+                return
+            except Exception as e:
+                print(f"Review cache write failed, writing the local cache: {e}")
+                redis_failed(e)
+
+        expires = time.time() + self.ttl
+        with self._lock:
+            for k, v in items.items():
+                self._local[k] = (expires, v)
+                self._local.move_to_end(k)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+
+
+_default_cache: Optional[ReviewCache] = None
+
+
+def get_review_cache() -> ReviewCache:
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ReviewCache(redis=get_redis)
+    return _default_cache
+
+
+def review_cache_namespace(provider: LLMProvider, context: str = "") -> str:
+    """
+    Prefix for the cache keys of hunks reviewed by `provider` with `context`:
+    another model, prompt version or context doesn't reuse those reviews.
+    """
+    key = "\0".join([provider.version(), REVIEW_PROMPT_VERSION, context])
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def hunk_cache_key(namespace: str, hunk: Hunk) -> str:
+    return f"{namespace}:{hunk.fingerprint()}"
+
+
+def assign_suggestions(hunks: List[Hunk], suggestions: List[Dict[str, Any]]) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    Map suggestions onto the hunks they refer to (by index into `hunks`), storing
+    each line as an offset from the hunk start so it can be rebased on reuse.
+    Suggestions that can't be attributed to a hunk are returned under key -1.
+    """
+    assigned: Dict[int, List[Dict[str, Any]]] = {i: [] for i in range(len(hunks))}
+    assigned[-1] = []
+    for suggestion in suggestions:
+        path = suggestion.get("file") or suggestion.get("path") or ""
+        candidates = [i for i, h in enumerate(hunks) if h.path == path or h.path.endswith("/" + path)]
+        if not candidates:
+            assigned[-1].append(suggestion)
+            continue
+        try:
+            line = int(suggestion.get("line"))
+        except (TypeError, ValueError):
+            line = None
+        target = candidates[0]
+        if line is not None:
+            target = min(candidates, key=lambda i: _distance(hunks[i], line))
+        entry = dict(suggestion)
+        entry["file"] = hunks[target].path
+        entry.pop("line", None)
+        if line is not None:
+            entry["offset"] = line - hunks[target].new_start
+        assigned[target].append(entry)
+    return assigned
+
+
+def _distance(hunk: Hunk, line: int) -> int:
+    start, end = hunk.new_range
+    if start <= line <= end:
+        return 0
+    return min(abs(line - start), abs(line - end))
+
+
+def rebase_suggestions(hunk: Hunk, entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    rebased = []
+    for entry in entries:
+        suggestion = dict(entry)
+        offset = suggestion.pop("offset", None)
+        suggestion["file"] = hunk.path
+        if offset is not None:
+            suggestion["line"] = hunk.new_start + offset
+        rebased.append(suggestion)
+    return rebased
+
@@ -0,0 +1,429 @@
+"""
+Routes model calls across several providers.
+
+The router is an LLMProvider itself, registered as "router": set
+LLM_PROVIDER=router (or just LLM_ROUTER_PROVIDERS) and the pipeline and
+dispatcher use it like any single provider. Per call it:
+
+- orders the healthy providers: small prompts go to the cheapest,
+  larger ones to the fastest by rolling latency and error rate;
+- moves providers that are at their concurrency limit or can't take the
+  prompt size to the back;
+- sends a hedged copy to the next provider when the first hasn't answered
+  (or, streaming, produced its first chunk) within its rolling p95, within
+  a hedge budget, and takes whichever finishes first;
+- falls back to the next provider when a call fails or times out;
+- trips a per-provider circuit breaker on repeated failures, retrying it
+  with a single probe call after a cooldown.
+"""
+import asyncio
+import os
+import time
+import weakref
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .llm import LLMProvider, build_provider
+from .telemetry import record_llm_attempt, record_router_event
+
+LLM_ROUTER_PROVIDERS = os.getenv("LLM_ROUTER_PROVIDERS", "")
+# Relative cost per 1k prompt tokens
+LLM_ROUTER_COSTS = os.getenv("LLM_ROUTER_COSTS", "openai=10,gemini=1,local=0")
+LLM_ROUTER_CONCURRENCY = os.getenv("LLM_ROUTER_CONCURRENCY", "")
+LLM_ROUTER_DEFAULT_CONCURRENCY = int(os.getenv("LLM_ROUTER_DEFAULT_CONCURRENCY", "16"))
+# Largest prompt (estimated tokens) a provider is given while another one could take it
+LLM_ROUTER_MAX_TOKENS = os.getenv("LLM_ROUTER_MAX_TOKENS", "local=3000")
+# Prompts up to this size go to the cheapest provider rather than the fastest
+LLM_ROUTER_SMALL_TOKENS = int(os.getenv("LLM_ROUTER_SMALL_TOKENS", "1500"))
+LLM_ROUTER_TIMEOUT_SECONDS = float(os.getenv("LLM_ROUTER_TIMEOUT_SECONDS", "120"))
+# Hedged requests allowed per routed request, on average
+LLM_ROUTER_HEDGE_BUDGET = float(os.getenv("LLM_ROUTER_HEDGE_BUDGET", "0.1"))
+LLM_ROUTER_HEDGE_MIN_SECONDS = float(os.getenv("LLM_ROUTER_HEDGE_MIN_SECONDS", "1"))
+# Hedge delay until a provider has LLM_ROUTER_MIN_SAMPLES calls to compute its p95 from
+LLM_ROUTER_HEDGE_DEFAULT_SECONDS = float(os.getenv("LLM_ROUTER_HEDGE_DEFAULT_SECONDS", "20"))
+LLM_ROUTER_WINDOW = int(os.getenv("LLM_ROUTER_WINDOW", "200"))
+LLM_ROUTER_MIN_SAMPLES = int(os.getenv("LLM_ROUTER_MIN_SAMPLES", "20"))
+LLM_ROUTER_BREAKER_FAILURES = int(os.getenv("LLM_ROUTER_BREAKER_FAILURES", "5"))
+LLM_ROUTER_BREAKER_ERROR_RATE = float(os.getenv("LLM_ROUTER_BREAKER_ERROR_RATE", "0.5"))
+LLM_ROUTER_BREAKER_SECONDS = float(os.getenv("LLM_ROUTER_BREAKER_SECONDS", "30"))
+LLM_ROUTER_BREAKER_MAX_SECONDS = float(os.getenv("LLM_ROUTER_BREAKER_MAX_SECONDS", "300"))
+
+# Unused hedges carry over up to this many
+_HEDGE_BURST = 5.0
+
+
+def _parse_map(value: str, cast: Callable[[str], Any]) -> Dict[str, Any]:
+    parsed = {}
+    for item in value.split(","):
+        name, _, setting = item.strip().partition("=")
+        try:
+            parsed[name.strip()] = cast(setting.strip())
+        except ValueError:
+            continue
+    return parsed
+
+
+def _percentile(samples: List[Tuple[float, bool]], q: float) -> float:
+    """
+    q-th percentile of (seconds, observed) latencies. A sample that isn't
+    observed is censored: the call was cancelled after that long, so it would
+    have taken longer. Kaplan-Meier estimate; without censored samples this is
+    the plain percentile, and past the last observed latency the longest
+    sample is returned as a lower bound.
+    """
+    # Completions sort before cancellations at the same time; those were still at risk
+    ordered = sorted(samples, key=lambda sample: (sample[0], not sample[1]))
+    at_risk = len(ordered)
+    survival = 1.0
+    for seconds, observed in ordered:
+        if observed:
+            survival *= 1 - 1 / at_risk
+            # Rounding in the product would otherwise stop one sample early at exact quantiles
+            if 1 - survival > q / 100 + 1e-9:
+                return seconds
+        at_risk -= 1
+    return ordered[-1][0]
+
+
+def configured_providers() -> List[str]:
+    """LLM_ROUTER_PROVIDERS, or every provider with credentials configured."""
+    if LLM_ROUTER_PROVIDERS:
+        return [name.strip() for name in LLM_ROUTER_PROVIDERS.split(",") if name.strip()]
+    names = []
+    if os.getenv("USE_LOCAL_LLM", "false").lower() == "true":
+        names.append("local")
+    if os.getenv("OPENAI_API_KEY"):
+        names.append("openai")
+    if os.getenv("GEMINI_API_KEY"):
+        names.append("gemini")
+    return names
+
+
+class RoutedProvider:
+    """One provider behind the router: rolling stats, concurrency limit and circuit breaker."""
+
+    def __init__(self, provider: LLMProvider, cost: float, max_concurrency: int, max_tokens: Optional[int] = None):
+        self.provider = provider
+        self.name = provider.name
+        self.cost = cost
+        self.max_concurrency = max_concurrency
+        self.max_tokens = max_tokens
+        # (seconds, ok) of recent calls, ok None for calls cancelled as hedge
+        # losers, and (seconds, observed) to the first chunk of recent streams
+        self.calls: deque = deque(maxlen=LLM_ROUTER_WINDOW)
+        self.first_chunks: deque = deque(maxlen=LLM_ROUTER_WINDOW)
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        # While the breaker is open; once it has passed, the next call is the probe
+        self.open_until = 0.0
+        self.cooldown = LLM_ROUTER_BREAKER_SECONDS
+        self.probing = False
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+    def available(self, now: float) -> bool:
+        return not self.open_until or (now >= self.open_until and not self.probing)
+
+    def saturated(self) -> bool:
+        return self.in_flight >= self.max_concurrency
+
+    def error_rate(self) -> float:
+        finished = [ok for _, ok in self.calls if ok is not None]
+        return sum(1 for ok in finished if not ok) / len(finished) if finished else 0.0
+
+    def latency(self, q: float, first_chunk: bool = False) -> Optional[float]:
+        # Cancelled calls count as censored samples: leaving them out would only keep the fast ones
+        if first_chunk:
+            samples = list(self.first_chunks)
+        else:
+            samples = [(seconds, ok is not None) for seconds, ok in self.calls if ok is not False]
+        if len(samples) < LLM_ROUTER_MIN_SAMPLES or not any(observed for _, observed in samples):
+            return None
+        return _percentile(samples, q)
+
+    def expected_latency(self) -> float:
+        """Median latency inflated by the error rate; 0 until there are enough samples, so new providers get tried."""
+        median = self.latency(50)
+        return median / max(1.0 - self.error_rate(), 0.1) if median is not None else 0.0
+
+    def hedge_delay(self, first_chunk: bool = False) -> float:
+        p95 = self.latency(95, first_chunk)
+        return max(p95 if p95 is not None else LLM_ROUTER_HEDGE_DEFAULT_SECONDS, LLM_ROUTER_HEDGE_MIN_SECONDS)
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        await semaphore.acquire()
+        self.in_flight += 1
+        if self.open_until:
+            self.probing = True
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphores[asyncio.get_running_loop()].release()
+
+    def record_cancelled(self, seconds: float, first_chunk: bool = False):
+        """A call cancelled after `seconds` (it lost a hedge race): it would have taken longer."""
+        if first_chunk:
+            self.first_chunks.append((seconds, False))
+        self.calls.append((seconds, None))
+        self.probing = False
+
+    def record(self, seconds: float, ok: bool):
+        self.calls.append((seconds, ok))
+        if ok:
+            record_llm_attempt(self.name, seconds)
+            self.consecutive_failures = 0
+            if self.open_until:
+                print(f"LLM router: {self.name} recovered, circuit closed")
+                record_router_event(self.name, "breaker_close")
+                self.open_until = 0.0
+                self.cooldown = LLM_ROUTER_BREAKER_SECONDS
+                # Failures from before the outage shouldn't trip the breaker again straight away
+                self.calls = deque((call for call in self.calls if call[1] is not False), maxlen=LLM_ROUTER_WINDOW)
+            self.probing = False
+            return
+        self.consecutive_failures += 1
+        failing = (
+            self.probing
+            or self.consecutive_failures >= LLM_ROUTER_BREAKER_FAILURES
+            or (len(self.calls) >= LLM_ROUTER_MIN_SAMPLES and self.error_rate() >= LLM_ROUTER_BREAKER_ERROR_RATE)
+        )
+        if failing and (not self.open_until or self.probing):
+            print(f"LLM router: {self.name} failing, circuit open for {self.cooldown:.0f}s")
+            record_router_event(self.name, "breaker_open")
+            self.open_until = time.monotonic() + self.cooldown
+            self.cooldown = min(self.cooldown * 2, LLM_ROUTER_BREAKER_MAX_SECONDS)
+        self.probing = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        p50, p95 = self.latency(50), self.latency(95)
+        return {
+            "calls": len(self.calls),
+            "error_rate": round(self.error_rate(), 3),
+            "p50_seconds": round(p50, 3) if p50 is not None else None,
+            "p95_seconds": round(p95, 3) if p95 is not None else None,
+            "in_flight": self.in_flight,
+            "circuit": "closed" if not self.open_until else ("open" if time.monotonic() < self.open_until else "half-open"),
+        }
+
+
+class ProviderRouter(LLMProvider):
+    name = "router"
+
+    def __init__(self, providers: List[RoutedProvider], small_tokens: int = LLM_ROUTER_SMALL_TOKENS):
+        if not providers:
+            raise ValueError("LLM router has no providers")
+        self.providers = providers
+        self.small_tokens = small_tokens
+        self.stats = {"requests": 0, "hedges": 0, "hedge_wins": 0, "fallbacks": 0, "failures": 0}
+        self._hedge_credit = 1.0
+
+    @classmethod
+    def from_env(cls) -> "ProviderRouter":
+        costs = _parse_map(LLM_ROUTER_COSTS, float)
+        limits = _parse_map(LLM_ROUTER_CONCURRENCY, int)
+        max_tokens = _parse_map(LLM_ROUTER_MAX_TOKENS, int)
+        providers = []
+        for name in configured_providers():
+            try:
+                provider = build_provider(name)
+            except Exception as e:
+                print(f"LLM router: skipping {name}: {e}")
+                continue
+            providers.append(RoutedProvider(
+                provider, costs.get(name, 1.0), limits.get(name, LLM_ROUTER_DEFAULT_CONCURRENCY), max_tokens.get(name)
+            ))
+        print(f"LLM router over {', '.join(p.name for p in providers) or 'no providers'}")
+        return cls(providers)
+
+    def candidates(self, prompt_tokens: int) -> List[RoutedProvider]:
+        """Providers in the order they should be tried for a prompt of this size."""
+        now = time.monotonic()
+        healthy = [p for p in self.providers if p.available(now) and p.provider.ready()]
+        if not healthy:
+            # Every breaker is open: better to try the one closest to closing than to fail outright
+            healthy = [min(self.providers, key=lambda p: p.open_until)]
+        rank = {id(p): i for i, p in enumerate(self.providers)}
+        if prompt_tokens <= self.small_tokens:
+            key = lambda p: (p.cost, p.expected_latency(), rank[id(p)])
+        else:
+            key = lambda p: (p.expected_latency(), p.cost, rank[id(p)])
+        ordered = sorted(healthy, key=key)
+        # Stable: within each group the cost/latency order is kept
+        return sorted(ordered, key=lambda p: (p.max_tokens is not None and prompt_tokens > p.max_tokens, p.saturated()))
+
+    def version(self) -> str:
+        # Any of the providers may answer, so a cached review belongs to the set
+        return "+".join(sorted(p.provider.version() for p in self.providers))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"stats": dict(self.stats), "providers": {p.name: p.snapshot() for p in self.providers}}
+
+    async def _race(
+        self,
+        prompt_tokens: int,
+        attempt: Callable[[RoutedProvider], Awaitable[Any]],
+        discard: Callable[[Any], Awaitable[None]],
+        first_chunk: bool = False,
+    ) -> Tuple[RoutedProvider, Any]:
+        """
+        Run `attempt` on the best provider, hedging once after its p95 and
+        falling back on failure. Returns the first successful (provider,
+        result); results of attempts that lose the race go to `discard`.
+        """
+        self.stats["requests"] += 1
+        self._hedge_credit = min(self._hedge_credit + LLM_ROUTER_HEDGE_BUDGET, _HEDGE_BURST)
+        queue = self.candidates(prompt_tokens)
+        pending: Dict[asyncio.Task, RoutedProvider] = {}
+        errors: List[str] = []
+        hedged = False
+        hedge: Optional[RoutedProvider] = None
+        launched_at = 0.0
+
+        def launch():
+            nonlocal launched_at
+            provider = queue.pop(0)
+            pending[asyncio.create_task(attempt(provider))] = provider
+            launched_at = time.monotonic()
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if not hedged and queue and len(pending) == 1:
+                    (provider,) = pending.values()
+                    timeout = max(provider.hedge_delay(first_chunk) - (time.monotonic() - launched_at), 0.0)
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    if self._hedge_credit >= 1:
+                        self._hedge_credit -= 1
+                        self.stats["hedges"] += 1
+                        hedge = queue[0]
+                        record_router_event(hedge.name, "hedge")
+                        launch()
+                    continue
+                winner = None
+                for task in done:
+                    provider = pending.pop(task)
+                    if task.exception() is not None:
+                        errors.append(f"{provider.name}: {task.exception()!r}")
+                    elif winner is None:
+                        winner = (provider, task.result())
+                    else:
+                        await discard(task.result())
+                if winner is not None:
+                    if winner[0] is hedge:
+                        self.stats["hedge_wins"] += 1
+                        record_router_event(hedge.name, "hedge_win")
+                    return winner
+                if not pending and queue:
+                    self.stats["fallbacks"] += 1
+                    record_router_event(queue[0].name, "fallback")
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+            for task in pending:
+                try:
+                    result = await task
+                except BaseException:
+                    continue
+                await discard(result)
+        self.stats["failures"] += 1
+        raise RuntimeError(f"All LLM providers failed: {'; '.join(errors)}")
+
+    async def _call(self, provider: RoutedProvider, code_diff: str, context: str) -> Dict[str, Any]:
+        await provider.acquire()
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(provider.provider.agenerate_review(code_diff, context), LLM_ROUTER_TIMEOUT_SECONDS)
+        except asyncio.CancelledError:
+            provider.record_cancelled(time.perf_counter() - start)
+            raise
+        except Exception:
+            provider.record(time.perf_counter() - start, ok=False)
+            raise
+        finally:
+            provider.release()
+        provider.record(time.perf_counter() - start, ok=True)
+        return result
+
+    async def agenerate_review(self, code_diff: str, context: str = "") -> Dict[str, Any]:
+        async def discard(result):
+            pass
+
+        provider, result = await self._race(
+            (len(code_diff) + len(context)) // 4, lambda p: self._call(p, code_diff, context), discard
+        )
+        return result
+
+    def generate_review(self, code_diff: str, context: str = "") -> Dict[str, Any]:
+        # Synchronous callers get plain fallback in order, without hedging
+        errors = []
+        for provider in self.candidates((len(code_diff) + len(context)) // 4):
+            start = time.perf_counter()
+            try:
+                result = provider.provider.generate_review(code_diff, context)
+            except Exception as e:
+                provider.record(time.perf_counter() - start, ok=False)
+                errors.append(f"{provider.name}: {e!r}")
+                continue
+            provider.record(time.perf_counter() - start, ok=True)
+            return result
+        raise RuntimeError(f"All LLM providers failed: {'; '.join(errors)}")
+
+    async def _open_stream(self, provider: RoutedProvider, code_diff: str, context: str):
+        """Start a stream and wait for its first chunk; returns (provider, stream, first chunk, start time)."""
+        await provider.acquire()
+        start = time.perf_counter()
+        stream = provider.provider.astream_review(code_diff, context)
+        try:
+            first = await asyncio.wait_for(anext(stream, None), LLM_ROUTER_TIMEOUT_SECONDS)
+        except BaseException as e:
+            await stream.aclose()
+            provider.release()
+            if isinstance(e, asyncio.CancelledError):
+                provider.record_cancelled(time.perf_counter() - start, first_chunk=True)
+            else:
+                provider.record(time.perf_counter() - start, ok=False)
+            raise
+        provider.first_chunks.append((time.perf_counter() - start, True))
+        return provider, stream, first, start
+
+    async def astream_review(self, code_diff: str, context: str = "") -> AsyncIterator[str]:
+        """
+        Hedging and fallback apply until a provider produces its first chunk;
+        after that the stream is committed to it and a failure is raised.
+        """
+        async def discard(opened):
+            provider, stream, _, start = opened
+            await stream.aclose()
+            provider.release()
+            provider.record_cancelled(time.perf_counter() - start)
+
+        _, (provider, stream, first, start) = await self._race(
+            (len(code_diff) + len(context)) // 4,
+            lambda p: self._open_stream(p, code_diff, context),
+            discard,
+            first_chunk=True,
+        )
+        ok = None
+        try:
+            if first is not None:
+                yield first
+                async for chunk in stream:
+                    yield chunk
+            ok = True
+        except Exception:
+            ok = False
+            raise
+        finally:
+            await stream.aclose()
+            provider.release()
+            if ok is not None:
+                provider.record(time.perf_counter() - start, ok)
+            else:
+                provider.record_cancelled(time.perf_counter() - start)
@@ -0,0 +1,315 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from .celery_app import celery
+from .redis_client import get_redis, redis_failed
+
+# Concurrent reviews allowed per installation (tenant) and per repository
+REVIEW_TENANT_CONCURRENCY = int(os.getenv("REVIEW_TENANT_CONCURRENCY", "8"))
+REVIEW_REPO_CONCURRENCY = int(os.getenv("REVIEW_REPO_CONCURRENCY", "2"))
+# Per-repository overrides, e.g. "acme/monorepo=6,acme/docs=1"
+REVIEW_REPO_LIMITS = os.getenv("REVIEW_REPO_LIMITS", "")
+# How long a review that hit a cap waits before trying again
+REVIEW_REQUEUE_SECONDS = float(os.getenv("REVIEW_REQUEUE_SECONDS", "5"))
+# Delayed reviews moved onto the queue per dispatch_due_reviews call
+REVIEW_DISPATCH_BATCH = int(os.getenv("REVIEW_DISPATCH_BATCH", "500"))
+# Leases expire on their own so a crashed worker can't hold a slot forever
+REVIEW_SLOT_TTL = int(os.getenv("REVIEW_SLOT_TTL", "1800"))
+# Every this many reviews a tenant already has queued push its next one down a priority level
+REVIEW_BACKLOG_PENALTY_STEP = int(os.getenv("REVIEW_BACKLOG_PENALTY_STEP", "5"))
+
+# (changed lines up to, priority); with the Redis broker 0 is served first
+PRIORITY_BY_SIZE = ((50, 0), (200, 1), (1000, 3), (5000, 5))
+LOWEST_PRIORITY = 9
+
+_QUEUED_PREFIX = "review-queued:"
+_RUNNING_PREFIX = "review-running:"
+_WAIT_PREFIX = "review-wait:"
+_TENANTS_KEY = "review-tenants"
+# Reviews waiting out their debounce or a requeue delay: task ids scored by
+# due time, and the task id -> send_task arguments they are dispatched with
+_DELAYED_KEY = "review-delayed"
+_DELAYED_TASKS_KEY = "review-delayed-tasks"
+_STALE_QUEUED_SECONDS = 24 * 3600
+
+# Atomically drop expired leases from every key, then take a lease on all of
+# them only if each is below its limit. KEYS are lease sets; ARGV is
+# now, expiry, member, then one limit per key.
+_ACQUIRE_SCRIPT = """
+for i, key in ipairs(KEYS) do
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', ARGV[1])
+    if redis.call('ZSCORE', key, ARGV[3]) == false and redis.call('ZCARD', key) >= tonumber(ARGV[3 + i]) then
+        return 0
+    end
+end
+for _, key in ipairs(KEYS) do
+    redis.call('ZADD', key, ARGV[2], ARGV[3])
+    redis.call('EXPIRE', key, math.ceil(ARGV[2] - ARGV[1]) + 60)
+end
+return 1
+"""
+
+
+# Atomically take up to ARGV[2] reviews due by ARGV[1] off the delay set, so
+# concurrent dispatchers never send the same review twice.
+_POP_DUE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+local tasks = {}
+for _, task_id in ipairs(due) do
+    redis.call('ZREM', KEYS[1], task_id)
+    local task = redis.call('HGET', KEYS[2], task_id)
+    if task then
+        redis.call('HDEL', KEYS[2], task_id)
+        table.insert(tasks, task)
+    end
+end
+return tasks
+"""
+
+
+def _parse_limits(value: str) -> Dict[str, int]:
+    limits = {}
+    for item in value.split(","):
+        name, _, limit = item.strip().partition("=")
+        if name and limit.strip().isdigit():
+            limits[name.strip()] = int(limit)
+    return limits
+
+
+_repo_limits = _parse_limits(REVIEW_REPO_LIMITS)
+
+
+def tenant_key(owner: str, installation_id: Optional[int]) -> str:
+    return f"installation:{installation_id}" if installation_id else f"owner:{owner}"
+
+
+def repo_limit(repository: str) -> int:
+    return _repo_limits.get(repository, REVIEW_REPO_CONCURRENCY)
+
+
+def review_priority(changed_lines: int, backlog: int = 0) -> int:
+    """Smaller diffs first; tenants with a deep backlog yield to everyone else."""
+    priority = LOWEST_PRIORITY - 2
+    for limit, value in PRIORITY_BY_SIZE:
+        if changed_lines <= limit:
+            priority = value
+            break
+    if REVIEW_BACKLOG_PENALTY_STEP > 0:
+        priority += backlog // REVIEW_BACKLOG_PENALTY_STEP
+    return min(priority, LOWEST_PRIORITY)
+
+
+class _LocalState:
+    """
+    Per-process running leases when Redis is unavailable. Leases are taken and
+    released by the same worker process, so the caps hold per process. Queue
+    state is not kept: it is written by the API and cleared by the worker.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running: Dict[str, Dict[str, float]] = {}
+
+
+_local = _LocalState()
+
+
+def mark_queued(tenant: str, task_id: str, scheduled_at: float) -> int:
+    """
+    Record a queued review for `tenant` and return how many it had queued
+    before. Without Redis the backlog isn't known and 0 is returned.
+    """
+    redis = get_redis()
+    if redis is None:
+        return 0
+    key = _QUEUED_PREFIX + tenant
+    try:
+        pipe = redis.pipeline()
+        pipe.zremrangebyscore(key, "-inf", time.time() - _STALE_QUEUED_SECONDS)
+        pipe.zcard(key)
+        pipe.zadd(key, {task_id: scheduled_at})
+        pipe.expire(key, _STALE_QUEUED_SECONDS)
+        pipe.sadd(_TENANTS_KEY, tenant)
+        return int(pipe.execute()[1])
+    except Exception as e:
+        print(f"Failed to record queued review: {e}")
+        redis_failed(e)
+        return 0
+
+
+def mark_dequeued(tenant: str, task_id: str, started: bool = True):
+    """Remove a review from its tenant's queue, recording its wait if it is starting."""
+    redis = get_redis()
+    now = time.time()
+    if redis is None:
+        return
+    key = _QUEUED_PREFIX + tenant
+    try:
+        pipe = redis.pipeline()
+        pipe.zscore(key, task_id)
+        pipe.zrem(key, task_id)
+        scheduled_at = pipe.execute()[0]
+        if started and scheduled_at is not None:
+            pipe = redis.pipeline()
+            pipe.hincrby(_WAIT_PREFIX + tenant, "count", 1)
+            pipe.hincrbyfloat(_WAIT_PREFIX + tenant, "seconds", max(now - scheduled_at, 0.0))
+            pipe.execute()
+    except Exception as e:
+        print(f"Failed to record dequeued review: {e}")
+        redis_failed(e)
+
+
+def acquire_slot(tenant: str, repository: str, task_id: str) -> bool:
+    """Take a lease on both the tenant's and the repository's concurrency slots, or neither."""
+    limits = (REVIEW_TENANT_CONCURRENCY, repo_limit(repository))
+    keys = (_RUNNING_PREFIX + tenant, _RUNNING_PREFIX + "repo:" + repository)
+    now = time.time()
+    redis = get_redis()
+    if redis is not None:
+        try:
+            return bool(redis.eval(_ACQUIRE_SCRIPT, len(keys), *keys, now, now + REVIEW_SLOT_TTL, task_id, *limits))
+        except Exception as e:
+            # Scheduling is best effort; fall back to this process's leases
+            print(f"Failed to acquire review slot: {e}")
+            redis_failed(e)
+    with _local.lock:
+        for key, limit in zip(keys, limits):
+            leases = _local.running.setdefault(key, {})
+            for member in [m for m, expires in leases.items() if expires <= now]:
+                del leases[member]
+            if task_id not in leases and len(leases) >= limit:
+                return False
+        for key in keys:
+            _local.running[key][task_id] = now + REVIEW_SLOT_TTL
+    return True
+
+
+def release_slot(tenant: str, repository: str, task_id: str):
+    keys = (_RUNNING_PREFIX + tenant, _RUNNING_PREFIX + "repo:" + repository)
+    # The lease may be in Redis or, if Redis failed when it was taken, in process
+    with _local.lock:
+        for key in keys:
+            _local.running.get(key, {}).pop(task_id, None)
+    redis = get_redis()
+    if redis is None:
+        return
+    try:
+        pipe = redis.pipeline()
+        for key in keys:
+            pipe.zrem(key, task_id)
+        pipe.execute()
+    except Exception as e:
+        print(f"Failed to release review slot: {e}")
+        redis_failed(e)
+
+
+def queue_stats() -> Dict[str, Dict[str, Any]]:
+    """Queued and running reviews and average queue wait per tenant; empty without Redis."""
+    now = time.time()
+    redis = get_redis()
+    stats: Dict[str, Dict[str, Any]] = {}
+    if redis is None:
+        return stats
+
+    try:
+        tenants = sorted(t.decode() for t in redis.smembers(_TENANTS_KEY))
+        pipe = redis.pipeline()
+        for tenant in tenants:
+            pipe.zcard(_QUEUED_PREFIX + tenant)
+            pipe.zcount(_RUNNING_PREFIX + tenant, now, "+inf")
+            pipe.zrange(_QUEUED_PREFIX + tenant, 0, 0, withscores=True)
+            pipe.hgetall(_WAIT_PREFIX + tenant)
+        results = pipe.execute()
+    except Exception as e:
+        print(f"Failed to read queue stats: {e}")
+        redis_failed(e)
+        return stats
+    for i, tenant in enumerate(tenants):
+        queued, running, oldest, waits = results[i * 4:(i + 1) * 4]
+        stats[tenant] = _tenant_stats(
+            queued, running, oldest[0][1] if oldest else None,
+            int(waits.get(b"count", 0)), float(waits.get(b"seconds", 0.0)), now,
+        )
+    return stats
+
+
+def _tenant_stats(queued: int, running: int, oldest: Optional[float], count: int, total: float, now: float) -> Dict[str, Any]:
+    return {
+        "queued": queued,
+        "running": running,
+        "oldest_wait_seconds": round(max(now - oldest, 0.0), 1) if oldest is not None else 0.0,
+        "avg_wait_seconds": round(total / count, 2) if count else 0.0,
+        "started": count,
+    }
+
+
+def schedule_review(task_id: str, kwargs: Dict[str, Any], priority: Optional[int], delay: float):
+    """
+    Queue process_review after `delay` seconds without holding a worker: the
+    review waits in a Redis sorted set until dispatch_due_reviews (a beat
+    task) moves it onto the priority queue. Without Redis it is sent with a
+    countdown instead, which workers reserve at once, outside the priority
+    order.
+    """
+    redis = get_redis()
+    if redis is not None:
+        task = json.dumps({"task_id": task_id, "kwargs": kwargs, "priority": priority})
+        try:
+            pipe = redis.pipeline()
+            pipe.hset(_DELAYED_TASKS_KEY, task_id, task)
+            pipe.zadd(_DELAYED_KEY, {task_id: time.time() + delay})
+            pipe.execute()
+            return
+        except Exception as e:
+            print(f"Failed to delay review, sending it with a countdown: {e}")
+            redis_failed(e)
+    celery.send_task("process_review", kwargs=kwargs, task_id=task_id, priority=priority, countdown=delay)
+
+
+def cancel_review(task_id: str):
+    """Drop a review that is still waiting out its delay."""
+    redis = get_redis()
+    if redis is None:
+        return
+    try:
+        pipe = redis.pipeline()
+        pipe.zrem(_DELAYED_KEY, task_id)
+        pipe.hdel(_DELAYED_TASKS_KEY, task_id)
+        pipe.execute()
+    except Exception as e:
+        print(f"Failed to cancel delayed review: {e}")
+        redis_failed(e)
+
+
+def dispatch_due_reviews(limit: int = REVIEW_DISPATCH_BATCH) -> int:
+    """
+    Send delayed reviews that are due to the priority queue and return how
+    many were sent. The first dispatch is stamped on the task as
+    dispatched_at, which ends its debounce stage.
+    """
+    redis = get_redis()
+    if redis is None:
+        return 0
+    now = time.time()
+    try:
+        tasks: List[bytes] = redis.eval(_POP_DUE_SCRIPT, 2, _DELAYED_KEY, _DELAYED_TASKS_KEY, now, limit)
+    except Exception as e:
+        print(f"Failed to read delayed reviews: {e}")
+        redis_failed(e)
+        return 0
+    sent = 0
+    for raw in tasks:
+        task = json.loads(raw)
+        kwargs = dict(task["kwargs"])
+        kwargs.setdefault("dispatched_at", now)
+        try:
+            celery.send_task("process_review", kwargs=kwargs, task_id=task["task_id"], priority=task["priority"])
+            sent += 1
+        except Exception as e:
+            # Back on the delay set for the next dispatch
+            print(f"Failed to dispatch review {task['task_id']}: {e}")
+            schedule_review(task["task_id"], task["kwargs"], task["priority"], 0)
+    return sent
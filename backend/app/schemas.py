@@ -1,11 +1,70 @@
-from pydantic import BaseModel
-from typing import List, Optional, Any
+import re
+from pydantic import AliasChoices, BaseModel, ConfigDict, Field, field_validator
+from typing import List, Literal, Optional
 from datetime import datetime
 
+SEVERITIES = ("info", "minor", "major", "critical")
+# What models write instead of the four levels
+_SEVERITY_ALIASES = {
+    "nit": "info", "note": "info", "style": "info", "low": "info", "suggestion": "info",
+    "warning": "minor", "medium": "minor", "moderate": "minor",
+    "error": "major", "high": "major", "bug": "major",
+    "blocker": "critical", "severe": "critical", "security": "critical",
+}
+
+class Suggestion(BaseModel):
+    """
+    One review comment. Validation coerces the loose shapes model output
+    comes in: alternative key names, line numbers as strings ("L12",
+    "12-14"), free-form severities. A suggestion without a comment is invalid.
+    """
+    model_config = ConfigDict(extra="ignore", from_attributes=True)
+
+    file: str = Field("", validation_alias=AliasChoices("file", "path", "filename"))
+    line: Optional[int] = Field(None, validation_alias=AliasChoices("line", "line_number", "lineno"))
+    severity: Literal["info", "minor", "major", "critical"] = "minor"
+    category: Optional[str] = None
+    comment: str = Field(validation_alias=AliasChoices("comment", "message", "body", "suggestion", "text"))
+
+    @field_validator("file", mode="before")
+    @classmethod
+    def _file(cls, value):
+        return "" if value is None else str(value).strip()
+
+    @field_validator("line", mode="before")
+    @classmethod
+    def _line(cls, value):
+        if value is None or isinstance(value, bool):
+            return None
+        if not isinstance(value, (int, float)):
+            match = re.search(r"\d+", str(value))
+            value = int(match.group()) if match else 0
+        return int(value) if value > 0 else None
+
+    @field_validator("severity", mode="before")
+    @classmethod
+    def _severity(cls, value):
+        value = str(value or "").strip().lower()
+        return value if value in SEVERITIES else _SEVERITY_ALIASES.get(value, "minor")
+
+    @field_validator("category", mode="before")
+    @classmethod
+    def _category(cls, value):
+        if value is None:
+            return None
+        return str(value).strip().lower() or None
+
+    @field_validator("comment", mode="before")
+    @classmethod
+    def _comment(cls, value):
+        if value is None or not str(value).strip():
+            raise ValueError("empty comment")
+        return str(value).strip()
+
 class ReviewBase(BaseModel):
     status: str
     summary: Optional[str] = None
-    suggestions: Optional[List[Any]] = None
+    suggestions: List[Suggestion] = []
 
 class ReviewCreate(ReviewBase):
     pull_request_id: int
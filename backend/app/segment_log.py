@@ -0,0 +1,383 @@
+import atexit
+import bisect
+import fcntl
+import gzip
+import json
+import operator
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SEGMENT_MAX_BYTES = int(os.getenv("SEGMENT_MAX_BYTES", str(64 * 1024 * 1024)))
+SEGMENT_BLOCK_RECORDS = int(os.getenv("SEGMENT_BLOCK_RECORDS", "1024"))
+SEGMENT_FLUSH_MS = int(os.getenv("SEGMENT_FLUSH_MS", "200"))
+SEGMENT_FLUSH_RECORDS = int(os.getenv("SEGMENT_FLUSH_RECORDS", "256"))
+SEGMENT_ZSTD_LEVEL = int(os.getenv("SEGMENT_ZSTD_LEVEL", "3"))
+# Records a BufferedWriter holds while the log can't be written; the oldest go first
+SEGMENT_MAX_BUFFERED = int(os.getenv("SEGMENT_MAX_BUFFERED", "10000"))
+# Numeric fields whose per-block min/max are kept in the index so filters on
+# them can skip whole blocks without decompressing
+SEGMENT_STATS_FIELDS = ("feedback.rating", "review_id")
+
+_SEGMENT_NAME = re.compile(r"^segment-(\d{20})\.(jsonl|jsonl\.zst|jsonl\.gz)$")
+
+_OPS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">=": operator.ge,
+    ">": operator.gt,
+    "<=": operator.le,
+    "<": operator.lt,
+}
+
+Condition = Tuple[str, str, Any]
+
+
+def _get(record: Dict[str, Any], field: str) -> Any:
+    value: Any = record
+    for part in field.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def matches(record: Dict[str, Any], where: Optional[List[Condition]]) -> bool:
+    """
+    True if `record` satisfies every (field, op, value) condition; `field` may
+    be dotted and `op` is a comparison, "in" (value is a set) or "exists".
+    """
+    for field, op, expected in where or ():
+        value = _get(record, field)
+        if op == "exists":
+            if (value is not None) != bool(expected):
+                return False
+            continue
+        if op == "in":
+            if value not in expected:
+                return False
+            continue
+        if value is None:
+            return False
+        try:
+            if not _OPS[op](value, expected):
+                return False
+        except TypeError:
+            return False
+    return True
+
+
+def _may_match(stats: Dict[str, List[float]], where: Optional[List[Condition]]) -> bool:
+    """Whether a block with these per-field [min, max] stats can contain a match."""
+    for field, op, expected in where or ():
+        if field not in SEGMENT_STATS_FIELDS:
+            continue
+        bounds = stats.get(field)
+        if bounds is None:
+            # no record in the block has the field
+            if op != "exists" or expected:
+                return False
+            continue
+        low, high = bounds
+        try:
+            if op == "in" and (not expected or max(expected) < low or min(expected) > high):
+                return False
+            if op == "==" and not low <= expected <= high:
+                return False
+            if op in (">=", ">") and not _OPS[op](high, expected):
+                return False
+            if op in ("<=", "<") and not _OPS[op](low, expected):
+                return False
+        except TypeError:
+            continue
+    return True
+
+
+def _compress(data: bytes, codec: str) -> bytes:
+    if codec == "zst":
+        return zstandard.ZstdCompressor(level=SEGMENT_ZSTD_LEVEL).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zst":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read .zst segments")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+class SegmentStore:
+    """
+    Append-only record log split into segments named by the offset of their
+    first record. New records go to a plain JSONL segment; once it exceeds
+    SEGMENT_MAX_BYTES it is sealed into independently compressed blocks of
+    SEGMENT_BLOCK_RECORDS records (zstd, or gzip without zstandard) with an
+    index of block offsets and field stats, so readers can seek to an offset
+    and skip blocks that can't match a filter.
+
+    Writes from several processes are serialized with an flock on the
+    directory's lock file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._lock_path = os.path.join(path, "LOCK")
+        self.codec = "zst" if zstandard is not None else "gz"
+
+    # --- layout ---
+
+    def _segments(self) -> List[Tuple[int, str, str]]:
+        """(base offset, extension, path) for every segment, oldest first; sealed wins over open."""
+        found: Dict[int, Tuple[int, str, str]] = {}
+        for name in os.listdir(self.path):
+            match = _SEGMENT_NAME.match(name)
+            if not match:
+                continue
+            base, ext = int(match.group(1)), match.group(2)
+            if ext != "jsonl" and not os.path.exists(self._index_path(base)):
+                continue  # sealing didn't finish
+            if base in found and ext == "jsonl":
+                continue
+            found[base] = (base, ext, os.path.join(self.path, name))
+        return [found[base] for base in sorted(found)]
+
+    def _segment_path(self, base: int, ext: str) -> str:
+        return os.path.join(self.path, f"segment-{base:020d}.{ext}")
+
+    def _index_path(self, base: int) -> str:
+        return os.path.join(self.path, f"segment-{base:020d}.idx.json")
+
+    def _read_index(self, base: int) -> Dict[str, Any]:
+        with open(self._index_path(base)) as f:
+            return json.load(f)
+
+    def _sealed_path(self, base: int) -> Optional[str]:
+        for ext in ("jsonl.zst", "jsonl.gz"):
+            path = self._segment_path(base, ext)
+            if os.path.exists(path) and os.path.exists(self._index_path(base)):
+                return path
+        return None
+
+    def _active(self) -> Tuple[int, str]:
+        """Base offset and path of the open segment, creating it after the last sealed one if needed."""
+        segments = self._segments()
+        if segments and segments[-1][1] == "jsonl":
+            base, _, path = segments[-1]
+            return base, path
+        base = 0
+        if segments:
+            last_base = segments[-1][0]
+            stale = self._segment_path(last_base, "jsonl")
+            if os.path.exists(stale):
+                os.remove(stale)  # sealed, but removal was interrupted
+            base = last_base + self._read_index(last_base)["count"]
+        return base, self._segment_path(base, "jsonl")
+
+    # --- writing ---
+
+    def append_many(self, records: List[Dict[str, Any]]):
+        """Append records durably: one write and one fsync for the whole group."""
+        if not records:
+            return
+        data = "".join(json.dumps(r, separators=(",", ":")) + "\n" for r in records).encode()
+        with open(self._lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                base, path = self._active()
+                with open(path, "ab") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    size = f.tell()
+                if size >= SEGMENT_MAX_BYTES:
+                    self._seal(base, path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _seal(self, base: int, path: str):
+        with open(path, "rb") as f:
+            # Everything up to the last newline; keeps numbering identical to the open segment
+            lines = f.read().split(b"\n")[:-1]
+
+        target = self._segment_path(base, f"jsonl.{self.codec}")
+        blocks = []
+        with open(target + ".tmp", "wb") as out:
+            for start in range(0, len(lines), SEGMENT_BLOCK_RECORDS):
+                chunk = lines[start:start + SEGMENT_BLOCK_RECORDS]
+                stats: Dict[str, List[float]] = {}
+                for line in chunk:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if not isinstance(record, dict):
+                        continue
+                    for field in SEGMENT_STATS_FIELDS:
+                        value = _get(record, field)
+                        if isinstance(value, (int, float)) and not isinstance(value, bool):
+                            low, high = stats.get(field, (value, value))
+                            stats[field] = [min(low, value), max(high, value)]
+                blocks.append({"offset": base + start, "pos": out.tell(), "count": len(chunk), "stats": stats})
+                out.write(_compress(b"\n".join(chunk) + b"\n", self.codec))
+            blocks_end = out.tell()
+            out.flush()
+            os.fsync(out.fileno())
+
+        index = {"base": base, "count": len(lines), "codec": self.codec, "size": blocks_end, "blocks": blocks}
+        with open(self._index_path(base) + ".tmp", "w") as f:
+            json.dump(index, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self._index_path(base) + ".tmp", self._index_path(base))
+        os.replace(target + ".tmp", target)
+        os.remove(path)
+
+    # --- reading ---
+
+    def iter_records(
+        self, start_offset: int = 0, where: Optional[List[Condition]] = None
+    ) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """
+        Stream (offset, record) pairs from `start_offset` on, keeping only
+        records that satisfy `where`, e.g. [("feedback.rating", ">=", 4)].
+        Only one block is held in memory at a time.
+        """
+        for base, ext, path in self._segments():
+            if ext == "jsonl":
+                yield from self._iter_open(base, path, start_offset, where)
+            else:
+                yield from self._iter_sealed(base, path, start_offset, where)
+
+    def _iter_sealed(self, base, path, start_offset, where):
+        index = self._read_index(base)
+        if base + index["count"] <= start_offset:
+            return
+        blocks = index["blocks"]
+        first = max(bisect.bisect_right([b["offset"] for b in blocks], start_offset) - 1, 0)
+        with open(path, "rb") as f:
+            for i in range(first, len(blocks)):
+                block = blocks[i]
+                if not _may_match(block["stats"], where):
+                    continue
+                end = blocks[i + 1]["pos"] if i + 1 < len(blocks) else index["size"]
+                f.seek(block["pos"])
+                lines = _decompress(f.read(end - block["pos"]), index["codec"]).split(b"\n")
+                for offset, line in enumerate(lines[:block["count"]], block["offset"]):
+                    if offset < start_offset:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if matches(record, where):
+                        yield offset, record
+
+    def _iter_open(self, base, path, start_offset, where):
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            # Sealed between listing and opening
+            sealed = self._sealed_path(base)
+            if sealed is not None:
+                yield from self._iter_sealed(base, sealed, start_offset, where)
+            return
+        with f:
+            for offset, line in enumerate(f, base):
+                if offset < start_offset or not line.endswith(b"\n"):
+                    continue  # before the requested offset, or a write still in progress
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if matches(record, where):
+                    yield offset, record
+
+    def end_offset(self) -> int:
+        """Offset the next appended record will get."""
+        segments = self._segments()
+        if not segments:
+            return 0
+        base, ext, path = segments[-1]
+        if ext != "jsonl":
+            return base + self._read_index(base)["count"]
+        with open(path, "rb") as f:
+            return base + sum(1 for line in f if line.endswith(b"\n"))
+
+
+class BufferedWriter:
+    """
+    Collects records in memory and appends them to a SegmentStore from a
+    background thread every SEGMENT_FLUSH_MS or SEGMENT_FLUSH_RECORDS records,
+    whichever comes first, so callers never wait on disk I/O. Records that
+    fail to write are retried with the next flush; past `max_buffered` the
+    oldest are dropped (and counted in `dropped`).
+    """
+
+    def __init__(
+        self,
+        store: SegmentStore,
+        flush_ms: int = SEGMENT_FLUSH_MS,
+        flush_records: int = SEGMENT_FLUSH_RECORDS,
+        max_buffered: int = SEGMENT_MAX_BUFFERED,
+    ):
+        self.store = store
+        self.flush_interval = flush_ms / 1000
+        self.flush_records = flush_records
+        self.max_buffered = max_buffered
+        self.dropped = 0
+        self._buffer: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        atexit.register(self.flush)
+
+    def append(self, record: Dict[str, Any]):
+        with self._lock:
+            self._buffer.append(record)
+            self._trim()  # reported by the next failed flush
+            full = len(self._buffer) >= self.flush_records
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="segment-writer", daemon=True)
+                self._thread.start()
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        # Serialized so groups land in the log in the order they were buffered
+        with self._flush_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+            if not batch:
+                return
+            try:
+                self.store.append_many(batch)
+            except Exception as e:
+                with self._lock:
+                    self._buffer[:0] = batch
+                    self._trim()
+                print(f"Failed to write {len(batch)} training records, will retry ({self.dropped} dropped so far): {e}")
+
+    def _trim(self):
+        excess = len(self._buffer) - self.max_buffered
+        if excess > 0:
+            del self._buffer[:excess]
+            self.dropped += excess
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            started = time.monotonic()
+            self.flush()
+            if time.monotonic() - started > self.flush_interval:
+                print(f"Slow training log flush: {time.monotonic() - started:.2f}s")
@@ -0,0 +1,87 @@
+"""
+Import-time report for the API and worker entry points.
+
+    python -m app.startup_profile                 # app.main and app.worker
+    python -m app.startup_profile app.main --top 40 --json
+
+Each module is imported in a fresh interpreter with -X importtime. The
+report shows the total import time, the slowest modules (cumulative) and
+time per top-level package. Any module in LAZY_MODULES that gets imported is
+listed as a leak, and the exit status is 1: those SDKs belong behind the
+provider registry or inside the function that needs them.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Any, Dict, List
+
+DEFAULT_MODULES = ["app.main", "app.worker"]
+LAZY_MODULES = (
+    "openai", "google.generativeai", "torch", "transformers", "peft",
+    "trl", "datasets", "bitsandbytes", "tree_sitter", "numpy",
+)
+
+
+def profile_import(module: str) -> Dict[str, Any]:
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{completed.stderr.strip().splitlines()[-1]}")
+
+    modules: List[Dict[str, Any]] = []
+    for line in completed.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append({"module": name.strip(), "self_ms": int(self_us) / 1000, "cumulative_ms": int(cumulative_us) / 1000})
+
+    packages: Dict[str, float] = {}
+    for entry in modules:
+        package = entry["module"].split(".")[0]
+        packages[package] = packages.get(package, 0.0) + entry["self_ms"]
+    names = {entry["module"] for entry in modules}
+    return {
+        "module": module,
+        "seconds": round(float(completed.stdout.strip().splitlines()[-1]), 3),
+        "modules": len(modules),
+        "slowest": sorted(modules, key=lambda e: e["cumulative_ms"], reverse=True),
+        "packages": dict(sorted(packages.items(), key=lambda item: item[1], reverse=True)),
+        "lazy_leaks": [name for name in LAZY_MODULES if name in names],
+    }
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Import-time profile of the API and worker")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="print the full report as JSON")
+    args = parser.parse_args(argv)
+
+    reports = [profile_import(module) for module in args.modules]
+    for report in reports:
+        report["slowest"] = report["slowest"][:args.top]
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        for report in reports:
+            print(f"{report['module']}: {report['seconds']:.3f}s, {report['modules']} modules imported")
+            print("  slowest (cumulative ms):")
+            for entry in report["slowest"]:
+                print(f"    {entry['cumulative_ms']:9.1f}  {entry['module']}")
+            print("  by package (self ms):")
+            for package, ms in list(report["packages"].items())[:args.top]:
+                print(f"    {ms:9.1f}  {package}")
+            if report["lazy_leaks"]:
+                print(f"  imported eagerly, should be lazy: {', '.join(report['lazy_leaks'])}")
+            print()
+    return 1 if any(report["lazy_leaks"] for report in reports) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
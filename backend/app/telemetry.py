@@ -0,0 +1,177 @@
+import contextvars
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+
+# With several processes (uvicorn workers, Celery) point this at a directory
+# they share so the API can export everyone's samples
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "")
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "0"))
+OTEL_EXPORTER_OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+STAGE_SECONDS = Histogram("review_stage_seconds", "Time spent in each review stage", ["stage"], buckets=LATENCY_BUCKETS)
+REVIEW_SECONDS = Histogram("review_duration_seconds", "End-to-end review time in the worker", ["status"], buckets=LATENCY_BUCKETS)
+WEBHOOK_SECONDS = Histogram("webhook_handle_seconds", "Time to handle a webhook delivery", ["event"], buckets=LATENCY_BUCKETS)
+LLM_SECONDS = Histogram("llm_request_seconds", "Model call latency", ["provider"], buckets=LATENCY_BUCKETS)
+LLM_TOKENS = Counter("llm_tokens", "Tokens sent to and generated by models", ["provider", "kind"])
+LLM_ROUTER_EVENTS = Counter("llm_router_events", "Hedged requests, fallbacks and circuit breaker changes", ["provider", "event"])
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+
+def render_metrics() -> bytes:
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+_tracer = None
+_tracer_checked = False
+
+
+def get_tracer():
+    """OpenTelemetry tracer exporting to OTEL_EXPORTER_OTLP_ENDPOINT, or None when not configured/installed."""
+    global _tracer, _tracer_checked
+    if _tracer_checked:
+        return _tracer
+    _tracer_checked = True
+    if not OTEL_EXPORTER_OTLP_ENDPOINT:
+        return None
+    try:
+        from opentelemetry import trace
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError as e:
+        print(f"OpenTelemetry export disabled: {e}")
+        return None
+    provider = TracerProvider(resource=Resource.create({"service.name": os.getenv("OTEL_SERVICE_NAME", "ai-code-reviewer")}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=OTEL_EXPORTER_OTLP_ENDPOINT, insecure=True)))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("app.review")
+    return _tracer
+
+
+class Trace:
+    """
+    Timings for one review, identified by the trace id minted when the webhook
+    arrived. Stage durations add up across calls (concurrent LLM batches sum
+    their busy time) and are also observed into the Prometheus histograms.
+    """
+
+    def __init__(self, trace_id: Optional[str] = None, **attributes: Any):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.attributes = attributes
+        self.stages: Dict[str, float] = {}
+        self.tokens = {"prompt": 0, "completion": 0}
+        self._span = None
+        self._context = None
+        tracer = get_tracer()
+        if tracer is not None:
+            from opentelemetry import trace
+
+            self._span = tracer.start_span("process_review", attributes={"review.trace_id": self.trace_id, **attributes})
+            self._context = trace.set_span_in_context(self._span)
+
+    def record(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        STAGE_SECONDS.labels(name).observe(seconds)
+
+    @contextmanager
+    def stage(self, name: str):
+        span = None
+        if self._span is not None:
+            span = get_tracer().start_span(name, context=self._context, attributes={"review.trace_id": self.trace_id})
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+            if span is not None:
+                span.end()
+
+    def end(self, status: str, seconds: float):
+        REVIEW_SECONDS.labels(status).observe(seconds)
+        if self._span is not None:
+            self._span.set_attribute("review.status", status)
+            self._span.set_attribute("llm.prompt_tokens", self.tokens["prompt"])
+            self._span.set_attribute("llm.completion_tokens", self.tokens["completion"])
+            self._span.end()
+
+    def summary(self) -> str:
+        stages = " ".join(f"{name}={seconds:.3f}s" for name, seconds in self.stages.items())
+        return f"trace={self.trace_id} {stages} tokens={self.tokens['prompt']}/{self.tokens['completion']}"
+
+
+_current: "contextvars.ContextVar[Optional[Trace]]" = contextvars.ContextVar("review_trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+async def traced(trace: Trace, coro):
+    """Await `coro` with `trace` as the current trace; tasks it creates inherit it."""
+    token = _current.set(trace)
+    try:
+        return await coro
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def stage(name: str):
+    """Time a stage against the current trace, or just the histogram outside of one."""
+    trace = current_trace()
+    if trace is not None:
+        with trace.stage(name):
+            yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(name).observe(time.perf_counter() - start)
+
+
+def record_stage(name: str, seconds: float):
+    trace = current_trace()
+    if trace is not None:
+        trace.record(name, seconds)
+    else:
+        STAGE_SECONDS.labels(name).observe(seconds)
+
+
+def record_llm_call(provider: str, seconds: float):
+    LLM_SECONDS.labels(provider).observe(seconds)
+    record_stage("llm", seconds)
+
+
+def record_llm_attempt(provider: str, seconds: float):
+    # One provider call made by the router; the routed call as a whole goes through record_llm_call
+    LLM_SECONDS.labels(provider).observe(seconds)
+
+
+def record_router_event(provider: str, event: str):
+    LLM_ROUTER_EVENTS.labels(provider, event).inc()
+
+
+def record_llm_usage(provider: str, prompt_tokens: Optional[int], completion_tokens: Optional[int]):
+    trace = current_trace()
+    for kind, count in (("prompt", prompt_tokens), ("completion", completion_tokens)):
+        if not count:
+            continue
+        LLM_TOKENS.labels(provider, kind).inc(count)
+        if trace is not None:
+            trace.tokens[kind] += count
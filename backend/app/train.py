@@ -1,29 +1,260 @@
+import argparse
+import hashlib
 import json
+import re
+from array import array
 from .collector import DataCollector
+from .feedback import iter_training_rows
 import openai
 import os
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+TRAINING_DIR = os.getenv("TRAINING_DIR", "data/fine_tuning/training")
+TRAINING_DATA_PATH = "data/fine_tuning/training_data.jsonl"
+TRAIN_MIN_RATING = int(os.getenv("TRAIN_MIN_RATING", "4"))
+TRAIN_SHARD_SIZE = int(os.getenv("TRAIN_SHARD_SIZE", "10000"))
+TRAIN_DEDUP_MODE = os.getenv("TRAIN_DEDUP_MODE", "exact")  # "exact" or "minhash"
+# 64 permutations in 16 bands of 4 rows: pairs above ~0.5 Jaccard similarity collide
+TRAIN_MINHASH_PERMS = int(os.getenv("TRAIN_MINHASH_PERMS", "64"))
+TRAIN_LSH_BANDS = int(os.getenv("TRAIN_LSH_BANDS", "16"))
+TRAIN_SHINGLE_SIZE = int(os.getenv("TRAIN_SHINGLE_SIZE", "5"))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def to_example(entry: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "messages": [
+            {"role": "system", "content": "You are an expert code reviewer."},
+            {"role": "user", "content": f"Review this diff:\n{entry['diff']}"},
+            {"role": "assistant", "content": json.dumps(entry['review'])}
+        ]
+    }
+
+
+def normalized_diff(diff: str) -> str:
+    """Diff text without hunk line numbers or whitespace differences, for duplicate detection."""
+    lines = (_WHITESPACE.sub(" ", line).strip() for line in diff.splitlines() if not line.startswith("@@"))
+    return "\n".join(line for line in lines if line)
+
+
+def _hash64(data: str) -> int:
+    return int.from_bytes(hashlib.blake2b(data.encode(), digest_size=8).digest(), "little")
+
+
+class ExactDeduper:
+    """Drops examples whose normalized diff has been seen before."""
+
+    def __init__(self, seen: Iterable[int] = ()):
+        self.seen = set(seen)
+        self.new: List[int] = []
+
+    def is_duplicate(self, diff: str) -> bool:
+        key = _hash64(normalized_diff(diff))
+        if key in self.seen:
+            return True
+        self.seen.add(key)
+        self.new.append(key)
+        return False
+
+
+class MinHashDeduper:
+    """
+    Near-duplicate detection with MinHash signatures over token shingles and
+    banded LSH: an example is dropped if any of its band hashes was seen before.
+    """
+
+    _PRIME = (1 << 31) - 1
+
+    def __init__(self, seen: Iterable[int] = (), perms: int = TRAIN_MINHASH_PERMS, bands: int = TRAIN_LSH_BANDS):
+        import numpy as np
+
+        self.np = np
+        self.bands = bands
+        self.rows = perms // bands
+        rng = np.random.RandomState(1)
+        self.a = rng.randint(1, self._PRIME, size=perms).astype(np.uint64)
+        self.b = rng.randint(0, self._PRIME, size=perms).astype(np.uint64)
+        self.seen = set(seen)
+        self.new: List[int] = []
+
+    def signature(self, text: str):
+        np = self.np
+        tokens = text.split()
+        size = TRAIN_SHINGLE_SIZE
+        shingles = {" ".join(tokens[i:i + size]) for i in range(max(len(tokens) - size + 1, 1))}
+        hashes = np.array([_hash64(s) & 0x7FFFFFFF for s in shingles], dtype=np.uint64)
+        # (a * x + b) mod p for every permutation/shingle pair; products stay below 2**62
+        return ((np.outer(hashes, self.a) + self.b) % self._PRIME).min(axis=0)
+
+    def is_duplicate(self, diff: str) -> bool:
+        signature = self.signature(normalized_diff(diff))
+        keys = [
+            _hash64(f"{band}:" + signature[band * self.rows:(band + 1) * self.rows].tobytes().hex())
+            for band in range(self.bands)
+        ]
+        duplicate = any(key in self.seen for key in keys)
+        for key in keys:
+            if key not in self.seen:
+                self.seen.add(key)
+                self.new.append(key)
+        return duplicate
 
-def prepare_training_data():
-    collector = DataCollector()
-    raw_data = collector.get_dataset()
-    
-    training_data = []
-    for entry in raw_data:
-        if entry.get("feedback") and entry["feedback"].get("rating", 0) >= 4:
-            # Only use high-quality reviews
-            training_data.append({
-                "messages": [
-                    {"role": "system", "content": "You are an expert code reviewer."},
-                    {"role": "user", "content": f"Review this diff:\n{entry['diff']}"},
-                    {"role": "assistant", "content": json.dumps(entry['review'])}
-                ]
-            })
-            
-    with open("data/fine_tuning/training_data.jsonl", "w") as f:
-        for item in training_data:
-            f.write(json.dumps(item) + "\n")
-            
-    return "data/fine_tuning/training_data.jsonl"
+
+class TrainingSetBuilder:
+    """
+    Builds the fine-tuning set incrementally from the collector log and the
+    feedback table. Rows are streamed from the last processed log offset and
+    feedback id, filtered by rating, deduplicated and appended to fixed-size
+    JSONL shards; progress and dedup hashes are saved whenever a shard fills
+    up and at the end, so an interrupted run resumes from its last full shard
+    and the next run only processes new records.
+    """
+
+    def __init__(
+        self,
+        collector: Optional[DataCollector] = None,
+        output_dir: str = TRAINING_DIR,
+        shard_size: int = TRAIN_SHARD_SIZE,
+        min_rating: int = TRAIN_MIN_RATING,
+        dedup: str = TRAIN_DEDUP_MODE,
+        use_feedback_table: bool = True,
+    ):
+        self.collector = collector or DataCollector()
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        self.min_rating = min_rating
+        self.dedup = dedup
+        self.use_feedback_table = use_feedback_table
+        self.state_path = os.path.join(output_dir, "state.json")
+        self.hashes_path = os.path.join(output_dir, f"dedup-{dedup}.bin")
+
+    def _load_state(self) -> Dict[str, Any]:
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                state = json.load(f)
+            if state.get("dedup") == self.dedup and state.get("shard_size") == self.shard_size:
+                return state
+            print("Training set settings changed, rebuilding from scratch")
+        return {
+            "offset": 0, "shard": 0, "shard_rows": 0, "shard_bytes": 0,
+            "rows": 0, "duplicates": 0, "dedup": self.dedup, "shard_size": self.shard_size,
+        }
+
+    def _save_state(self, state: Dict[str, Any]):
+        with open(self.state_path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def _load_hashes(self, state: Dict[str, Any]) -> array:
+        hashes = array("Q")
+        if state.get("hash_bytes") and os.path.exists(self.hashes_path):
+            with open(self.hashes_path, "rb") as f:
+                hashes.frombytes(f.read(state.get("hash_bytes", 0)))
+        return hashes
+
+    def shard_path(self, index: int) -> str:
+        return os.path.join(self.output_dir, f"shard-{index:05d}.jsonl")
+
+    def shards(self) -> List[str]:
+        return sorted(
+            os.path.join(self.output_dir, name) for name in os.listdir(self.output_dir)
+            if name.startswith("shard-") and name.endswith(".jsonl")
+        ) if os.path.isdir(self.output_dir) else []
+
+    def rows(self, state: Dict[str, Any]) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        where = [("feedback.rating", ">=", self.min_rating)]
+        return self.collector.iter_dataset(where=where, start_offset=state["offset"])
+
+    def build(self, rebuild: bool = False) -> Dict[str, Any]:
+        os.makedirs(self.output_dir, exist_ok=True)
+        if rebuild:
+            for path in self.shards() + [self.state_path, self.hashes_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+        state = self._load_state()
+        deduper_cls = MinHashDeduper if self.dedup == "minhash" else ExactDeduper
+        deduper = deduper_cls(self._load_hashes(state))
+
+        # Drop anything written after the last saved state (interrupted run)
+        for path in self.shards():
+            if int(os.path.basename(path)[len("shard-"):-len(".jsonl")]) > state["shard"]:
+                os.remove(path)
+        shard = self.shard_path(state["shard"])
+        if os.path.exists(shard):
+            os.truncate(shard, state["shard_bytes"])
+        out = open(shard, "a")
+        added = duplicates = 0
+
+        def checkpoint(offset: int):
+            # Everything before `offset` (and feedback up to feedback_id) is in the shards and hashes
+            out.flush()
+            with open(self.hashes_path, "r+b" if os.path.exists(self.hashes_path) else "wb") as f:
+                f.seek(state.get("hash_bytes", 0))
+                f.write(array("Q", deduper.new).tobytes())
+                f.truncate()
+                state["hash_bytes"] = f.tell()
+            deduper.new.clear()
+            state["offset"] = offset
+            state["shard_bytes"] = os.path.getsize(self.shard_path(state["shard"]))
+            self._save_state(state)
+
+        def add(entry: Dict[str, Any], offset: int):
+            nonlocal out, added, duplicates
+            if state["shard_rows"] >= self.shard_size:
+                # A full shard is final: save progress so an interrupted run resumes from here
+                out.close()
+                state["shard"] += 1
+                state["shard_rows"] = 0
+                out = open(self.shard_path(state["shard"]), "w")
+                checkpoint(offset)
+            if not entry.get("diff") or deduper.is_duplicate(entry["diff"]):
+                duplicates += 1
+                state["duplicates"] += 1
+                return
+            out.write(json.dumps(to_example(entry)) + "\n")
+            state["shard_rows"] += 1
+            state["rows"] += 1
+            added += 1
+
+        # Records appended while building are left for the next run
+        self.collector.writer.flush()
+        end = self.collector.store.end_offset()
+        try:
+            # Interactions logged together with their feedback
+            for offset, entry in self.rows(state):
+                if offset >= end:
+                    break
+                add(entry, offset)
+            # Feedback submitted through the API, joined to the reviewed diffs.
+            # A run interrupted inside a group of feedback redoes the group;
+            # rows already in the shards come back as duplicates.
+            if self.use_feedback_table:
+                for last_id, rows in iter_training_rows(self.collector, self.min_rating, state.get("feedback_id", 0)):
+                    for row in rows:
+                        add(row, max(state["offset"], end))
+                    state["feedback_id"] = last_id
+            checkpoint(max(state["offset"], end))
+        finally:
+            out.close()
+        return {"added": added, "duplicates": duplicates, "rows": state["rows"], "shards": len(self.shards())}
+
+    def export(self, path: str = TRAINING_DATA_PATH) -> str:
+        """Concatenate the shards into a single JSONL file, as fine-tuning uploads expect."""
+        with open(path + ".tmp", "w") as out:
+            for shard in self.shards():
+                with open(shard) as f:
+                    for line in f:
+                        out.write(line)
+        os.replace(path + ".tmp", path)
+        return path
+
+
+def prepare_training_data(rebuild: bool = False, dedup: str = TRAIN_DEDUP_MODE):
+    builder = TrainingSetBuilder(dedup=dedup)
+    stats = builder.build(rebuild=rebuild)
+    print(f"Training set: {stats['added']} new rows, {stats['duplicates']} skipped, {stats['rows']} total")
+    return builder.export()
 
 def start_finetuning_job(file_path: str):
     client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
@@ -43,9 +274,14 @@ def start_finetuning_job(file_path: str):
     print(f"Fine-tuning job started: {job.id}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the fine-tuning set from collected reviews")
+    parser.add_argument("--rebuild", action="store_true", help="ignore previous progress and start over")
+    parser.add_argument("--dedup", choices=["exact", "minhash"], default=TRAIN_DEDUP_MODE)
+    args = parser.parse_args()
+
     print("Preparing data...")
-    file_path = prepare_training_data()
+    file_path = prepare_training_data(rebuild=args.rebuild, dedup=args.dedup)
     print(f"Data saved to {file_path}")
-    
+
     # Uncomment to actually run
     # start_finetuning_job(file_path)
@@ -1,20 +1,31 @@
+import argparse
+import hashlib
+import json
 import os
+import time
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
 import torch
 from transformers import (
     AutoModelForCausalLM,
     AutoTokenizer,
-    BitsAndBytesConfig,
-    TrainingArguments,
 )
-from peft import LoraConfig, get_peft_model, prepare_model_for_kbit_training
-from trl import SFTTrainer
-from datasets import load_dataset
+from peft import LoraConfig, get_peft_model
+
+CPU_BASE_MODEL = os.getenv("CPU_BASE_MODEL", "HuggingFaceTB/SmolLM2-135M-Instruct")
+PREPROCESS_CACHE_DIR = os.getenv("PREPROCESS_CACHE_DIR", "data/fine_tuning/preprocessed")
 
 def train_local_model(
     base_model_id: str = "codellama/CodeLlama-7b-hf",
     data_path: str = "data/fine_tuning/training_data.jsonl",
     output_dir: str = "models/local_finetuned"
 ):
+    from transformers import BitsAndBytesConfig, TrainingArguments
+    from peft import prepare_model_for_kbit_training
+    from trl import SFTTrainer
+    from datasets import load_dataset
+
     print(f"Starting local fine-tuning of {base_model_id}...")
     
     # 1. Load Tokenizer
@@ -79,9 +90,202 @@ def train_local_model(
     trainer.model.save_pretrained(output_dir)
     print(f"Model saved to {output_dir}")
 
+def _render_chat(tokenizer, messages: List[Dict[str, str]], add_generation_prompt: bool = False) -> str:
+    if getattr(tokenizer, "chat_template", None):
+        return tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=add_generation_prompt)
+    text = "".join(f"### {m['role'].capitalize()}\n{m['content']}\n\n" for m in messages)
+    return text + ("### Assistant\n" if add_generation_prompt else "")
+
+
+def preprocess_dataset(data_path: str, tokenizer, max_seq_length: int, cache_dir: str = PREPROCESS_CACHE_DIR) -> Dict[str, np.ndarray]:
+    """
+    Apply the chat template and tokenize every example once. Token ids and a
+    loss mask (assistant tokens only) are stored as flat memory-mapped arrays
+    with an (offset, length) index, cached by data file, tokenizer and
+    sequence length so later runs skip straight to training.
+    """
+    stat = os.stat(data_path)
+    key = hashlib.sha256(
+        f"{os.path.abspath(data_path)}|{stat.st_size}|{stat.st_mtime_ns}|{tokenizer.name_or_path}|{max_seq_length}".encode()
+    ).hexdigest()[:16]
+    path = os.path.join(cache_dir, key)
+    if not os.path.exists(os.path.join(path, "index.npy")):
+        os.makedirs(path, exist_ok=True)
+        index: List[Tuple[int, int]] = []
+        total = 0
+        with open(data_path) as f, open(os.path.join(path, "tokens.bin"), "wb") as tokens_out, \
+                open(os.path.join(path, "mask.bin"), "wb") as mask_out:
+            for line in f:
+                if not line.strip():
+                    continue
+                messages = json.loads(line)["messages"]
+                prompt = _render_chat(tokenizer, messages[:-1], add_generation_prompt=True)
+                full = _render_chat(tokenizer, messages)
+                prompt_ids = tokenizer(prompt, add_special_tokens=False).input_ids
+                ids = (tokenizer(full, add_special_tokens=False).input_ids + [tokenizer.eos_token_id])[:max_seq_length]
+                mask = [0] * min(len(prompt_ids), len(ids)) + [1] * max(len(ids) - len(prompt_ids), 0)
+                tokens_out.write(np.asarray(ids, dtype=np.uint32).tobytes())
+                mask_out.write(np.asarray(mask, dtype=np.uint8).tobytes())
+                index.append((total, len(ids)))
+                total += len(ids)
+        np.save(os.path.join(path, "index.npy"), np.asarray(index, dtype=np.int64).reshape(-1, 2))
+        print(f"Preprocessed {len(index)} examples ({total} tokens) into {path}")
+
+    return {
+        "tokens": np.memmap(os.path.join(path, "tokens.bin"), dtype=np.uint32, mode="r"),
+        "mask": np.memmap(os.path.join(path, "mask.bin"), dtype=np.uint8, mode="r"),
+        "index": np.load(os.path.join(path, "index.npy")),
+    }
+
+
+def pack_examples(index: np.ndarray, max_seq_length: int) -> List[List[int]]:
+    """
+    Group example ids into sequences of at most `max_seq_length` tokens,
+    longest first into the first pack with room (first-fit decreasing).
+    """
+    packs: List[List[int]] = []
+    room: List[int] = []
+    for example in np.argsort(-index[:, 1], kind="stable"):
+        length = int(index[example, 1])
+        for i, free in enumerate(room):
+            if free >= length:
+                packs[i].append(int(example))
+                room[i] -= length
+                break
+        else:
+            packs.append([int(example)])
+            room.append(max_seq_length - length)
+    return packs
+
+
+def packed_batches(
+    data: Dict[str, np.ndarray],
+    packs: List[List[int]],
+    batch_size: int,
+    pad_token_id: int,
+    seed: int = 0,
+    dtype: torch.dtype = torch.float32,
+) -> Iterator[Dict[str, torch.Tensor]]:
+    """
+    Batches of packs with similar lengths, padded only to the longest pack in
+    the batch. Each packed example gets its own positions and a causal block
+    of the 4D attention mask (additive, in the model's `dtype`), so tokens
+    never attend across examples and every example trains as if alone.
+    """
+    index, tokens, mask = data["index"], data["tokens"], data["mask"]
+    lengths = [int(index[p, 1].sum()) for p in packs]
+    order = sorted(range(len(packs)), key=lambda i: lengths[i])
+    batches = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+    rng = np.random.default_rng(seed)
+    while True:
+        for b in rng.permutation(len(batches)):
+            members = batches[b]
+            width = max(lengths[i] for i in members)
+            input_ids = torch.full((len(members), width), pad_token_id, dtype=torch.long)
+            labels = torch.full((len(members), width), -100, dtype=torch.long)
+            # Block-diagonal causal mask: 0 where attention is allowed
+            attention_mask = torch.full((len(members), 1, width, width), torch.finfo(dtype).min, dtype=dtype)
+            position_ids = torch.zeros((len(members), width), dtype=torch.long)
+            for row, i in enumerate(members):
+                cursor = 0
+                for example in packs[i]:
+                    start, length = index[example]
+                    ids = torch.from_numpy(tokens[start:start + length].astype(np.int64))
+                    keep = torch.from_numpy(mask[start:start + length].astype(bool))
+                    input_ids[row, cursor:cursor + length] = ids
+                    labels[row, cursor:cursor + length] = torch.where(keep, ids, torch.full_like(ids, -100))
+                    position_ids[row, cursor:cursor + length] = torch.arange(length)
+                    attention_mask[row, 0, cursor:cursor + length, cursor:cursor + length].triu_(1)
+                    cursor += length
+            yield {"input_ids": input_ids, "attention_mask": attention_mask, "position_ids": position_ids, "labels": labels}
+
+
+def train_local_model_cpu(
+    base_model_id: str = CPU_BASE_MODEL,
+    data_path: str = "data/fine_tuning/training_data.jsonl",
+    output_dir: str = "models/local_finetuned",
+    max_seq_length: int = 1024,
+    batch_size: int = 4,
+    gradient_accumulation_steps: int = 1,
+    learning_rate: float = 2e-4,
+    max_steps: int = 100,
+    logging_steps: int = 10,
+) -> Dict[str, float]:
+    """
+    LoRA fine-tuning that runs on CPU with a small base model in full
+    precision. Examples are tokenized once, packed into sequences and
+    batched by length; tokens/sec and padding ratio are logged as it trains.
+    """
+    print(f"Starting CPU fine-tuning of {base_model_id}...")
+    torch.manual_seed(0)
+    tokenizer = AutoTokenizer.from_pretrained(base_model_id)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    data = preprocess_dataset(data_path, tokenizer, max_seq_length)
+    packs = pack_examples(data["index"], max_seq_length)
+    print(f"Packed {len(data['index'])} examples into {len(packs)} sequences")
+
+    model = AutoModelForCausalLM.from_pretrained(base_model_id, torch_dtype=torch.float32)
+    model = get_peft_model(model, LoraConfig(
+        r=16,
+        lora_alpha=32,
+        lora_dropout=0.05,
+        bias="none",
+        task_type="CAUSAL_LM",
+        target_modules=["q_proj", "v_proj"],
+    ))
+    model.train()
+    optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=learning_rate)
+    batches = packed_batches(data, packs, batch_size, tokenizer.pad_token_id, dtype=model.dtype)
+
+    totals = {"tokens": 0, "padding": 0, "seconds": 0.0}
+    window = {"tokens": 0, "padding": 0, "seconds": 0.0, "loss": 0.0}
+    for step in range(1, max_steps + 1):
+        started = time.perf_counter()
+        for _ in range(gradient_accumulation_steps):
+            batch = next(batches)
+            loss = model(**batch).loss / gradient_accumulation_steps
+            loss.backward()
+            # Real tokens may attend to themselves; padding attends to nothing
+            real = int(batch["attention_mask"].diagonal(dim1=-2, dim2=-1).eq(0).sum())
+            window["tokens"] += real
+            window["padding"] += batch["input_ids"].numel() - real
+            window["loss"] += loss.item()
+        optimizer.step()
+        optimizer.zero_grad()
+        window["seconds"] += time.perf_counter() - started
+
+        if step % logging_steps == 0 or step == max_steps:
+            steps = logging_steps if step % logging_steps == 0 else step % logging_steps
+            padding_ratio = window["padding"] / (window["tokens"] + window["padding"])
+            print(
+                f"step {step}: loss {window['loss'] / steps:.4f}, "
+                f"{window['tokens'] / window['seconds']:.0f} tokens/s, padding {padding_ratio:.1%}"
+            )
+            for key in totals:
+                totals[key] += window[key]
+            window = {"tokens": 0, "padding": 0, "seconds": 0.0, "loss": 0.0}
+
+    model.save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
+    print(f"Model saved to {output_dir}")
+    return {
+        "tokens_per_second": totals["tokens"] / totals["seconds"] if totals["seconds"] else 0.0,
+        "padding_ratio": totals["padding"] / (totals["tokens"] + totals["padding"]) if totals["tokens"] else 0.0,
+    }
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fine-tune a local review model")
+    parser.add_argument("--cpu", action="store_true", help="packed LoRA training on CPU with a small base model")
+    parser.add_argument("--base-model", default=None)
+    parser.add_argument("--max-steps", type=int, default=100)
+    args = parser.parse_args()
+
     # Ensure data exists
     if not os.path.exists("data/fine_tuning/training_data.jsonl"):
         print("No training data found. Run collector first.")
+    elif args.cpu:
+        train_local_model_cpu(base_model_id=args.base_model or CPU_BASE_MODEL, max_steps=args.max_steps)
     else:
-        train_local_model()
+        train_local_model(base_model_id=args.base_model or "codellama/CodeLlama-7b-hf")
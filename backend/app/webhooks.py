@@ -0,0 +1,89 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from .redis_client import get_redis, redis_failed
+
+GITHUB_WEBHOOK_SECRET = os.getenv("GITHUB_WEBHOOK_SECRET", "")
+WEBHOOK_DEDUP_TTL = int(os.getenv("WEBHOOK_DEDUP_TTL", "86400"))
+# Quiet period after a push before its review starts; newer pushes supersede it meanwhile
+REVIEW_DEBOUNCE_SECONDS = float(os.getenv("REVIEW_DEBOUNCE_SECONDS", "30"))
+LATEST_REVIEW_TTL = int(os.getenv("LATEST_REVIEW_TTL", "86400"))
+
+
+def verify_signature(body: bytes, signature: Optional[str], secret: str = GITHUB_WEBHOOK_SECRET) -> bool:
+    """Check X-Hub-Signature-256 against the raw body. Always passes when no secret is configured."""
+    if not secret:
+        return True
+    if not signature or not signature.startswith("sha256="):
+        return False
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature[len("sha256="):])
+
+
+_local_deliveries: Dict[str, float] = {}
+_local_lock = threading.Lock()
+
+
+def is_duplicate_delivery(delivery_id: Optional[str]) -> bool:
+    """Record a delivery id and report whether it has been seen within WEBHOOK_DEDUP_TTL."""
+    if not delivery_id:
+        return False
+    redis = get_redis()
+    if redis is not None:
+        try:
+            return not redis.set(f"webhook-delivery:{delivery_id}", 1, nx=True, ex=WEBHOOK_DEDUP_TTL)
+        except Exception as e:
+            print(f"Delivery dedup check failed, checking in process: {e}")
+            redis_failed(e)
+
+    now = time.time()
+    with _local_lock:
+        if len(_local_deliveries) > 10000:
+            for key in [k for k, expires in _local_deliveries.items() if expires < now]:
+                del _local_deliveries[key]
+        if _local_deliveries.get(delivery_id, 0) > now:
+            return True
+        _local_deliveries[delivery_id] = now + WEBHOOK_DEDUP_TTL
+        return False
+
+
+def _latest_key(owner: str, repo: str, pr_number: int) -> str:
+    return f"review-latest:{owner}/{repo}#{pr_number}"
+
+
+def set_latest_review(owner: str, repo: str, pr_number: int, task_id: str, head_sha: Optional[str]) -> Optional[str]:
+    """
+    Mark `task_id` as the review that should run for this PR and return the
+    task it supersedes, if any. Only the latest task for a PR does any work.
+    """
+    redis = get_redis()
+    if redis is None:
+        return None
+    key = _latest_key(owner, repo, pr_number)
+    try:
+        pipe = redis.pipeline()
+        pipe.hget(key, "task_id")
+        pipe.hset(key, mapping={"task_id": task_id, "head_sha": head_sha or ""})
+        pipe.expire(key, LATEST_REVIEW_TTL)
+        previous = pipe.execute()[0]
+    except Exception as e:
+        print(f"Failed to record latest review: {e}")
+        redis_failed(e)
+        return None
+    return previous.decode() if previous else None
+
+
+def is_superseded(owner: str, repo: str, pr_number: int, task_id: Optional[str]) -> bool:
+    redis = get_redis()
+    if redis is None or not task_id:
+        return False
+    try:
+        latest = redis.hget(_latest_key(owner, repo, pr_number), "task_id")
+    except Exception as e:
+        redis_failed(e)
+        return False
+    return latest is not None and latest.decode() != task_id
@@ -1,18 +1,84 @@
 
-from celery import Celery
+from celery.signals import worker_process_init, worker_ready
 import os
 import asyncio
-from .llm import get_llm_provider
+import threading
+import time
+from .celery_app import celery
+from .llm import get_llm_provider, reset_llm_provider
 from .github_service import GitHubClient
-from .analysis import CodeAnalyzer
+from .analysis import get_analysis_engine, summarize_analysis
+from .pipeline import ReviewPipeline
+from .publisher import ReviewPublisher
+from .webhooks import is_superseded
+from .database import SessionLocal
+from .crud import finish_review, pull_request_fields, record_review_stats, start_review, suggestion_rows
+from .collector import get_collector
+from .retrieval import REVIEW_CONTEXT, get_review_index_store
+from .telemetry import PROMETHEUS_MULTIPROC_DIR, WORKER_METRICS_PORT, Trace, traced
+from .scheduling import (
+    LOWEST_PRIORITY,
+    REVIEW_REQUEUE_SECONDS,
+    acquire_slot,
+    dispatch_due_reviews,
+    mark_dequeued,
+    release_slot,
+    schedule_review,
+    tenant_key,
+)
+from .backfill import BACKFILL_TASK_SECONDS, run_backfill
 
-CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
-CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
+COLLECT_TRAINING_DATA = os.getenv("COLLECT_TRAINING_DATA", "true").lower() == "true"
 
-celery = Celery(__name__, broker=CELERY_BROKER_URL, backend=CELERY_RESULT_BACKEND)
+_loop = None
+_loop_lock = threading.Lock()
 
-@celery.task(name="process_review")
-def process_review(owner: str, repo: str, pr_number: int, installation_id: int):
+@worker_process_init.connect
+def _reset_event_loop(**kwargs):
+    global _loop
+    _loop = None
+    # Provider clients hold connection pools that must not cross a fork
+    reset_llm_provider()
+
+@worker_ready.connect
+def _warm_local_model(**kwargs):
+    # Load the local model once per worker process instead of on the first review
+    if os.getenv("USE_LOCAL_LLM", "false").lower() == "true":
+        from .local_server import get_local_server
+        threading.Thread(target=get_local_server, name="local-llm-warmup", daemon=True).start()
+
+@worker_ready.connect
+def _serve_metrics(**kwargs):
+    # Without a shared multiprocess directory the worker exports its own metrics
+    if WORKER_METRICS_PORT and not PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import start_http_server
+        start_http_server(WORKER_METRICS_PORT)
+
+def run_async(coro):
+    """Run a coroutine on the process-wide event loop and wait for its result."""
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="review-event-loop", daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coro, _loop).result()
+
+class ReviewSuperseded(Exception):
+    pass
+
+@celery.task(name="process_review", bind=True)
+def process_review(
+    self,
+    owner: str,
+    repo: str,
+    pr_number: int,
+    installation_id: int,
+    head_sha: str = None,
+    trace_id: str = None,
+    received_at: float = None,
+    dispatched_at: float = None,
+    tenant: str = None,
+):
     # In a real app, we'd fetch the installation token using the installation_id
     # For now, we assume a global token or env var
     token = os.getenv("GITHUB_TOKEN")
@@ -20,28 +86,184 @@ def process_review(owner: str, repo: str, pr_number: int, installation_id: int):
         print("No GITHUB_TOKEN found")
         return
 
-    client = GitHubClient(token)
-    llm = get_llm_provider()
-    analyzer = CodeAnalyzer()
+    def checkpoint():
+        # A newer push for this PR arrived while we were queued or running
+        if is_superseded(owner, repo, pr_number, self.request.id):
+            raise ReviewSuperseded()
+
+    tenant = tenant or tenant_key(owner, installation_id)
+    repository = f"{owner}/{repo}"
+    picked_up = time.time()
+    # The debounce was waited out on the delay set (see schedule_review)
+    if is_superseded(owner, repo, pr_number, self.request.id):
+        mark_dequeued(tenant, self.request.id, started=False)
+        print(f"Skipping superseded review of {owner}/{repo}#{pr_number}")
+        return {"superseded": True}
 
-    # Run async code in sync Celery task
-    loop = asyncio.get_event_loop()
-    if loop.is_closed():
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+    # Per-installation and per-repository caps keep one busy tenant from
+    # filling every worker; over the cap, go back on the delay set and try
+    # later without holding this worker meanwhile.
+    if not acquire_slot(tenant, repository, self.request.id):
+        priority = (self.request.delivery_info or {}).get("priority")
+        schedule_review(self.request.id, dict(self.request.kwargs or {}), priority, REVIEW_REQUEUE_SECONDS)
+        return {"requeued": True}
+    mark_dequeued(tenant, self.request.id)
+
+    trace = Trace(trace_id, repository=repository, pr_number=pr_number)
+    if dispatched_at is not None:
+        if received_at is not None:
+            # From the webhook until the delay set let the review go
+            trace.record("debounce", max(dispatched_at - received_at, 0.0))
+        # Waiting for a worker since then, over-cap requeues included
+        trace.record("queue_wait", max(picked_up - dispatched_at, 0.0))
+
+    started = time.monotonic()
+    status = "failed"
+    review_result = None
+    pull_request = None
+    publisher = None
+    review_id = _start_review(owner, repo, pr_number)
 
     try:
-        diff = loop.run_until_complete(client.get_pr_diff(owner, repo, pr_number))
-        
-        # Analyze code (simplified, just passing diff for now)
-        # In reality, we'd fetch files and analyze them
-        
-        review_result = llm.generate_review(diff)
-        
-        # Post comment
-        summary = f"## AI Code Review\n\n{review_result}"
-        loop.run_until_complete(client.post_comment(owner, repo, pr_number, summary))
-        
+        client = GitHubClient(token)
+        llm = get_llm_provider()
+
+        with trace.stage("fetch_pr"):
+            pr = run_async(client.get_pull_request(owner, repo, pr_number))
+            pull_request = pull_request_fields(pr)
+        checkpoint()
+
+        # Summary comment up front, inline comments per file as soon as it's reviewed
+        async def should_post():
+            return not await asyncio.to_thread(is_superseded, owner, repo, pr_number, self.request.id)
+
+        commit_id = (pr.get("head") or {}).get("sha") or head_sha
+        publisher = ReviewPublisher(client, owner, repo, pr_number, commit_id, should_post=should_post)
+        with trace.stage("comment_post"):
+            run_async(publisher.start())
+
+        # Structure of the changed files at the PR head, parsed in a process pool
+        file_context = {}
+        try:
+            with trace.stage("analysis"):
+                analysis = run_async(get_analysis_engine().analyze_pr(client, owner, repo, pr_number))
+            file_context = {path: summarize_analysis(result) for path, result in analysis["files"].items()}
+            slowest = sorted(analysis["timings_ms"].items(), key=lambda item: item[1], reverse=True)[:5]
+            print(
+                f"Analysis for {owner}/{repo}#{pr_number}: {analysis['parsed']} parsed, "
+                f"{analysis['cache_hits']} cached, slowest (ms): {slowest}, "
+                f"throughput: {get_analysis_engine().throughput()}"
+            )
+        except Exception as e:
+            print(f"Code analysis failed, reviewing without it: {e}")
+        checkpoint()
+
+        # The diff is streamed, filtered and reviewed in token-budgeted batches
+        # Reviewed diffs are kept so dashboard feedback can be turned into training rows
+        on_batch = None
+        if COLLECT_TRAINING_DATA and review_id is not None:
+            def on_batch(diff, review):
+                get_collector().save_interaction(diff, review, review_id=review_id, repository=repository)
+        # Suggestions from this repository's earlier reviews of similar hunks
+        context_provider = None
+        if REVIEW_CONTEXT:
+            def context_provider(hunks):
+                return get_review_index_store().context_for(repository, hunks)
+        pipeline = ReviewPipeline(
+            llm,
+            on_batch=on_batch,
+            on_file=publisher.add_file,
+            on_suggestion=publisher.on_suggestion,
+            context_provider=context_provider,
+        )
+        with trace.stage("review"):
+            review_result = run_async(traced(trace, pipeline.run(
+                client.stream_pr_diff(owner, repo, pr_number), file_context=file_context
+            )))
+        cache_stats = review_result["cache"]
+        print(
+            f"Review cache for {owner}/{repo}#{pr_number}: "
+            f"{cache_stats['hits']}/{cache_stats['hunks']} hunks reused (hit ratio {cache_stats['hit_ratio']})"
+        )
+
+        checkpoint()
+
+        # Remaining inline comments, then the final summary in place of the progress note
+        with trace.stage("comment_post"):
+            run_async(traced(trace, publisher.finish(review_result)))
+        print(
+            f"Published review of {owner}/{repo}#{pr_number}: {len(publisher.posted)} inline comments "
+            f"in {publisher.stats['reviews']} reviews, first feedback after {publisher.first_feedback:.2f}s"
+        )
+        status = "completed"
+        if REVIEW_CONTEXT and on_batch is not None:
+            # Make this review retrievable for the next ones
+            get_review_index_store().update_in_background()
+        return cache_stats
+
+    except ReviewSuperseded:
+        status = "cancelled"
+        print(f"Review of {owner}/{repo}#{pr_number} superseded by a newer push")
+        if publisher is not None:
+            run_async(publisher.abandon("Superseded by a newer push; the latest revision is being reviewed."))
+        return {"superseded": True}
     except Exception as e:
         print(f"Error processing review: {e}")
+        if publisher is not None:
+            run_async(publisher.abandon("The review failed. Push again to retry."))
+    finally:
+        release_slot(tenant, repository, self.request.id)
+        with trace.stage("persist"):
+            _finish_review(review_id, repository, status, review_result, time.monotonic() - started, pull_request)
+        trace.end(status, time.monotonic() - started)
+        print(f"Review of {owner}/{repo}#{pr_number} {status}: {trace.summary()}")
+
+@celery.task(name="dispatch_delayed_reviews")
+def dispatch_delayed_reviews():
+    """Beat task: move reviews whose debounce or requeue delay is over onto the priority queue."""
+    return dispatch_due_reviews()
+
+@celery.task(name="backfill_reviews")
+def backfill_reviews(repositories=None, installation: bool = False, limit: int = None, **options):
+    """Bulk review of existing PRs (see app.backfill); continues in a new task after BACKFILL_TASK_SECONDS."""
+    stats = run_async(run_backfill(
+        repositories, installation, limit=limit, deadline=time.monotonic() + BACKFILL_TASK_SECONDS, **options
+    ))
+    print(f"Backfill of {repositories or 'installation'}: {stats}")
+    if not stats["complete"]:
+        # Checkpoints let the next task skip everything reviewed so far
+        remaining = None if limit is None else limit - stats["started"]
+        celery.send_task(
+            "backfill_reviews",
+            kwargs=dict(options, repositories=repositories, installation=installation, limit=remaining),
+            priority=LOWEST_PRIORITY,
+        )
+    return stats
 
+def _start_review(owner: str, repo: str, pr_number: int):
+    db = SessionLocal()
+    try:
+        return start_review(db, owner, repo, pr_number, url=f"https://github.com/{owner}/{repo}")
+    except Exception as e:
+        print(f"Failed to create review record: {e}")
+        db.rollback()
+        return None
+    finally:
+        db.close()
+
+def _finish_review(review_id, repository: str, status: str, review_result, duration: float, pull_request=None):
+    summary = review_result["summary"] if review_result else None
+    suggestions = review_result["suggestions"] if review_result else []
+    db = SessionLocal()
+    try:
+        if review_id is None:
+            # No review row to attach suggestions to; only the rollup counts them
+            severities = [row["severity"] for row in suggestion_rows(None, None, suggestions)]
+            record_review_stats(db, repository, status, severities, duration)
+        else:
+            finish_review(db, review_id, repository, status, summary, suggestions, duration, pull_request)
+    except Exception as e:
+        print(f"Failed to persist review: {e}")
+        db.rollback()
+    finally:
+        db.close()
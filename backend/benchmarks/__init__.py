@@ -0,0 +1,8 @@
+"""
+Offline benchmarks for the end-to-end review path.
+
+    python -m benchmarks.run                      # all scenarios, all fixtures
+    python -m benchmarks.run --baseline old.json  # fail on regressions
+
+See benchmarks/run.py for the scenarios and options.
+"""
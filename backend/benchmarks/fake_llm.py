@@ -0,0 +1,63 @@
+import asyncio
+import json
+import re
+import time
+from typing import Any, AsyncIterator, Dict, List
+
+from app.llm import LLMProvider, build_review_prompt
+from app.telemetry import record_llm_usage
+
+_HUNK = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,\d+)? @@")
+
+
+class FakeLLMProvider(LLMProvider):
+    """
+    Deterministic provider for benchmarks: one suggestion on the first added
+    line of every hunk, after a simulated latency of `base_ms` plus
+    `ms_per_1k_tokens` for the prompt (4 characters to a token). Streaming
+    spreads the same latency over `chunks` pieces of the JSON output.
+    """
+
+    name = "fake"
+
+    def __init__(self, base_ms: float = 50.0, ms_per_1k_tokens: float = 20.0, chunks: int = 8):
+        self.base_ms = base_ms
+        self.ms_per_1k_tokens = ms_per_1k_tokens
+        self.chunks = chunks
+
+    def _review(self, code_diff: str, context: str):
+        prompt_tokens = len(build_review_prompt(code_diff, context)) // 4
+        suggestions: List[Dict[str, Any]] = []
+        path, line, pending = "", 0, False
+        for text in code_diff.splitlines():
+            if text.startswith("+++ "):
+                path = text[6:] if text.startswith("+++ b/") else text[4:]
+            elif (match := _HUNK.match(text)):
+                line, pending = int(match.group(1)), True
+            elif pending and text.startswith("+"):
+                suggestions.append({"file": path, "line": line, "comment": f"Check the new value on line {line}."})
+                pending = False
+            elif pending and not text.startswith("-"):
+                line += 1
+        review = {"summary": f"Reviewed {len(suggestions)} hunks.", "suggestions": suggestions}
+        completion_tokens = 20 + 15 * len(suggestions)
+        record_llm_usage(self.name, prompt_tokens, completion_tokens)
+        return review, (self.base_ms + self.ms_per_1k_tokens * prompt_tokens / 1000) / 1000
+
+    def generate_review(self, code_diff: str, context: str = "") -> Dict[str, Any]:
+        review, delay = self._review(code_diff, context)
+        time.sleep(delay)
+        return review
+
+    async def agenerate_review(self, code_diff: str, context: str = "") -> Dict[str, Any]:
+        review, delay = self._review(code_diff, context)
+        await asyncio.sleep(delay)
+        return review
+
+    async def astream_review(self, code_diff: str, context: str = "") -> AsyncIterator[str]:
+        review, delay = self._review(code_diff, context)
+        text = json.dumps({"suggestions": review["suggestions"], "summary": review["summary"]})
+        size = max(len(text) // self.chunks, 1)
+        for start in range(0, len(text), size):
+            await asyncio.sleep(delay / self.chunks)
+            yield text[start:start + size]
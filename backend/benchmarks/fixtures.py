@@ -0,0 +1,213 @@
+"""
+Pull request fixtures for the benchmarks.
+
+A fixture is everything the review path reads from GitHub for one PR:
+
+    {"name", "webhook", "pull", "files", "blobs": {sha: content}, "diff"}
+
+The built-in fixtures are generated from a fixed seed so every run sees the
+same bytes. Real PRs can be captured once with
+
+    GITHUB_TOKEN=... python -m benchmarks.fixtures --record owner/repo#123 -o benchmarks/fixtures
+
+and are picked up with `python -m benchmarks.run --fixture-dir benchmarks/fixtures`.
+"""
+import argparse
+import asyncio
+import difflib
+import gzip
+import hashlib
+import json
+import os
+import random
+from typing import Any, Dict, List, Tuple
+
+# name -> (PR number, files, classes per file, methods per class, edits per file)
+SPECS: Dict[str, Tuple[int, int, int, int, int]] = {
+    "small": (1, 1, 3, 6, 6),
+    "medium": (2, 8, 4, 8, 25),
+    "huge": (3, 12, 20, 12, 300),
+    "many-file": (4, 250, 1, 4, 2),
+}
+
+
+def blob_sha(content: str) -> str:
+    data = content.encode()
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def _python_module(rng: random.Random, index: int, classes: int, methods: int) -> List[str]:
+    lines = [f'"""Generated module {index}."""', "import os", "from typing import Dict, List", ""]
+    for c in range(classes):
+        lines += [f"class Service{index}x{c}:", f'    """Service {c}."""', ""]
+        for m in range(methods):
+            lines += [
+                f"    def handle_{m}(self, items: List[int], limit: int = {m}) -> Dict[str, int]:",
+                "        result = {}",
+                "        for item in items:",
+                f"            if item > limit * {rng.randint(1, 9)}:",
+                f"                result[str(item)] = item * {rng.randint(2, 50)}",
+                "        return result",
+                "",
+            ]
+    return lines
+
+
+def _typescript_module(rng: random.Random, index: int, classes: int, methods: int) -> List[str]:
+    lines = ['import { readFile } from "fs";', ""]
+    for c in range(classes):
+        lines.append(f"export class Store{index}x{c} {{")
+        for m in range(methods):
+            lines += [
+                f"  load{m}(items: number[], limit = {m}): Record<string, number> {{",
+                "    const result: Record<string, number> = {};",
+                "    for (const item of items) {",
+                f"      if (item > limit * {rng.randint(1, 9)}) {{",
+                f"        result[String(item)] = item * {rng.randint(2, 50)};",
+                "      }",
+                "    }",
+                "    return result;",
+                "  }",
+            ]
+        lines += ["}", ""]
+    return lines
+
+
+def _edit(rng: random.Random, lines: List[str], edits: int) -> List[str]:
+    """Rewrite the body of `edits` random methods: one changed and one added line each."""
+    new = list(lines)
+    targets = [i for i, line in enumerate(new) if "result[" in line]
+    for i in sorted(rng.sample(targets, min(edits, len(targets))), reverse=True):
+        indent = new[i][:len(new[i]) - len(new[i].lstrip())]
+        new[i] = new[i].replace("item *", f"item + {rng.randint(100, 999)} *")
+        semicolon = ";" if new[i].endswith(";") else ""
+        new.insert(i + 1, f"{indent}total = len(result) + {rng.randint(1, 99)}{semicolon}")
+    return new
+
+
+def _file_diff(path: str, old: List[str], new: List[str], old_sha: str, new_sha: str) -> Tuple[List[str], str]:
+    body = list(difflib.unified_diff(old, new, f"a/{path}", f"b/{path}", lineterm="", n=3))
+    header = [f"diff --git a/{path} b/{path}", f"index {old_sha[:7]}..{new_sha[:7]} 100644"]
+    patch = "\n".join(body[2:])
+    return header + body, patch
+
+
+def generate(name: str) -> Dict[str, Any]:
+    number, file_count, classes, methods, edits = SPECS[name]
+    rng = random.Random(f"{name}:{number}")
+    files: List[Dict[str, Any]] = []
+    blobs: Dict[str, str] = {}
+    diff: List[str] = []
+    for index in range(file_count):
+        typescript = file_count > 1 and index % 5 == 4
+        path = f"src/pkg{index % 10}/module_{index}." + ("ts" if typescript else "py")
+        old = (_typescript_module if typescript else _python_module)(rng, index, classes, methods)
+        new = _edit(rng, old, edits)
+        old_content, new_content = "\n".join(old) + "\n", "\n".join(new) + "\n"
+        sha = blob_sha(new_content)
+        lines, patch = _file_diff(path, old, new, blob_sha(old_content), sha)
+        diff += lines
+        blobs[sha] = new_content
+        additions = sum(1 for line in lines[4:] if line.startswith("+"))
+        deletions = sum(1 for line in lines[4:] if line.startswith("-"))
+        files.append({
+            "filename": path, "status": "modified", "sha": sha, "patch": patch,
+            "additions": additions, "deletions": deletions, "changes": additions + deletions,
+        })
+    if name == "huge":
+        # Generated files are filtered out before review but still streamed
+        old = [f'    "dep-{i}": "1.{i}.0",' for i in range(3000)]
+        new = [f'    "dep-{i}": "1.{i}.1",' for i in range(3000)]
+        lines, _ = _file_diff("package-lock.json", old, new, "0" * 40, "1" * 40)
+        diff += lines
+
+    pull = {
+        "number": number,
+        "title": f"Benchmark PR ({name})",
+        "body": "Generated by benchmarks.fixtures",
+        "state": "open",
+        "user": {"login": "bench"},
+        "head": {"sha": hashlib.sha1(name.encode()).hexdigest(), "ref": f"bench/{name}"},
+        "base": {"ref": "main"},
+        "additions": sum(f["additions"] for f in files),
+        "deletions": sum(f["deletions"] for f in files),
+        "changed_files": len(files),
+    }
+    return {
+        "name": name,
+        "webhook": webhook_payload(pull),
+        "pull": pull,
+        "files": files,
+        "blobs": blobs,
+        "diff": "\n".join(diff) + "\n",
+    }
+
+
+def webhook_payload(pull: Dict[str, Any], owner: str = "bench", repo: str = "service", installation_id: int = 1) -> Dict[str, Any]:
+    return {
+        "action": "synchronize",
+        "number": pull["number"],
+        "pull_request": pull,
+        "repository": {"name": repo, "full_name": f"{owner}/{repo}", "owner": {"login": owner}},
+        "installation": {"id": installation_id},
+    }
+
+
+def load_fixtures(names: List[str], fixture_dir: str = "") -> Dict[str, Dict[str, Any]]:
+    """Built-in fixtures by name, plus every recorded fixture in `fixture_dir`."""
+    fixtures = {name: generate(name) for name in names if name in SPECS}
+    if fixture_dir and os.path.isdir(fixture_dir):
+        for filename in sorted(os.listdir(fixture_dir)):
+            if not filename.endswith((".json", ".json.gz")):
+                continue
+            opener = gzip.open if filename.endswith(".gz") else open
+            with opener(os.path.join(fixture_dir, filename), "rt") as f:
+                fixture = json.load(f)
+            if not names or fixture["name"] in names:
+                fixtures[fixture["name"]] = fixture
+    missing = set(names) - set(fixtures)
+    if missing:
+        raise ValueError(f"Unknown fixtures: {', '.join(sorted(missing))}")
+    return fixtures
+
+
+async def record(owner: str, repo: str, pr_number: int) -> Dict[str, Any]:
+    """Capture a live PR through the same client the worker uses."""
+    from app.analysis import CodeAnalyzer
+    from app.github_service import GitHubClient, close_http_client
+
+    client = GitHubClient(os.environ["GITHUB_TOKEN"])
+    try:
+        pull = await client.get_pull_request(owner, repo, pr_number)
+        files = await client.list_pr_files(owner, repo, pr_number)
+        diff = await client.get_pr_diff(owner, repo, pr_number)
+        blobs = {}
+        for f in files:
+            if f.get("status") != "removed" and f.get("sha") and CodeAnalyzer.supports(f["filename"]):
+                blobs[f["sha"]] = await client.get_blob(owner, repo, f["sha"])
+    finally:
+        await close_http_client()
+    return {
+        "name": f"{owner}-{repo}-{pr_number}",
+        "webhook": webhook_payload(pull, owner, repo),
+        "pull": pull,
+        "files": files,
+        "blobs": blobs,
+        "diff": diff,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record a pull request as a benchmark fixture")
+    parser.add_argument("--record", required=True, metavar="OWNER/REPO#NUMBER")
+    parser.add_argument("-o", "--output-dir", default="benchmarks/fixtures")
+    args = parser.parse_args()
+
+    name, _, number = args.record.partition("#")
+    owner, _, repo = name.partition("/")
+    fixture = asyncio.run(record(owner, repo, int(number)))
+    os.makedirs(args.output_dir, exist_ok=True)
+    path = os.path.join(args.output_dir, fixture["name"] + ".json.gz")
+    with gzip.open(path, "wt") as f:
+        json.dump(fixture, f)
+    print(f"Recorded {args.record} ({len(fixture['files'])} files) to {path}")
@@ -0,0 +1,567 @@
+"""
+Replays the benchmark fixtures through the review path, entirely offline:
+
+  parse    CodeAnalyzer parse throughput over the fixture's files (in process)
+  webhook  POST /webhook throughput and latency; the Celery enqueue is recorded
+           instead of sent to a broker
+  worker   process_review end to end against the stub GitHub server and the
+           fake LLM provider: tasks/sec, task latency, per-stage latency
+  retrieval  prompt-context lookups for the fixture's hunks against a review
+           index of --index-entries rows: latency per hunk
+  backfill  app.backfill over copies of the fixture PR, as many as fit in
+           --backfill-hunks (10 to --backfill-prs): PRs/sec, then the re-run,
+           which should only cost 304s on the PR list
+
+Each scenario/fixture pair runs in a fresh interpreter so peak RSS and caches
+are its own. Results are written as JSON; with --baseline, any throughput,
+latency or memory figure more than --tolerance worse than the baseline is
+reported and the exit status is 1.
+
+The default run takes about 3 minutes on a single core, most of it in the
+worker and backfill scenarios on the huge and many-file fixtures; pick
+scenarios and fixtures with --scenarios/--fixtures for a quicker check.
+
+    cd backend && python -m benchmarks.run --output benchmarks/results/1.4.0.json
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from .fixtures import SPECS, load_fixtures
+
+SCENARIOS = ("parse", "webhook", "worker", "retrieval", "backfill")
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WEBHOOK_SECRET = "benchmark-secret"
+# Unroutable, so every Redis user takes its in-process fallback
+NO_REDIS_URL = "redis://127.0.0.1:1/0"
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered), max(1, math.ceil(q / 100 * len(ordered)))) - 1]
+
+
+def latency_ms(values: List[float]) -> Dict[str, float]:
+    return {
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "max_ms": round(max(values, default=0.0) * 1000, 2),
+    }
+
+
+def peak_rss() -> Dict[str, float]:
+    # ru_maxrss is in KiB on Linux
+    return {
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "children_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+
+
+def bench_parse(fixture: Dict[str, Any], options: Dict[str, Any]) -> Dict[str, Any]:
+    from app.analysis import CodeAnalyzer, parse_source
+
+    files = [
+        (f["filename"], fixture["blobs"][f["sha"]]) for f in fixture["files"]
+        if f.get("sha") in fixture["blobs"] and CodeAnalyzer.supports(f["filename"])
+    ]
+    languages: Dict[str, Dict[str, float]] = {}
+    for _ in range(options["parse_repeat"]):
+        for filename, content in files:
+            structure, seconds = parse_source(filename, content)
+            entry = languages.setdefault(structure.get("language", "unknown"), {"files": 0, "bytes": 0, "seconds": 0.0, "errors": 0})
+            entry["files"] += 1
+            entry["bytes"] += len(content.encode())
+            entry["seconds"] += seconds
+            entry["errors"] += "error" in structure
+    total_seconds = sum(e["seconds"] for e in languages.values())
+    return {
+        "files": sum(e["files"] for e in languages.values()),
+        "files_per_second": round(sum(e["files"] for e in languages.values()) / total_seconds, 1) if total_seconds else 0.0,
+        "kb_per_second": round(sum(e["bytes"] for e in languages.values()) / 1024 / total_seconds, 1) if total_seconds else 0.0,
+        "languages": {
+            language: {
+                "files": e["files"],
+                "errors": e["errors"],
+                "files_per_second": round(e["files"] / e["seconds"], 1) if e["seconds"] else 0.0,
+                "kb_per_second": round(e["bytes"] / 1024 / e["seconds"], 1) if e["seconds"] else 0.0,
+            }
+            for language, e in languages.items()
+        },
+        **peak_rss(),
+    }
+
+
+def bench_webhook(fixtures: Dict[str, Dict[str, Any]], options: Dict[str, Any]) -> Dict[str, Any]:
+    import asyncio
+
+    import httpx
+
+    from app import main
+
+    enqueued = []
+    main.celery.send_task = lambda name, **kwargs: enqueued.append(kwargs["task_id"])
+    main.celery.control.revoke = lambda *args, **kwargs: None
+
+    bodies = []
+    for fixture in fixtures.values():
+        body = json.dumps(fixture["webhook"]).encode()
+        signature = "sha256=" + hmac.new(WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+        bodies.append((body, signature))
+
+    async def run() -> Dict[str, Any]:
+        latencies: List[float] = []
+        statuses: Dict[str, int] = {}
+        counter = iter(range(options["requests"]))
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            async def sender():
+                for i in counter:
+                    body, signature = bodies[i % len(bodies)]
+                    headers = {
+                        "X-GitHub-Event": "pull_request",
+                        "X-GitHub-Delivery": str(uuid.uuid4()),
+                        "X-Hub-Signature-256": signature,
+                        "Content-Type": "application/json",
+                    }
+                    start = time.perf_counter()
+                    response = await client.post("/webhook", content=body, headers=headers)
+                    latencies.append(time.perf_counter() - start)
+                    statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*(sender() for _ in range(options["concurrency"])))
+            elapsed = time.perf_counter() - start
+        return {
+            "requests": len(latencies),
+            "concurrency": options["concurrency"],
+            "seconds": round(elapsed, 3),
+            "requests_per_second": round(len(latencies) / elapsed, 1),
+            **latency_ms(latencies),
+            "statuses": statuses,
+            "enqueued": len(enqueued),
+        }
+
+    return {**asyncio.run(run()), **peak_rss()}
+
+
+def bench_worker(fixture: Dict[str, Any], options: Dict[str, Any]) -> Dict[str, Any]:
+    from app import worker
+    from app.analysis import get_analysis_engine
+    from app.database import engine
+    from app.github_service import get_client_stats
+    from app.llm import dispatcher, register_provider
+    from app.models import Base
+
+    from .fake_llm import FakeLLMProvider
+
+    Base.metadata.create_all(bind=engine)
+    register_provider("fake", lambda: FakeLLMProvider(options["llm_ms"], options["llm_ms_per_1k_tokens"]))
+    os.environ["LLM_PROVIDER"] = "fake"
+
+    traces = []
+
+    class RecordingTrace(worker.Trace):
+        def end(self, status: str, seconds: float):
+            super().end(status, seconds)
+            self.attributes["status"] = status
+            traces.append(self)
+
+    worker.Trace = RecordingTrace
+    pull = fixture["pull"]
+
+    def run_task(index: int) -> float:
+        start = time.perf_counter()
+        # A repository and installation per task: the per-tenant caps and
+        # superseding are exercised by the scheduler, not measured here
+        worker.process_review.apply(
+            kwargs=dict(
+                owner="bench",
+                repo=f"service-{index}",
+                pr_number=pull["number"],
+                installation_id=index + 1,
+                head_sha=pull["head"]["sha"],
+                received_at=time.time(),
+                dispatched_at=time.time(),
+            ),
+            task_id=str(uuid.uuid4()),
+        )
+        return time.perf_counter() - start
+
+    # Starts the analysis pool and event loop; in warm mode also fills the caches
+    run_task(-1)
+    traces.clear()
+    dispatcher.completed = 0
+
+    with ThreadPoolExecutor(options["concurrency"]) as pool:
+        start = time.perf_counter()
+        latencies = list(pool.map(run_task, range(options["tasks"])))
+        elapsed = time.perf_counter() - start
+
+    stages: Dict[str, List[float]] = {}
+    statuses: Dict[str, int] = {}
+    tokens = {"prompt": 0, "completion": 0}
+    for trace in traces:
+        statuses[trace.attributes["status"]] = statuses.get(trace.attributes["status"], 0) + 1
+        for kind in tokens:
+            tokens[kind] += trace.tokens[kind]
+        for name, seconds in trace.stages.items():
+            stages.setdefault(name, []).append(seconds)
+    get_analysis_engine().shutdown()
+
+    client = get_client_stats()
+    return {
+        "tasks": len(latencies),
+        "concurrency": options["concurrency"],
+        "cache": options["cache"],
+        "seconds": round(elapsed, 3),
+        "tasks_per_second": round(len(latencies) / elapsed, 2),
+        **latency_ms(latencies),
+        "statuses": statuses,
+        "stages": {
+            name: {
+                "mean_ms": round(sum(values) / len(values) * 1000, 2),
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p95_ms": round(percentile(values, 95) * 1000, 2),
+            }
+            for name, values in sorted(stages.items())
+        },
+        "llm_calls": dispatcher.completed,
+        "tokens": tokens,
+        "github": {
+            "requests": options["stub"].requests,
+            "connections_opened": client["connections_opened"],
+            "connections_reused": client["connections_reused"],
+        },
+        **peak_rss(),
+    }
+
+
+def bench_retrieval(fixture: Dict[str, Any], options: Dict[str, Any]) -> Dict[str, Any]:
+    import numpy as np
+
+    from app.diff_parser import split_hunks
+    from app.retrieval import ReviewIndexStore
+
+    store = ReviewIndexStore(os.environ["REVIEW_INDEX_DIR"])
+    hunks = split_hunks(fixture["diff"])
+    repository = "bench/service"
+    # Random unit rows stand in for past reviews; the fixture's own hunks are in there too
+    index = store.index_for(repository, create=True)
+    rng = np.random.default_rng(0)
+    start = time.perf_counter()
+    for first in range(0, options["index_entries"], 100_000):
+        count = min(100_000, options["index_entries"] - first)
+        vectors = rng.standard_normal((count, store.dim), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        index.add(vectors, [{"review_id": 0, "path": "filler", "suggestions": ["filler"]}] * count)
+    store.add(repository, [
+        (hunk, {"review_id": 0, "path": hunk.path, "snippet": "", "suggestions": [f"Past suggestion {i}"]})
+        for i, hunk in enumerate(hunks)
+    ])
+    build_seconds = time.perf_counter() - start
+
+    latencies: List[float] = []
+    start = time.perf_counter()
+    for _ in range(options["retrieval_repeat"]):
+        for first in range(0, len(hunks), 20):
+            batch = hunks[first:first + 20]
+            began = time.perf_counter()
+            store.context_for(repository, batch)
+            latencies.extend([(time.perf_counter() - began) / len(batch)] * len(batch))
+    elapsed = time.perf_counter() - start
+    return {
+        "entries": len(index.vectors),
+        "lists": index.vectors.manifest["nlist"],
+        "build_seconds": round(build_seconds, 2),
+        "hunks": len(latencies),
+        "hunks_per_second": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        **latency_ms(latencies),
+        **peak_rss(),
+    }
+
+
+def bench_backfill(fixture: Dict[str, Any], options: Dict[str, Any]) -> Dict[str, Any]:
+    from app.analysis import get_analysis_engine
+    from app.backfill import run_backfill
+    from app.database import SessionLocal, engine
+    from app.llm import dispatcher, register_provider
+    from app.models import Base, Review, Suggestion
+    from app.worker import run_async
+
+    from .fake_llm import FakeLLMProvider
+
+    Base.metadata.create_all(bind=engine)
+    register_provider("fake", lambda: FakeLLMProvider(options["llm_ms"], options["llm_ms_per_1k_tokens"]))
+    os.environ["LLM_PROVIDER"] = "fake"
+    stub = options["stub"]
+
+    def backfill() -> Dict[str, Any]:
+        return run_async(run_backfill(["bench/service"], concurrency=options["concurrency"]))
+
+    start = time.perf_counter()
+    first = backfill()
+    elapsed = time.perf_counter() - start
+    requests = dict(stub.requests)
+    start = time.perf_counter()
+    rerun = backfill()
+    rerun_seconds = time.perf_counter() - start
+    get_analysis_engine().shutdown()
+
+    db = SessionLocal()
+    try:
+        stored = {"reviews": db.query(Review).count(), "suggestions": db.query(Suggestion).count()}
+    finally:
+        db.close()
+    return {
+        "prs": first["listed"],
+        "concurrency": options["concurrency"],
+        "seconds": round(elapsed, 3),
+        "prs_per_second": round(first["reviewed"] / elapsed, 2) if elapsed else 0.0,
+        "reviewed": first["reviewed"],
+        "failed": first["failed"],
+        "stored": stored,
+        "llm_calls": dispatcher.completed,
+        "rerun_ms": round(rerun_seconds * 1000, 2),
+        "rerun": {key: rerun[key] for key in ("listed", "skipped", "started", "pages_not_modified")},
+        "github": {"first": requests, "rerun": {k: v - requests.get(k, 0) for k, v in stub.requests.items()}},
+        **peak_rss(),
+    }
+
+
+def run_child(spec: Dict[str, Any]):
+    """Entry point of the per-scenario interpreter; the environment is already set up."""
+    fixtures = load_fixtures(spec["fixtures"], spec["fixture_dir"])
+    options = spec["options"]
+    if spec["scenario"] == "parse":
+        result = bench_parse(fixtures[spec["fixtures"][0]], options)
+    elif spec["scenario"] == "webhook":
+        result = bench_webhook(fixtures, options)
+    elif spec["scenario"] == "retrieval":
+        result = bench_retrieval(fixtures[spec["fixtures"][0]], options)
+    else:
+        from .stub_github import StubGitHub
+
+        listed = 0
+        if spec["scenario"] == "backfill":
+            listed = backfill_prs(fixtures[spec["fixtures"][0]], options)
+        stub = StubGitHub(fixtures, options["github_latency_ms"], listed=listed).start()
+        os.environ["GITHUB_API_URL"] = stub.url
+        bench = bench_backfill if spec["scenario"] == "backfill" else bench_worker
+        try:
+            result = bench(fixtures[spec["fixtures"][0]], {**options, "stub": stub})
+        finally:
+            stub.stop()
+    with open(spec["output"], "w") as f:
+        json.dump(result, f)
+
+
+def backfill_prs(fixture: Dict[str, Any], options: Dict[str, Any]) -> int:
+    """PRs listed for the backfill scenario: about --backfill-hunks hunks of review work in all."""
+    from app.diff_parser import split_hunks
+
+    hunks = max(len(split_hunks(fixture["diff"])), 1)
+    return max(min(options["backfill_hunks"] // hunks, options["backfill_prs"]), min(10, options["backfill_prs"]))
+
+
+def child_env(scenario: str, options: Dict[str, Any], workdir: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": BACKEND_DIR + os.pathsep + env.get("PYTHONPATH", ""),
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'benchmark.db')}",
+        "REDIS_URL": options["redis_url"] or NO_REDIS_URL,
+        "CELERY_BROKER_URL": options["redis_url"] or NO_REDIS_URL,
+        "GITHUB_TOKEN": "benchmark",
+        "GITHUB_WEBHOOK_SECRET": WEBHOOK_SECRET,
+        # The stub is local; don't let the client-side rate limiter pace it
+        "GITHUB_REQUESTS_PER_SECOND": "1000000",
+        "GITHUB_BURST": "1000000",
+        "REVIEW_TENANT_CONCURRENCY": str(options["concurrency"]),
+        "REVIEW_REPO_CONCURRENCY": str(options["concurrency"]),
+        "COLLECT_TRAINING_DATA": "false",
+        "REVIEW_INDEX_DIR": os.path.join(workdir, "review_index"),
+        "BACKFILL_DIR": os.path.join(workdir, "backfill"),
+        "PROMETHEUS_MULTIPROC_DIR": "",
+        "WORKER_METRICS_PORT": "0",
+        "OTEL_EXPORTER_OTLP_ENDPOINT": "",
+    })
+    if options["cache"] == "cold":
+        # No room in the in-process caches: every hunk is reviewed, every file parsed
+        env["REVIEW_CACHE_SIZE"] = "0"
+    return env
+
+
+def run_scenario(scenario: str, fixtures: List[str], args: argparse.Namespace, options: Dict[str, Any]) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix="benchmark-") as workdir:
+        spec = {
+            "scenario": scenario,
+            "fixtures": fixtures,
+            "fixture_dir": os.path.abspath(args.fixture_dir) if args.fixture_dir else "",
+            "options": options,
+            "output": os.path.join(workdir, "result.json"),
+        }
+        completed = subprocess.run(
+            [sys.executable, "-m", "benchmarks.run", "--child", json.dumps(spec)],
+            cwd=workdir,
+            env=child_env(scenario, options, workdir),
+            stdout=None if args.verbose else subprocess.DEVNULL,
+            stderr=None if args.verbose else subprocess.PIPE,
+            text=True,
+        )
+        if completed.returncode != 0 or not os.path.exists(spec["output"]):
+            tail = (completed.stderr or "").strip().splitlines()[-20:]
+            return {"error": f"exit status {completed.returncode}", "stderr": tail}
+        with open(spec["output"]) as f:
+            return json.load(f)
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _metrics(results: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    """Flatten results to {path: value} for the figures that have a better direction."""
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}/{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(_metrics(value, path))
+        elif isinstance(value, (int, float)) and (key.endswith("_per_second") or key.endswith("_ms") or key == "peak_rss_mb"):
+            flat[path] = float(value)
+    return flat
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    regressions = []
+    old = _metrics(baseline.get("results", {}))
+    for path, value in sorted(_metrics(current["results"]).items()):
+        before = old.get(path)
+        if not before:
+            continue
+        higher_is_better = path.endswith("_per_second")
+        change = (value - before) / before
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append(f"{path}: {before:g} -> {value:g} ({change:+.0%})")
+    return regressions
+
+
+def _summary(scenario: str, name: str, result: Dict[str, Any]) -> str:
+    if "error" in result:
+        return f"{scenario:8} {name:10} FAILED {result['error']}"
+    if scenario == "parse":
+        figures = f"{result['files_per_second']} files/s, {result['kb_per_second']} KB/s"
+    elif scenario == "webhook":
+        figures = f"{result['requests_per_second']} req/s, p99 {result['p99_ms']} ms"
+    elif scenario == "retrieval":
+        figures = f"{result['entries']} entries, p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms per hunk"
+    elif scenario == "backfill":
+        figures = f"{result['prs_per_second']} PRs/s over {result['prs']} PRs, re-run {result['rerun_ms']} ms"
+    else:
+        figures = f"{result['tasks_per_second']} tasks/s, p95 {result['p95_ms']} ms"
+    return f"{scenario:8} {name:10} {figures}, peak RSS {result['peak_rss_mb']} MB"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the review path")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--fixtures", nargs="+", default=list(SPECS), help="built-in or recorded fixture names")
+    parser.add_argument("--fixture-dir", default="", help="directory of recorded fixtures (see benchmarks.fixtures)")
+    parser.add_argument("--output", default=os.path.join("benchmarks", "results", "latest.json"))
+    parser.add_argument("--baseline", help="earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression (default 0.2)")
+    parser.add_argument("--tasks", type=int, default=16, help="worker tasks per fixture")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=2000, help="webhook deliveries")
+    parser.add_argument("--parse-repeat", type=int, default=3)
+    parser.add_argument("--index-entries", type=int, default=200_000, help="review index size for the retrieval scenario")
+    parser.add_argument("--retrieval-repeat", type=int, default=5)
+    parser.add_argument("--backfill-prs", type=int, default=200, help="most PRs listed for the backfill scenario")
+    parser.add_argument("--backfill-hunks", type=int, default=4000, help="hunks reviewed per backfill fixture, which sets its PR count")
+    parser.add_argument("--cache", choices=["cold", "warm"], default="cold")
+    parser.add_argument("--llm-ms", type=float, default=50.0, help="fake provider base latency")
+    parser.add_argument("--llm-ms-per-1k-tokens", type=float, default=20.0)
+    parser.add_argument("--github-latency-ms", type=float, default=0.0, help="added to every stub GitHub response")
+    parser.add_argument("--redis-url", default="", help="use this Redis instead of the in-process fallbacks")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the application's output")
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(json.loads(args.child))
+        return 0
+
+    options = {
+        "tasks": args.tasks,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "parse_repeat": args.parse_repeat,
+        "index_entries": args.index_entries,
+        "retrieval_repeat": args.retrieval_repeat,
+        "backfill_prs": args.backfill_prs,
+        "backfill_hunks": args.backfill_hunks,
+        "cache": args.cache,
+        "llm_ms": args.llm_ms,
+        "llm_ms_per_1k_tokens": args.llm_ms_per_1k_tokens,
+        "github_latency_ms": args.github_latency_ms,
+        "redis_url": args.redis_url,
+    }
+    load_fixtures(args.fixtures, args.fixture_dir)  # fail fast on unknown names
+
+    results: Dict[str, Dict[str, Any]] = {}
+    for scenario in args.scenarios:
+        groups = {"all": args.fixtures} if scenario == "webhook" else {name: [name] for name in args.fixtures}
+        for name, fixtures in groups.items():
+            result = run_scenario(scenario, fixtures, args, options)
+            results.setdefault(scenario, {})[name] = result
+            print(_summary(scenario, name, result), flush=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "options": options,
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    failed = any("error" in result for scenario in results.values() for result in scenario.values())
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if not regressions:
+            print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+        failed = failed or bool(regressions)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""
+In-process stand-in for the GitHub REST endpoints the worker calls, serving
+fixtures by PR number for any owner/repo. Point GITHUB_API_URL at `url`.
+With `listed`, the PR list has PRs 1..listed, each a copy of the first
+fixture, and pages carry ETags that conditional requests are answered
+with 304 against.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+_PULLS = re.compile(r"^/repos/[^/]+/[^/]+/pulls$")
+_PULL = re.compile(r"^/repos/[^/]+/[^/]+/pulls/(\d+)$")
+_FILES = re.compile(r"^/repos/[^/]+/[^/]+/pulls/(\d+)/files$")
+_BLOB = re.compile(r"^/repos/[^/]+/[^/]+/git/blobs/([0-9a-f]+)$")
+_COMMENTS = re.compile(r"^/repos/[^/]+/[^/]+/(issues|pulls)/(\d+)/(comments|reviews)$")
+_COMMENT = re.compile(r"^/repos/[^/]+/[^/]+/(issues|pulls)/comments/(\d+)$")
+
+
+class StubGitHub:
+    def __init__(self, fixtures: Dict[str, Dict[str, Any]], latency_ms: float = 0.0, listed: int = 0):
+        self.pulls = {fixture["pull"]["number"]: fixture for fixture in fixtures.values()}
+        self.listed = listed
+        self._first = next(iter(fixtures.values()))
+        self.blobs = {sha: content for fixture in fixtures.values() for sha, content in fixture["blobs"].items()}
+        self.latency = latency_ms / 1000
+        self.requests: Dict[str, int] = {}
+        self.posted: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubGitHub":
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stub._handle(self, "GET")
+
+            def do_POST(self):
+                stub._handle(self, "POST")
+
+            def do_PATCH(self):
+                stub._handle(self, "PATCH")
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="stub-github", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _fixture(self, number: int) -> Optional[Dict[str, Any]]:
+        fixture = self.pulls.get(number)
+        if fixture is None and 1 <= number <= self.listed:
+            fixture = self._first
+        return fixture
+
+    def _count(self, counter: Dict[str, int], key: str):
+        with self._lock:
+            counter[key] = counter.get(key, 0) + 1
+
+    def _handle(self, handler: BaseHTTPRequestHandler, method: str):
+        url = urlparse(handler.path)
+        if self.latency:
+            time.sleep(self.latency)
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = json.loads(handler.rfile.read(length) or b"null") if length else None
+
+        if method == "GET" and _PULLS.match(url.path):
+            query = parse_qs(url.query)
+            per_page = int(query.get("per_page", ["30"])[0])
+            page = int(query.get("page", ["1"])[0])
+            numbers = range((page - 1) * per_page + 1, min(page * per_page, self.listed) + 1)
+            pulls = [dict(self._first["pull"], number=number) for number in numbers]
+            etag = '"' + hashlib.sha1(json.dumps(pulls).encode()).hexdigest() + '"'
+            if handler.headers.get("If-None-Match") == etag:
+                self._count(self.requests, "pulls_not_modified")
+                return self._send(handler, 304, "", headers={"ETag": etag})
+            self._count(self.requests, "pulls")
+            return self._send(handler, 200, pulls, headers={"ETag": etag})
+        if method == "GET" and (match := _PULL.match(url.path)):
+            fixture = self._fixture(int(match.group(1)))
+            if fixture is None:
+                return self._send(handler, 404, {"message": "Not Found"})
+            if "diff" in handler.headers.get("Accept", ""):
+                self._count(self.requests, "diff")
+                return self._send(handler, 200, fixture["diff"], "text/plain; charset=utf-8")
+            self._count(self.requests, "pull")
+            return self._send(handler, 200, fixture["pull"])
+        if method == "GET" and (match := _FILES.match(url.path)):
+            self._count(self.requests, "files")
+            fixture = self._fixture(int(match.group(1)))
+            query = parse_qs(url.query)
+            per_page = int(query.get("per_page", ["30"])[0])
+            page = int(query.get("page", ["1"])[0])
+            files = fixture["files"] if fixture else []
+            return self._send(handler, 200, files[(page - 1) * per_page:page * per_page])
+        if method == "GET" and (match := _BLOB.match(url.path)):
+            self._count(self.requests, "blob")
+            content = self.blobs.get(match.group(1))
+            if content is None:
+                return self._send(handler, 404, {"message": "Not Found"})
+            return self._send(handler, 200, content, "application/vnd.github.raw")
+        if method == "POST" and (match := _COMMENTS.match(url.path)):
+            kind = "review" if match.group(3) == "reviews" else f"{match.group(1)}_comment"
+            self._count(self.requests, kind)
+            self._count(self.posted, kind)
+            return self._send(handler, 201, {"id": sum(self.posted.values()), "body": (body or {}).get("body", "")})
+        if method == "PATCH" and (match := _COMMENT.match(url.path)):
+            self._count(self.requests, "comment_edit")
+            return self._send(handler, 200, {"id": int(match.group(2)), "body": (body or {}).get("body", "")})
+        self._send(handler, 404, {"message": "Not Found"})
+
+    def _send(
+        self,
+        handler: BaseHTTPRequestHandler,
+        status: int,
+        payload: Any,
+        content_type: str = "application/json",
+        headers: Optional[Dict[str, str]] = None,
+    ):
+        data = payload.encode() if isinstance(payload, str) else json.dumps(payload).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
@@ -9,13 +9,14 @@ def run_migrations():
     """Run database migrations"""
     print("🔄 Running database migrations...")
     try:
-        # Create tables directly using SQLAlchemy models
-        from app.database import engine
-        from app.models import Base
-        
-        print("Creating database tables...")
-        Base.metadata.create_all(bind=engine)
-        print("✅ Database tables created successfully!")
+        # Alembic revisions in alembic/versions; they also bring databases
+        # created with create_all by older versions up to date
+        from alembic import command
+        from alembic.config import Config
+
+        config = Config(os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini"))
+        command.upgrade(config, "head")
+        print("✅ Database is at the latest revision!")
         return True
     except Exception as e:
         print(f"❌ Migration failed: {e}")
@@ -0,0 +1,6 @@
+import os
+
+# Importing app modules must not need Postgres or Redis: SQLite in memory, and
+# an unroutable Redis so every Redis user takes its in-process fallback
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("REDIS_URL", "redis://127.0.0.1:1/0")
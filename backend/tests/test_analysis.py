@@ -0,0 +1,80 @@
+import random
+
+from app.analysis import CodeAnalyzer, IntervalIndex, scope_structure, summarize_analysis
+
+SOURCE = '''import os
+from typing import List
+
+
+def helper(x):
+    return os.path.join(x)
+
+
+class Service:
+    @staticmethod
+    def handle(items: List[str]):
+        return [helper(i) for i in items]
+
+    def other(self):
+        return 1
+'''
+
+
+def test_interval_index_matches_linear_scan():
+    rng = random.Random(7)
+    intervals = []
+    for i in range(300):
+        start = rng.randint(1, 1000)
+        intervals.append((start, start + rng.randint(0, 60), i))
+    index = IntervalIndex(intervals)
+    for _ in range(200):
+        start = rng.randint(-10, 1100)
+        end = start + rng.randint(0, 30)
+        expected = {i for s, e, i in intervals if s <= end and e >= start}
+        assert sorted(index.overlapping(start, end)) == sorted(expected)
+
+
+def test_interval_index_edges():
+    index = IntervalIndex([(1, 5, "a"), (5, 9, "b"), (20, 20, "c")])
+    assert sorted(index.overlapping(5, 5)) == ["a", "b"]
+    assert index.overlapping(10, 19) == []
+    assert index.overlapping(20, 20) == ["c"]
+    assert IntervalIndex([]).overlapping(1, 100) == []
+
+
+def test_scope_to_changed_lines():
+    structure = CodeAnalyzer().parse("service.py", SOURCE)
+    scoped = scope_structure(structure, [(12, 12)])
+    assert [(s["name"], s.get("parent")) for s in scoped["symbols"]] == [("Service", None), ("handle", "Service")]
+    # lineno is the def line; a change to the decorator alone still selects it
+    assert scoped["symbols"][1]["lineno"] == 11
+    assert [s["name"] for s in scope_structure(structure, [(10, 10)])["symbols"]] == ["Service", "handle"]
+    assert scoped["dependencies"] == [{"name": "helper", "kind": "function", "lineno": 5}]
+    assert scoped["imports"] == ["typing.List"]
+
+
+def test_scope_full_file():
+    result = CodeAnalyzer().analyze("service.py", SOURCE)
+    assert [s["name"] for s in result["symbols"]] == ["helper", "Service", "handle", "other"]
+    assert result["imports"] == ["os", "typing.List"]
+    # The legacy keys report the def line, as before symbols existed
+    assert result["functions"] == [
+        {"name": "helper", "lineno": 5, "args": ["x"]},
+        {"name": "handle", "lineno": 11, "args": ["items"]},
+        {"name": "other", "lineno": 14, "args": ["self"]},
+    ]
+    assert result["classes"] == [{"name": "Service", "lineno": 9}]
+
+
+def test_errors_and_skipped_pass_through():
+    assert CodeAnalyzer().analyze_python("def broken(:\n") == {"error": "SyntaxError", "language": "python"}
+    skipped = {"skipped": "too large", "bytes": 10, "language": "python"}
+    assert scope_structure(skipped, [(1, 2)]) is skipped
+    assert summarize_analysis(skipped) == ""
+
+
+def test_summarize_analysis():
+    scoped = CodeAnalyzer().analyze("service.py", SOURCE, [(12, 12)])
+    assert summarize_analysis(scoped) == (
+        "classes: Service@9; functions: handle(items)@11; uses: helper@5; imports: typing.List"
+    )
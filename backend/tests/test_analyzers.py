@@ -0,0 +1,155 @@
+import pytest
+
+from app.analysis import CodeAnalyzer
+
+
+GO = '''package main
+
+import (
+	"fmt"
+	str "strings"
+)
+
+type Server struct {
+	name string
+}
+
+func (s *Server) Handle(req string, n int) string {
+	return str.ToUpper(fmt.Sprint(req))
+}
+
+func main() {
+}
+'''
+JAVA = '''import java.util.List;
+import static java.util.Collections.emptyList;
+
+public class Service {
+    @Override
+    public String handle(List<String> items, int limit) {
+        return emptyList().toString();
+    }
+
+    Service() {}
+}
+
+interface Handler {
+    void run();
+}
+'''
+TS = '''import { readFile as read, stat } from "fs";
+import path from "path";
+import "./side-effect";
+
+export class Loader {
+    load(name: string, retries: number): Promise<string> {
+        return read(path.join(name));
+    }
+}
+
+interface Options { verbose: boolean }
+type Id = string;
+
+function main(argv: string[]) {}
+'''
+TSX = '''import React from "react";
+
+export function Button({ label }: { label: string }) {
+    return <button>{label}</button>;
+}
+'''
+JS = '''import { useState } from "react";
+const fs = require("fs");
+
+export class Store {
+    get(key, fallback) {
+        return useState(key);
+    }
+}
+
+function* ids(start) {}
+
+export default function App() {
+    return <div />;
+}
+'''
+
+
+def _parse(grammar, filename, source):
+    pytest.importorskip("tree_sitter")
+    pytest.importorskip(grammar)
+    result = CodeAnalyzer().parse(filename, source)
+    assert "error" not in result
+    return result
+
+
+def _symbols(result):
+    return [(s["kind"], s["name"], s["lineno"], s["parent"], s.get("args")) for s in result["symbols"]]
+
+
+def _imports(result):
+    return [(i["name"], i["module"]) for i in result["imports"]]
+
+
+def test_go_analyzer():
+    result = _parse("tree_sitter_go", "server.go", GO)
+    assert _symbols(result) == [
+        ("type", "Server", 8, None, None),
+        ("method", "Handle", 12, None, ["req", "n"]),
+        ("function", "main", 16, None, []),
+    ]
+    assert _imports(result) == [("fmt", "fmt"), ("str", "strings")]
+    handle = result["symbols"][1]
+    assert {"str", "fmt"} <= set(handle["names"])
+
+
+def test_java_analyzer_keeps_lineno_on_the_declaration():
+    result = _parse("tree_sitter_java", "Service.java", JAVA)
+    assert _symbols(result) == [
+        ("class", "Service", 4, None, None),
+        ("method", "handle", 6, "Service", ["items", "limit"]),
+        ("method", "Service", 10, "Service", []),
+        ("interface", "Handler", 13, None, None),
+        ("method", "run", 14, "Handler", []),
+    ]
+    handle = result["symbols"][1]
+    assert handle["start"] == 5
+    assert "start" not in result["symbols"][0]
+    assert _imports(result) == [
+        ("List", "java.util.List"),
+        ("emptyList", "java.util.Collections.emptyList"),
+    ]
+
+
+def test_typescript_analyzer():
+    result = _parse("tree_sitter_typescript", "loader.ts", TS)
+    assert _symbols(result) == [
+        ("class", "Loader", 5, None, None),
+        ("method", "load", 6, "Loader", ["name", "retries"]),
+        ("interface", "Options", 11, None, None),
+        ("type", "Id", 12, None, None),
+        ("function", "main", 14, None, ["argv"]),
+    ]
+    assert _imports(result) == [
+        ("read", "fs"),
+        ("stat", "fs"),
+        ("path", "path"),
+        ("./side-effect", "./side-effect"),
+    ]
+
+
+def test_tsx_analyzer():
+    result = _parse("tree_sitter_typescript", "button.tsx", TSX)
+    assert _symbols(result) == [("function", "Button", 3, None, ["{ label }"])]
+    assert _imports(result) == [("React", "react")]
+
+
+def test_javascript_analyzer():
+    result = _parse("tree_sitter_javascript", "store.jsx", JS)
+    assert _symbols(result) == [
+        ("class", "Store", 4, None, None),
+        ("method", "get", 5, "Store", ["key", "fallback"]),
+        ("function", "ids", 10, None, ["start"]),
+        ("function", "App", 12, None, []),
+    ]
+    assert _imports(result) == [("useState", "react")]
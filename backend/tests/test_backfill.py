@@ -0,0 +1,29 @@
+import asyncio
+
+import httpx
+
+from app import backfill
+from app.backfill import Backfill
+
+
+class FakeClient:
+    def __init__(self):
+        self.listed = []
+
+    async def list_pull_requests(self, owner, repo, state, etags, keep=None):
+        self.listed.append(f"{owner}/{repo}")
+        if repo == "missing":
+            request = httpx.Request("GET", f"https://api.github.com/repos/{owner}/{repo}/pulls")
+            raise httpx.HTTPStatusError("Not Found", request=request, response=httpx.Response(404, request=request))
+        yield []
+
+
+def test_failed_repository_does_not_stop_the_rest(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(backfill, "REVIEW_CONTEXT", False)
+    client = FakeClient()
+    stats = asyncio.run(Backfill(client, llm=None).run(["acme/api", "acme/missing", "acme/web"]))
+    assert client.listed == ["acme/api", "acme/missing", "acme/web"]
+    assert stats["repository_errors"] == 1
+    assert stats["repositories"] == 3
+    assert stats["complete"] is True
@@ -0,0 +1,103 @@
+import asyncio
+
+from app.diff_parser import DiffParser, aiter_hunks, changed_ranges, iter_hunks, patch_changed_ranges, render_diff, split_hunks
+
+DIFF = """diff --git a/app/a.py b/app/a.py
+index 1111111..2222222 100644
+--- a/app/a.py
++++ b/app/a.py
+@@ -1,3 +1,4 @@
+ import os
++import sys
+ 
+ x = 1
+@@ -10,2 +11,2 @@ def f():
+-    return 1
++    return 2
+ 
+diff --git a/docs/readme.md b/docs/readme.md
+new file mode 100644
+--- /dev/null
++++ b/docs/readme.md
+@@ -0,0 +1,2 @@
++# Title
++text
+diff --git a/old.py b/old.py
+deleted file mode 100644
+--- a/old.py
++++ /dev/null
+@@ -1 +0,0 @@
+-gone
+"""
+
+
+def test_split_hunks():
+    hunks = split_hunks(DIFF)
+    assert [(h.path, h.new_start, h.new_count) for h in hunks] == [
+        ("app/a.py", 1, 4), ("app/a.py", 11, 2), ("docs/readme.md", 1, 2), ("old.py", 0, 0),
+    ]
+    assert hunks[0].lines == [" import os", "+import sys", " ", " x = 1"]
+    assert hunks[0].file_header.splitlines()[0] == "diff --git a/app/a.py b/app/a.py"
+    assert hunks[1].header == "@@ -10,2 +11,2 @@ def f():"
+
+
+def test_crlf_lines():
+    hunks = list(iter_hunks(line + "\r\n" for line in DIFF.splitlines()))
+    assert hunks[0].lines[1] == "+import sys"
+
+
+def test_render_round_trip():
+    hunks = split_hunks(DIFF)
+    assert render_diff(hunks).replace("\n\n", "\n") == DIFF.replace("\n\n", "\n")
+    assert render_diff(hunks).count("diff --git a/app/a.py") == 1
+
+
+def test_include_skips_files():
+    parser = DiffParser(include=lambda path: path.endswith(".py"))
+    assert [h.path for h in iter_hunks(DIFF.splitlines(), parser)] == ["app/a.py", "app/a.py", "old.py"]
+    assert parser.skipped_files == {"docs/readme.md"}
+
+
+def test_max_hunk_lines_truncates():
+    parser = DiffParser(max_hunk_lines=2)
+    first = next(iter_hunks(DIFF.splitlines(), parser))
+    assert first.lines == [" import os", "+import sys", "\\ (hunk truncated)"]
+    assert parser.truncated_hunks == 1
+
+
+def test_max_file_lines_stops_file():
+    # The first hunk counts 3 + 4 lines, the second pushes app/a.py over the limit
+    parser = DiffParser(max_file_lines=8)
+    hunks = list(iter_hunks(DIFF.splitlines(), parser))
+    assert [(h.path, h.new_start) for h in hunks] == [("app/a.py", 1), ("docs/readme.md", 1), ("old.py", 0)]
+    assert parser.skipped_files == {"app/a.py"}
+
+
+def test_aiter_hunks():
+    async def lines():
+        for line in DIFF.splitlines():
+            yield line
+
+    async def collect():
+        return [h.path async for h in aiter_hunks(lines())]
+
+    assert asyncio.run(collect()) == ["app/a.py", "app/a.py", "docs/readme.md", "old.py"]
+
+
+def test_fingerprint_ignores_position_and_whitespace():
+    a = split_hunks(DIFF)[1]
+    moved = split_hunks(DIFF.replace("@@ -10,2 +11,2 @@", "@@ -40,2 +41,2 @@").replace("+    return 2", "+  return   2"))[1]
+    assert a.fingerprint() == moved.fingerprint()
+    assert a.fingerprint() != split_hunks(DIFF.replace("return 2", "return 3"))[1].fingerprint()
+
+
+def test_changed_ranges():
+    assert changed_ranges(10, [" a", "+b", "+c", " d", "-e", " f"]) == [(11, 12), (14, 14)]
+    # A deletion right after an addition merges into the same range
+    assert changed_ranges(1, ["+a", "-b", "\\ No newline at end of file"]) == [(1, 2)]
+
+
+def test_patch_changed_ranges():
+    patch = "@@ -1,2 +1,3 @@\n a\n+b\n c\n@@ -20 +21,2 @@\n-x\n+y\n+z"
+    assert patch_changed_ranges(patch) == [(2, 2), (21, 22)]
+    assert patch_changed_ranges("") == []
@@ -0,0 +1,63 @@
+import asyncio
+import json
+
+from sqlalchemy import exc
+
+from app import feedback
+from app.feedback import FeedbackQueue
+
+
+def _records(ratings):
+    return [{"review_id": i, "rating": rating, "comment": None} for i, rating in enumerate(ratings)]
+
+
+def _run(queue, records):
+    async def main():
+        queue.start()
+        for record in records:
+            assert queue.submit(record)
+        await asyncio.sleep(0.05)
+        await queue.stop()
+
+    asyncio.run(main())
+
+
+def test_bad_records_are_split_out_and_dead_lettered(tmp_path, monkeypatch):
+    written = []
+
+    def write(records):
+        if any(r["rating"] == 0 for r in records):
+            raise exc.IntegrityError("INSERT INTO feedback", {}, Exception("check constraint"))
+        written.extend(records)
+        return len(records)
+
+    monkeypatch.setattr(feedback, "write_feedback", write)
+    dead_letter = tmp_path / "dead.jsonl"
+    queue = FeedbackQueue(batch_size=8, flush_ms=1, retry_seconds=0, dead_letter_path=str(dead_letter))
+    records = _records([5, 4, 0, 3, 5, 0, 1, 2])
+    _run(queue, records)
+
+    assert [r["review_id"] for r in written] == [0, 1, 3, 4, 6, 7]
+    dead = [json.loads(line) for line in dead_letter.read_text().splitlines()]
+    assert [d["record"]["review_id"] for d in dead] == [2, 5]
+    assert "IntegrityError" in dead[0]["error"]
+    assert queue.stats["written"] == 6
+    assert queue.stats["dead_lettered"] == 2
+
+
+def test_connection_errors_are_retried_a_bounded_number_of_times(tmp_path, monkeypatch):
+    attempts = []
+
+    def write(records):
+        attempts.append(len(records))
+        raise exc.OperationalError("INSERT INTO feedback", {}, Exception("connection refused"))
+
+    monkeypatch.setattr(feedback, "write_feedback", write)
+    dead_letter = tmp_path / "dead.jsonl"
+    queue = FeedbackQueue(batch_size=4, flush_ms=1, retry_seconds=0, max_retries=2, dead_letter_path=str(dead_letter))
+    _run(queue, _records([5, 4, 3]))
+
+    # The first attempt and two retries, then the whole batch is dead-lettered
+    assert attempts == [3, 3, 3]
+    assert len(dead_letter.read_text().splitlines()) == 3
+    assert queue.stats["dead_lettered"] == 3
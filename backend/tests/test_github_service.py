@@ -0,0 +1,44 @@
+import time
+from email.utils import formatdate
+
+import httpx
+import pytest
+
+from app import github_service
+from app.github_service import _retry_delay
+
+
+def _response(status, headers=None, text=""):
+    return httpx.Response(status, headers=headers or {}, text=text)
+
+
+def test_not_throttled():
+    assert _retry_delay(_response(200), 0) is None
+    assert _retry_delay(_response(403, text="Resource not accessible"), 0) is None
+
+
+def test_retry_after_seconds():
+    assert _retry_delay(_response(429, {"Retry-After": "7"}), 0) == 7.0
+
+
+def test_retry_after_http_date():
+    delay = _retry_delay(_response(403, {"Retry-After": formatdate(time.time() + 30, usegmt=True)}), 0)
+    assert 28 <= delay <= 30
+    assert _retry_delay(_response(429, {"Retry-After": formatdate(time.time() - 30, usegmt=True)}), 0) == 0.0
+
+
+def test_unparseable_retry_after_is_ignored():
+    # Falls through to the backoff for secondary limits without a hint
+    assert _retry_delay(_response(429, {"Retry-After": "soon"}), 1) == 8.0
+
+
+def test_delays_are_capped(monkeypatch):
+    monkeypatch.setattr(github_service, "GITHUB_MAX_RETRY_SECONDS", 60.0)
+    assert _retry_delay(_response(429, {"Retry-After": "86400"}), 0) == 60.0
+    reset = {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(int(time.time()) + 3600)}
+    assert _retry_delay(_response(403, reset), 0) == 60.0
+
+
+@pytest.mark.parametrize("attempt, delay", [(0, 4.0), (2, 16.0), (5, 60.0)])
+def test_secondary_limit_backoff(attempt, delay):
+    assert _retry_delay(_response(403, text="You have exceeded a secondary rate limit"), attempt) == delay
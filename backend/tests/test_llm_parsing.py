@@ -0,0 +1,133 @@
+import json
+
+import pytest
+from pydantic import ValidationError
+
+from app.llm import SuggestionStream, _repair_json, loads_lenient, parse_review
+from app.schemas import Suggestion
+
+REVIEW = {"summary": "Looks fine", "suggestions": [{"file": "a.py", "line": 3, "comment": "Rename x"}]}
+
+
+def test_plain_json():
+    assert loads_lenient(json.dumps(REVIEW)) == REVIEW
+
+
+def test_code_fence_and_prose():
+    text = "Here is my review:\n```json\n" + json.dumps(REVIEW) + "\n```\nThanks!"
+    assert loads_lenient(text) == REVIEW
+
+
+def test_unterminated_fence():
+    assert loads_lenient("```json\n" + json.dumps(REVIEW)) == REVIEW
+
+
+def test_no_json():
+    assert loads_lenient("No issues found.") is None
+
+
+def test_trailing_commas():
+    assert loads_lenient('{"suggestions": [1, 2,],}') == {"suggestions": [1, 2]}
+
+
+def test_raw_newline_in_string():
+    assert loads_lenient('{"summary": "line one\nline two"}') == {"summary": "line one\nline two"}
+
+
+def test_truncated_in_string():
+    assert loads_lenient('{"summary": "Looks fi') == {"summary": "Looks fi"}
+
+
+def test_truncated_after_escape():
+    assert loads_lenient('{"summary": "a\\') == {"summary": "a"}
+
+
+def test_truncated_in_nested_object():
+    text = '{"summary": "s", "suggestions": [{"file": "a.py", "line": 3'
+    assert loads_lenient(text) == {"summary": "s", "suggestions": [{"file": "a.py", "line": 3}]}
+
+
+@pytest.mark.parametrize("text", ['{"summary": "s", "sugg', '{"summary": "s", "suggestions"', '{"summary": "s",'])
+def test_dangling_key_dropped(text):
+    assert loads_lenient(text) == {"summary": "s"}
+
+
+def test_key_without_value():
+    assert loads_lenient('{"summary": "s", "line":') == {"summary": "s", "line": None}
+
+
+@pytest.mark.parametrize("partial, value", [("tr", None), ("true", True), ("nul", None), ("false", False)])
+def test_partial_literal(partial, value):
+    assert loads_lenient('{"ok": ' + partial) == {"ok": value}
+
+
+def test_mismatched_closer_ignored():
+    assert loads_lenient('{"a": [1, 2}]}') == {"a": [1, 2]}
+
+
+def test_stops_after_first_value():
+    assert _repair_json('{"a": 1} trailing {"b": 2}') == '{"a": 1}'
+
+
+def test_parse_review_complete():
+    review = parse_review(json.dumps(REVIEW))
+    assert review == {"summary": "Looks fine", "suggestions": [{"file": "a.py", "line": 3, "severity": "minor", "comment": "Rename x"}]}
+
+
+def test_parse_review_repaired_is_partial():
+    review = parse_review('{"summary": "s", "suggestions": [{"file": "a.py", "comment": "c"}')
+    assert review["partial"] is True
+    assert review["suggestions"] == [{"file": "a.py", "severity": "minor", "comment": "c"}]
+
+
+def test_parse_review_text_is_partial():
+    assert parse_review("  just prose  ") == {"summary": "just prose", "suggestions": [], "partial": True}
+
+
+def test_parse_review_error_is_partial():
+    review = parse_review({"error": "timeout"})
+    assert review == {"summary": "timeout", "suggestions": [], "partial": True}
+
+
+def test_parse_review_list_and_invalid_suggestions():
+    review = parse_review([{"path": "a.py", "message": "m"}, {"file": "b.py"}, "junk"])
+    assert review["suggestions"] == [{"file": "a.py", "severity": "minor", "comment": "m"}]
+    assert "partial" not in review
+
+
+def test_suggestion_stream_yields_each_object():
+    stream = SuggestionStream()
+    text = json.dumps({"summary": "s", "suggestions": [{"file": "a.py", "comment": "one"}, {"file": "b.py", "comment": "two"}]})
+    cut = text.index("}, {") + 1
+    assert [s["comment"] for s in stream.feed(text[:cut])] == ["one"]
+    assert [s["comment"] for s in stream.feed(text[cut:])] == ["two"]
+    assert len(stream.result()["suggestions"]) == 2
+
+
+def test_suggestion_stream_cut_off_keeps_complete_suggestions():
+    stream = SuggestionStream()
+    stream.feed('{"suggestions": [{"file": "a.py", "comment": "one"}, {"file": "b.py", "comm')
+    result = stream.result()
+    assert result["partial"] is True
+    assert [s["comment"] for s in result["suggestions"]] == ["one"]
+
+
+@pytest.mark.parametrize("value, line", [(12, 12), ("12", 12), ("L12", 12), ("12-14", 12), ("line 7", 7), (0, None), ("n/a", None), (True, None), (None, None)])
+def test_suggestion_line(value, line):
+    assert Suggestion.model_validate({"comment": "c", "line": value}).line == line
+
+
+@pytest.mark.parametrize("value, severity", [("Critical", "critical"), ("nit", "info"), ("warning", "minor"), ("bug", "major"), ("whatever", "minor"), (None, "minor")])
+def test_suggestion_severity(value, severity):
+    assert Suggestion.model_validate({"comment": "c", "severity": value}).severity == severity
+
+
+def test_suggestion_aliases_and_cleanup():
+    suggestion = Suggestion.model_validate({"filename": " a.py ", "lineno": "3", "body": " fix ", "category": " Style ", "extra": 1})
+    assert suggestion.model_dump(exclude_none=True) == {"file": "a.py", "line": 3, "severity": "minor", "category": "style", "comment": "fix"}
+
+
+@pytest.mark.parametrize("raw", [{}, {"comment": ""}, {"comment": "   "}, {"comment": None}])
+def test_suggestion_requires_comment(raw):
+    with pytest.raises(ValidationError):
+        Suggestion.model_validate(raw)
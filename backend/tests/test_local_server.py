@@ -0,0 +1,91 @@
+import threading
+import time
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from app import local_server  # noqa: E402
+from app.local_server import LocalModelServer  # noqa: E402
+
+
+class _Encoding(dict):
+    __getattr__ = dict.__getitem__
+
+    def to(self, device):
+        return self
+
+
+class CharTokenizer:
+    """One token per character, left padding, ids as text."""
+
+    eos_token_id = 1
+    pad_token_id = 0
+
+    def __call__(self, text, return_tensors=None, padding=False):
+        if isinstance(text, str):
+            return _Encoding(input_ids=self._ids(text))
+        ids = [self._ids(t) for t in text]
+        width = max(map(len, ids))
+        return _Encoding(
+            input_ids=torch.tensor([[0] * (width - len(i)) + i for i in ids]),
+            attention_mask=torch.tensor([[0] * (width - len(i)) + [1] * len(i) for i in ids]),
+        )
+
+    def _ids(self, text):
+        return [2 + ord(c) % 90 for c in text]
+
+    def decode(self, ids, skip_special_tokens=True):
+        return " ".join(map(str, ids))
+
+
+PROMPTS = ["def f(x): return x", "a", "class Service:\n    pass\n" * 3, "hello world", "zz", "import os"]
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    config = transformers.LlamaConfig(
+        vocab_size=100, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+        num_attention_heads=4, num_key_value_heads=4,
+    )
+    return transformers.LlamaForCausalLM(config).eval()
+
+
+def _server(model, max_batch_size):
+    server = LocalModelServer(max_batch_size=max_batch_size, batch_wait_ms=1)
+    server.model, server.tokenizer = model, CharTokenizer()
+    threading.Thread(target=server._serve, daemon=True).start()
+    return server
+
+
+def test_concurrent_requests_match_sequential_ones(model):
+    alone = _server(model, 1)
+    expected = [alone.generate(p, max_new_tokens=20) for p in PROMPTS]
+    server = _server(model, 4)
+    requests = [server.submit(p, max_new_tokens=20) for p in PROMPTS[:3]]
+    time.sleep(0.01)
+    requests += [server.submit(p, max_new_tokens=20) for p in PROMPTS[3:]]
+    # Greedy output is the same as decoding each prompt on its own
+    assert [r.result(30) for r in requests] == expected
+
+
+def test_requests_join_mid_decode(model):
+    alone = _server(model, 1)
+    expected = [alone.generate(p, max_new_tokens=30) for p in PROMPTS]
+
+    server = LocalModelServer(max_batch_size=8)
+    server.model, server.tokenizer = model, CharTokenizer()
+    requests = [local_server.GenerationRequest(p, 30) for p in PROMPTS]
+    running = server._prefill(requests[:2])
+    for _ in range(3):
+        running = server._decode(running)
+    # A short and a long prompt join three tokens in, with caches of other lengths
+    running = local_server._Running.merge(running, server._prefill(requests[2:4]))
+    running = server._decode(running)
+    running = local_server._Running.merge(running, server._prefill(requests[4:]))
+    while running is not None:
+        running = server._decode(running)
+
+    assert [r.result(0) for r in requests] == expected
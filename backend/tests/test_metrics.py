@@ -0,0 +1,35 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app.crud import finish_review, get_metrics_summary, save_reviews, start_review
+from app.database import Base
+
+
+def _review(number, suggestions, duration=2.0):
+    return {
+        "owner": "acme", "repo": "api", "status": "completed", "summary": "ok", "duration": duration,
+        "pull_request": {"pr_number": number, "title": None, "description": None, "status": "open"},
+        "suggestions": suggestions,
+    }
+
+
+def test_severity_counts_come_from_the_rollup():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        save_reviews(db, [
+            _review(1, [{"file": "a.py", "severity": "major", "comment": "x"}, {"file": "a.py", "comment": "y"}]),
+            _review(2, [{"file": "b.py", "severity": "blocker", "comment": "z"}, {"file": "b.py"}], duration=40.0),
+        ])
+        review_id = start_review(db, "acme", "web", 3)
+        finish_review(db, review_id, "acme/web", "completed", "ok", [
+            {"file": "c.py", "severity": "info", "comment": "nit"},
+            {"file": "c.py", "severity": "major", "comment": "bug"},
+        ], 1.5)
+
+        summary = get_metrics_summary(db)
+
+    # The suggestion without a comment is invalid and counted nowhere
+    assert summary["by_severity"] == {"info": 1, "minor": 1, "major": 2, "critical": 1}
+    assert summary["issues_found"] == sum(summary["by_severity"].values())
+    assert summary["by_repository"] == {"acme/api": {"reviews": 2, "issues": 3}, "acme/web": {"reviews": 1, "issues": 2}}
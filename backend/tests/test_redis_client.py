@@ -0,0 +1,78 @@
+import redis
+
+from app import redis_client, review_cache
+from app.review_cache import ReviewCache
+
+
+class FakeRedis:
+    def __init__(self, error=None):
+        self.error = error
+        self.pings = 0
+
+    def ping(self):
+        self.pings += 1
+        if self.error is not None:
+            raise self.error
+        return True
+
+    def mget(self, keys):
+        raise self.error or redis.ConnectionError("gone")
+
+
+def _connect_with(monkeypatch, client):
+    monkeypatch.setattr(redis.Redis, "from_url", classmethod(lambda cls, url, **kwargs: client))
+
+
+def test_failed_connection_is_retried_after_the_backoff(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(redis_client.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(redis_client, "_redis", None)
+    monkeypatch.setattr(redis_client, "_retry_at", 0.0)
+    monkeypatch.setattr(redis_client, "REDIS_RETRY_SECONDS", 30)
+    down = FakeRedis(redis.ConnectionError("refused"))
+    _connect_with(monkeypatch, down)
+
+    assert redis_client.get_redis() is None
+    clock[0] += 10
+    assert redis_client.get_redis() is None
+    assert down.pings == 1
+
+    up = FakeRedis()
+    _connect_with(monkeypatch, up)
+    clock[0] += 25
+    assert redis_client.get_redis() is up
+    assert redis_client.get_redis() is up
+    assert up.pings == 1
+
+
+def test_lost_connection_drops_the_client_until_the_next_retry(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(redis_client.time, "monotonic", lambda: clock[0])
+    up = FakeRedis()
+    monkeypatch.setattr(redis_client, "_redis", up)
+    monkeypatch.setattr(redis_client, "_retry_at", 0.0)
+    _connect_with(monkeypatch, up)
+
+    redis_client.redis_failed(redis.ResponseError("WRONGTYPE"))
+    assert redis_client.get_redis() is up
+
+    redis_client.redis_failed(redis.TimeoutError("timed out"))
+    assert redis_client.get_redis() is None
+    clock[0] += redis_client.REDIS_RETRY_SECONDS
+    assert redis_client.get_redis() is up
+
+
+def test_review_cache_falls_back_to_the_local_cache_per_call(monkeypatch):
+    failures = []
+    monkeypatch.setattr(review_cache, "redis_failed", failures.append)
+    client = [FakeRedis()]
+    cache = ReviewCache(redis=lambda: client[0])
+    # FakeRedis fails every command, so both calls land in the local LRU
+    cache.set_many({"a": [1]})
+    assert cache.get_many(["a"]) == {"a": [1]}
+    assert len(failures) == 2
+
+    # The client is looked up per call: with Redis down nothing is attempted
+    client[0] = None
+    assert cache.get_many(["a"]) == {"a": [1]}
+    assert len(failures) == 2
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+from app import retrieval
+from app.retrieval import EntryLog, HashingEmbedder, VectorIndex
+
+DIM = 16
+
+
+def _unit_rows(count, seed):
+    rows = np.random.default_rng(seed).normal(size=(count, DIM)).astype(np.float32)
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+def _exact(vectors, queries, k):
+    scores = queries @ vectors.T
+    return [list(np.argsort(-row, kind="stable")[:k]) for row in scores]
+
+
+def test_tail_search_is_exact(tmp_path):
+    vectors = _unit_rows(200, 1)
+    index = VectorIndex(str(tmp_path), DIM)
+    index.add(vectors[:120], range(120))
+    index.add(vectors[120:], range(120, 200))
+    assert len(index) == 200
+    queries = _unit_rows(5, 2)
+    results = index.search(queries, k=4)
+    assert [[i for i, _ in row] for row in results] == _exact(vectors, queries, 4)
+    assert all(a[1] >= b[1] for row in results for a, b in zip(row, row[1:]))
+
+
+def test_compacted_ivf_search(tmp_path, monkeypatch):
+    monkeypatch.setattr(retrieval, "REVIEW_INDEX_IVF_MIN", 100)
+    monkeypatch.setattr(retrieval, "REVIEW_INDEX_TAIL_MAX", 250)
+    vectors = _unit_rows(400, 3)
+    index = VectorIndex(str(tmp_path), DIM)
+    index.add(vectors[:300], range(300))
+    # Past REVIEW_INDEX_TAIL_MAX the tail was folded into lists with centroids
+    assert index.manifest["count"] == 300 and index.manifest["nlist"] == 17
+    index.add(vectors[300:], range(300, 400))
+    assert index.tail_count == 100
+
+    queries = vectors[[5, 150, 350]]
+    # Probing every list is exact; each stored vector is its own best match
+    results = index.search(queries, k=3, nprobe=index.manifest["nlist"])
+    assert [[i for i, _ in row] for row in results] == _exact(vectors, queries, 3)
+    assert [row[0][0] for row in index.search(queries, k=1, nprobe=2)] == [5, 150, 350]
+
+
+def test_readers_see_appends_and_new_generations(tmp_path):
+    vectors = _unit_rows(50, 4)
+    writer = VectorIndex(str(tmp_path), DIM)
+    reader = VectorIndex(str(tmp_path), DIM)
+    writer.add(vectors[:30], range(30))
+    assert reader.search(vectors[:1], k=1)[0][0][0] == 0
+    with writer.locked():
+        writer.compact()
+    writer.add(vectors[30:], range(30, 50))
+    assert reader.search(vectors[45:46], k=1)[0][0][0] == 45
+    assert len(reader) == 50
+    # The files of the replaced generation are gone
+    assert not any(p.name.startswith("g0.") for p in tmp_path.iterdir())
+
+
+def test_interrupted_append_is_truncated(tmp_path):
+    vectors = _unit_rows(10, 5)
+    index = VectorIndex(str(tmp_path), DIM)
+    index.add(vectors[:4], range(4))
+    # Vectors written without their ids, as if the writer died in between
+    with open(index._file("tail.vectors.f32"), "ab") as f:
+        f.write(vectors[4:6].tobytes())
+    index.add(vectors[6:], range(6, 10))
+    assert len(index) == 8
+    assert [row[0][0] for row in index.search(vectors[[2, 7]], k=1)] == [2, 7]
+
+
+def test_empty_index(tmp_path):
+    index = VectorIndex(str(tmp_path), DIM)
+    assert len(index) == 0
+    assert index.search(_unit_rows(2, 6), k=3) == [[], []]
+
+
+def test_entry_log(tmp_path):
+    log = EntryLog(str(tmp_path / "entries"))
+    assert len(log) == 0
+    assert log.append([{"n": 0}, {"n": 1, "text": "line\nbreak"}]) == 0
+    assert log.append([{"n": 2}]) == 2
+    assert len(log) == 3
+    assert log.get([2, 0, 1]) == {2: {"n": 2}, 0: {"n": 0}, 1: {"n": 1, "text": "line\nbreak"}}
+    assert log.get([]) == {}
+
+
+def test_embedder_similarity():
+    embedder = HashingEmbedder(dim=256)
+    a, b, c = embedder.embed([
+        ("app/db.py", ["+    session.commit()", "+    session.close()"]),
+        ("app/db.py", ["+    self.session.commit()"]),
+        ("web/ui.tsx", ["+  return <Button onClick={submit} />"]),
+    ])
+    assert np.linalg.norm(a) == pytest.approx(1.0)
+    assert a @ b > a @ c
+    empty = embedder.embed([("Makefile", [" context only"])])[0]
+    assert not empty.any()
@@ -0,0 +1,170 @@
+import asyncio
+
+import pytest
+
+from app import router
+from app.llm import LLMProvider
+from app.router import ProviderRouter, RoutedProvider, _percentile
+
+
+class FakeProvider(LLMProvider):
+    def __init__(self, name, delay=0.0, fail=False):
+        self.name = name
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+
+    async def agenerate_review(self, code_diff, context=""):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError(f"{self.name} is down")
+        return {"summary": self.name, "suggestions": []}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(router.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    monkeypatch.setattr(router, "LLM_ROUTER_BREAKER_FAILURES", 3)
+    monkeypatch.setattr(router, "LLM_ROUTER_BREAKER_SECONDS", 10.0)
+    monkeypatch.setattr(router, "LLM_ROUTER_BREAKER_MAX_SECONDS", 25.0)
+    monkeypatch.setattr(router, "LLM_ROUTER_MIN_SAMPLES", 4)
+
+
+@pytest.mark.parametrize("count", [1, 10, 34, 50, 199])
+def test_percentile_without_censoring(count):
+    values = [float(v) for v in range(count)]
+    for q in (50, 95, 99):
+        assert _percentile([(v, True) for v in values], q) == values[min(int(q / 100 * count), count - 1)]
+
+
+def test_percentile_with_censoring():
+    # Cancelled after 8s: those calls would have been slower still, so the median moves up
+    observed = [(float(s), True) for s in range(1, 11)]
+    censored = [(8.0, False)] * 10
+    assert _percentile(observed, 50) == 6.0
+    assert _percentile(observed + censored, 50) == 9.0
+    # Past the last observed latency, the longest sample is the answer
+    assert _percentile([(1.0, True), (5.0, False)], 95) == 5.0
+
+
+def test_breaker_opens_after_consecutive_failures(clock, breaker):
+    provider = RoutedProvider(FakeProvider("a"), cost=1, max_concurrency=4)
+    provider.record(1.0, ok=False)
+    provider.record(1.0, ok=False)
+    assert provider.available(clock())
+    provider.record(1.0, ok=False)
+    assert not provider.available(clock())
+    assert provider.snapshot()["circuit"] == "open"
+
+
+def test_breaker_half_open_probe_and_backoff(clock, breaker):
+    provider = RoutedProvider(FakeProvider("a"), cost=1, max_concurrency=4)
+    for _ in range(3):
+        provider.record(1.0, ok=False)
+    clock.now += 10
+    assert provider.snapshot()["circuit"] == "half-open"
+    assert provider.available(clock())
+
+    # One probe at a time; a failed probe reopens the circuit for twice as long
+    provider.probing = True
+    assert not provider.available(clock())
+    provider.record(1.0, ok=False)
+    assert not provider.available(clock() + 19)
+    assert provider.available(clock() + 20)
+
+    # Backoff is capped at LLM_ROUTER_BREAKER_MAX_SECONDS
+    clock.now += 20
+    provider.probing = True
+    provider.record(1.0, ok=False)
+    assert provider.open_until == clock() + 25
+
+
+def test_breaker_closes_on_successful_probe(clock, breaker):
+    provider = RoutedProvider(FakeProvider("a"), cost=1, max_concurrency=4)
+    for _ in range(3):
+        provider.record(1.0, ok=False)
+    clock.now += 10
+    provider.probing = True
+    provider.record(0.5, ok=True)
+    assert provider.available(clock())
+    assert provider.snapshot()["circuit"] == "closed"
+    assert provider.cooldown == 10.0
+    # Failures from before the outage are forgotten
+    assert provider.error_rate() == 0.0
+
+
+def test_breaker_opens_on_error_rate(clock, breaker):
+    provider = RoutedProvider(FakeProvider("a"), cost=1, max_concurrency=4)
+    for ok in (True, True, False, True, False):
+        provider.record(1.0, ok=ok)
+    assert provider.available(clock())
+    provider.record(1.0, ok=False)
+    assert not provider.available(clock())
+
+
+def test_cancelled_calls_are_censored(breaker):
+    provider = RoutedProvider(FakeProvider("a"), cost=1, max_concurrency=4)
+    for _ in range(4):
+        provider.record(1.0, ok=True)
+    provider.record_cancelled(3.0)
+    provider.record_cancelled(3.0)
+    # Neither an error nor dropped from the latency estimate
+    assert provider.error_rate() == 0.0
+    assert provider.latency(95) == 3.0
+
+
+def test_candidates_order(clock, breaker):
+    cheap, fast = FakeProvider("cheap"), FakeProvider("fast")
+    routed = [RoutedProvider(cheap, cost=1, max_concurrency=4), RoutedProvider(fast, cost=10, max_concurrency=4)]
+    for _ in range(4):
+        routed[0].record(5.0, ok=True)
+        routed[1].record(1.0, ok=True)
+    llm_router = ProviderRouter(routed, small_tokens=100)
+    assert [p.name for p in llm_router.candidates(50)] == ["cheap", "fast"]
+    assert [p.name for p in llm_router.candidates(500)] == ["fast", "cheap"]
+    routed[1].max_tokens = 200
+    assert [p.name for p in llm_router.candidates(500)] == ["cheap", "fast"]
+    for _ in range(3):
+        routed[0].record(1.0, ok=False)
+    assert [p.name for p in llm_router.candidates(50)] == ["fast"]
+
+
+def test_falls_back_when_a_provider_fails(breaker):
+    down, up = FakeProvider("down", fail=True), FakeProvider("up")
+    llm_router = ProviderRouter([RoutedProvider(down, 1, 4), RoutedProvider(up, 2, 4)])
+    assert asyncio.run(llm_router.agenerate_review("diff"))["summary"] == "up"
+    assert llm_router.stats["fallbacks"] == 1
+
+
+def test_hedges_a_slow_provider(breaker, monkeypatch):
+    monkeypatch.setattr(router, "LLM_ROUTER_HEDGE_DEFAULT_SECONDS", 0.05)
+    monkeypatch.setattr(router, "LLM_ROUTER_HEDGE_MIN_SECONDS", 0.05)
+    slow, quick = FakeProvider("slow", delay=5), FakeProvider("quick")
+    routed = [RoutedProvider(slow, 1, 4), RoutedProvider(quick, 2, 4)]
+    llm_router = ProviderRouter(routed)
+    assert asyncio.run(llm_router.agenerate_review("diff"))["summary"] == "quick"
+    assert llm_router.stats["hedges"] == 1 and llm_router.stats["hedge_wins"] == 1
+    # The loser was cancelled and recorded as a censored sample, not a failure
+    assert [ok for _, ok in routed[0].calls] == [None]
+    assert routed[0].in_flight == 0
+
+
+def test_all_providers_failing_raises(breaker):
+    llm_router = ProviderRouter([RoutedProvider(FakeProvider("a", fail=True), 1, 4)])
+    with pytest.raises(RuntimeError, match="All LLM providers failed"):
+        asyncio.run(llm_router.agenerate_review("diff"))
@@ -0,0 +1,134 @@
+import json
+
+import pytest
+
+from app import scheduling
+from app.scheduling import LOWEST_PRIORITY, _parse_limits, acquire_slot, release_slot, review_priority, tenant_key
+
+
+@pytest.mark.parametrize("changed_lines, priority", [(0, 0), (50, 0), (51, 1), (200, 1), (1000, 3), (5000, 5), (5001, 7)])
+def test_priority_by_size(changed_lines, priority):
+    assert review_priority(changed_lines) == priority
+
+
+def test_backlog_penalty(monkeypatch):
+    monkeypatch.setattr(scheduling, "REVIEW_BACKLOG_PENALTY_STEP", 5)
+    assert review_priority(10, backlog=4) == 0
+    assert review_priority(10, backlog=5) == 1
+    assert review_priority(300, backlog=12) == 5
+    # Never below the lowest priority, which backfills use
+    assert review_priority(100_000, backlog=1000) == LOWEST_PRIORITY
+
+
+def test_backlog_penalty_disabled(monkeypatch):
+    monkeypatch.setattr(scheduling, "REVIEW_BACKLOG_PENALTY_STEP", 0)
+    assert review_priority(10, backlog=1000) == 0
+
+
+def test_tenant_key():
+    assert tenant_key("acme", 42) == "installation:42"
+    assert tenant_key("acme", 0) == "owner:acme"
+
+
+def test_parse_limits():
+    assert _parse_limits(" acme/mono=6, acme/docs=1,broken,bad=x,") == {"acme/mono": 6, "acme/docs": 1}
+
+
+def test_local_slots(monkeypatch):
+    monkeypatch.setattr(scheduling, "get_redis", lambda: None)
+    monkeypatch.setattr(scheduling, "_local", scheduling._LocalState())
+    monkeypatch.setattr(scheduling, "REVIEW_TENANT_CONCURRENCY", 2)
+    monkeypatch.setattr(scheduling, "_repo_limits", {"acme/a": 1})
+
+    assert acquire_slot("t", "acme/a", "1")
+    # Taking the same lease again is allowed; the repository cap is 1
+    assert acquire_slot("t", "acme/a", "1")
+    assert not acquire_slot("t", "acme/a", "2")
+    assert acquire_slot("t", "acme/b", "3")
+    # The tenant cap of 2 is reached, whatever the repository
+    assert not acquire_slot("t", "acme/c", "4")
+    release_slot("t", "acme/a", "1")
+    assert acquire_slot("t", "acme/a", "2")
+
+
+def test_local_slots_expire(monkeypatch):
+    monkeypatch.setattr(scheduling, "get_redis", lambda: None)
+    monkeypatch.setattr(scheduling, "_local", scheduling._LocalState())
+    monkeypatch.setattr(scheduling, "REVIEW_SLOT_TTL", -1)
+    monkeypatch.setattr(scheduling, "REVIEW_REPO_CONCURRENCY", 1)
+    assert acquire_slot("t", "acme/a", "1")
+    # The first lease has already expired, as if its worker had crashed
+    assert acquire_slot("t", "acme/a", "2")
+
+
+class DelayedRedis:
+    """Just enough of Redis for the delay set: a pipeline and the pop script."""
+
+    def __init__(self):
+        self.due = {}
+        self.tasks = {}
+
+    def pipeline(self):
+        return self
+
+    def hset(self, key, field, value):
+        self.tasks[field] = value
+
+    def zadd(self, key, mapping):
+        self.due.update(mapping)
+
+    def execute(self):
+        return []
+
+    def eval(self, script, numkeys, *args):
+        now, limit = args[numkeys:]
+        ready = sorted((score, task_id) for task_id, score in self.due.items() if score <= now)[:limit]
+        for _, task_id in ready:
+            del self.due[task_id]
+        return [self.tasks.pop(task_id) for _, task_id in ready]
+
+
+def test_delayed_reviews_are_dispatched_when_due(monkeypatch):
+    redis = DelayedRedis()
+    sent = []
+    clock = [1000.0]
+    monkeypatch.setattr(scheduling, "get_redis", lambda: redis)
+    monkeypatch.setattr(scheduling.time, "time", lambda: clock[0])
+    monkeypatch.setattr(scheduling.celery, "send_task", lambda name, **kwargs: sent.append(kwargs))
+
+    scheduling.schedule_review("a", {"pr_number": 1}, 0, 30)
+    scheduling.schedule_review("b", {"pr_number": 2, "dispatched_at": 900.0}, 3, 5)
+    assert scheduling.dispatch_due_reviews() == 0
+
+    clock[0] += 10
+    assert scheduling.dispatch_due_reviews() == 1
+    # A requeued review keeps its first dispatch time
+    assert sent == [{"kwargs": {"pr_number": 2, "dispatched_at": 900.0}, "task_id": "b", "priority": 3}]
+
+    clock[0] += 30
+    assert scheduling.dispatch_due_reviews() == 1
+    assert sent[1] == {"kwargs": {"pr_number": 1, "dispatched_at": 1040.0}, "task_id": "a", "priority": 0}
+    assert not redis.due and not redis.tasks
+
+
+def test_failed_dispatch_goes_back_on_the_delay_set(monkeypatch):
+    redis = DelayedRedis()
+    monkeypatch.setattr(scheduling, "get_redis", lambda: redis)
+    monkeypatch.setattr(scheduling, "redis_failed", lambda error: None)
+
+    def broker_down(name, **kwargs):
+        raise ConnectionError("broker down")
+
+    monkeypatch.setattr(scheduling.celery, "send_task", broker_down)
+    scheduling.schedule_review("a", {"pr_number": 1}, 0, 0)
+    assert scheduling.dispatch_due_reviews() == 0
+    assert json.loads(redis.tasks["a"]) == {"task_id": "a", "kwargs": {"pr_number": 1}, "priority": 0}
+
+
+def test_schedule_review_without_redis_uses_a_countdown(monkeypatch):
+    sent = []
+    monkeypatch.setattr(scheduling, "get_redis", lambda: None)
+    monkeypatch.setattr(scheduling.celery, "send_task", lambda name, **kwargs: sent.append((name, kwargs)))
+    scheduling.schedule_review("a", {"pr_number": 1}, 2, 30)
+    assert sent == [("process_review", {"kwargs": {"pr_number": 1}, "task_id": "a", "priority": 2, "countdown": 30})]
+
@@ -0,0 +1,105 @@
+import os
+
+import pytest
+
+from app import segment_log
+from app.segment_log import BufferedWriter, SegmentStore, matches
+
+
+@pytest.fixture
+def small_segments(monkeypatch):
+    # Seal after roughly 10 records, in blocks of 4
+    monkeypatch.setattr(segment_log, "SEGMENT_MAX_BYTES", 400)
+    monkeypatch.setattr(segment_log, "SEGMENT_BLOCK_RECORDS", 4)
+
+
+def _records(start, count):
+    return [{"review_id": i, "feedback": {"rating": i % 5 + 1}, "text": "x" * 20} for i in range(start, start + count)]
+
+
+def test_append_and_read_open_segment(tmp_path):
+    store = SegmentStore(str(tmp_path))
+    store.append_many(_records(0, 3))
+    store.append_many(_records(3, 2))
+    assert [(o, r["review_id"]) for o, r in store.iter_records()] == [(i, i) for i in range(5)]
+    assert [o for o, _ in store.iter_records(start_offset=3)] == [3, 4]
+    assert store.end_offset() == 5
+
+
+def test_sealed_segments_keep_offsets(tmp_path, small_segments):
+    store = SegmentStore(str(tmp_path))
+    for start in range(0, 40, 5):
+        store.append_many(_records(start, 5))
+    store.append_many(_records(40, 3))
+    names = sorted(os.listdir(tmp_path))
+    assert any(name.endswith(".idx.json") for name in names)
+    assert any(name.endswith(".jsonl") for name in names)
+    assert [o for o, r in store.iter_records()] == list(range(43))
+    assert all(o == r["review_id"] for o, r in store.iter_records())
+    assert [o for o, _ in store.iter_records(start_offset=13)] == list(range(13, 43))
+    assert store.end_offset() == 43
+
+
+def test_where_filters_and_block_stats(tmp_path, small_segments, monkeypatch):
+    store = SegmentStore(str(tmp_path))
+    for start in range(0, 40, 5):
+        store.append_many(_records(start, 5))
+    assert [o for o, _ in store.iter_records(where=[("review_id", ">=", 30)])] == list(range(30, 40))
+    assert [o for o, _ in store.iter_records(where=[("feedback.rating", "==", 5)])] == list(range(4, 40, 5))
+
+    # Blocks whose review_id range can't match are never decompressed
+    decompressed = []
+    real = segment_log._decompress
+    monkeypatch.setattr(segment_log, "_decompress", lambda data, codec: decompressed.append(1) or real(data, codec))
+    assert [o for o, _ in store.iter_records(where=[("review_id", "==", 2)])] == [2]
+    assert len(decompressed) == 1
+
+
+def test_torn_and_corrupt_lines_skipped(tmp_path):
+    store = SegmentStore(str(tmp_path))
+    store.append_many(_records(0, 2))
+    base, path = store._active()
+    with open(path, "ab") as f:
+        f.write(b"not json\n{\"review_id\": 9")
+    assert [o for o, _ in store.iter_records()] == [0, 1]
+
+
+@pytest.mark.parametrize("where, expected", [
+    ([("feedback.rating", ">=", 4)], True),
+    ([("feedback.rating", "<", 4)], False),
+    ([("feedback.comment", "exists", True)], False),
+    ([("feedback.comment", "exists", False)], True),
+    ([("review_id", "in", {1, 7})], True),
+    ([("review_id", ">", "a")], False),
+    ([("missing.field", "==", 1)], False),
+])
+def test_matches(where, expected):
+    assert matches({"review_id": 7, "feedback": {"rating": 4}}, where) is expected
+
+
+class _FlakyStore:
+    def __init__(self):
+        self.fail = True
+        self.written = []
+
+    def append_many(self, records):
+        if self.fail:
+            raise OSError("disk full")
+        self.written.extend(records)
+
+
+def test_buffered_writer_retries_and_bounds_buffer():
+    store = _FlakyStore()
+    writer = BufferedWriter(store, flush_ms=60_000, flush_records=1000, max_buffered=5)
+    for i in range(4):
+        writer.append({"i": i})
+    writer.flush()
+    for i in range(4, 8):
+        writer.append({"i": i})
+    writer.flush()
+    assert writer.dropped == 3
+
+    store.fail = False
+    writer.flush()
+    # The oldest records went first; order is kept for the rest
+    assert [r["i"] for r in store.written] == [3, 4, 5, 6, 7]
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+pytest.importorskip("peft")
+
+from app.train_local import pack_examples, packed_batches  # noqa: E402
+
+
+def _data(lengths):
+    tokens = np.random.default_rng(0).integers(1, 100, sum(lengths)).astype(np.int32)
+    starts = np.cumsum([0] + lengths[:-1])
+    index = np.stack([starts, lengths], axis=1)
+    mask = np.ones_like(tokens, dtype=np.uint8)
+    mask[starts] = 0  # the first token of each example is prompt
+    return {"index": index, "tokens": tokens, "mask": mask}
+
+
+def _segments(position_ids):
+    starts = [i for i, p in enumerate(position_ids.tolist()) if p == 0]
+    return list(zip(starts, starts[1:] + [len(position_ids)]))
+
+
+def test_packed_batch_layout():
+    data = _data([5, 3, 7, 4])
+    packs = pack_examples(data["index"], 10)
+    assert packs == [[2, 1], [0, 3]]
+    batch = next(packed_batches(data, packs, batch_size=2, pad_token_id=0))
+    mask = batch["attention_mask"]
+    assert mask.shape == (2, 1, 10, 10)
+    # Shortest pack first: row 0 holds examples of 5 and 4 tokens and one pad
+    allowed = mask[0, 0].eq(0)
+    assert allowed[4, :5].all() and not allowed[4, 5:].any()
+    assert allowed[8, 5:9].all() and not allowed[8, :5].any() and not allowed[5, 6]
+    assert not allowed[9].any()
+    assert batch["position_ids"][0].tolist() == [0, 1, 2, 3, 4, 0, 1, 2, 3, 0]
+    assert batch["labels"][0, 0] == -100 and batch["labels"][0, 5] == -100 and batch["labels"][0, 9] == -100
+
+
+@pytest.mark.parametrize("attn_implementation", ["eager", "sdpa"])
+def test_packed_examples_do_not_attend_to_each_other(attn_implementation):
+    torch.manual_seed(0)
+    config = transformers.LlamaConfig(
+        vocab_size=100, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+        num_attention_heads=4, num_key_value_heads=4, attn_implementation=attn_implementation,
+    )
+    model = transformers.LlamaForCausalLM(config).eval()
+    data = _data([5, 3, 7, 4])
+    batch = next(packed_batches(data, pack_examples(data["index"], 10), batch_size=2, pad_token_id=0))
+    with torch.no_grad():
+        packed = model(
+            input_ids=batch["input_ids"], attention_mask=batch["attention_mask"], position_ids=batch["position_ids"]
+        ).logits
+        for row in range(2):
+            for start, end in _segments(batch["position_ids"][row])[:2]:
+                alone = model(input_ids=batch["input_ids"][row, start:end][None]).logits[0]
+                assert torch.allclose(packed[row, start:end], alone, atol=1e-5)
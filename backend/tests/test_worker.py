@@ -0,0 +1,59 @@
+import time
+
+from app import worker
+
+
+def _apply(monkeypatch, **kwargs):
+    monkeypatch.setenv("GITHUB_TOKEN", "test-token")
+    return worker.process_review.apply(
+        kwargs=dict(owner="acme", repo="api", pr_number=7, installation_id=1, **kwargs), task_id="task-1"
+    )
+
+
+def _run(monkeypatch, **kwargs):
+    return _apply(monkeypatch, **kwargs).get()
+
+
+def test_over_cap_review_goes_back_on_the_delay_set(monkeypatch):
+    delayed = []
+    monkeypatch.setattr(worker, "is_superseded", lambda *args: False)
+    monkeypatch.setattr(worker, "acquire_slot", lambda *args: False)
+    monkeypatch.setattr(worker, "schedule_review", lambda *args: delayed.append(args))
+    monkeypatch.setattr(worker.time, "sleep", lambda seconds: (_ for _ in ()).throw(AssertionError("slept")))
+
+    assert _run(monkeypatch, received_at=100.0, dispatched_at=130.0) == {"requeued": True}
+    [(task_id, kwargs, priority, delay)] = delayed
+    assert task_id == "task-1"
+    assert kwargs["dispatched_at"] == 130.0 and kwargs["received_at"] == 100.0
+    assert delay == worker.REVIEW_REQUEUE_SECONDS
+
+
+def test_superseded_review_is_skipped_at_pickup(monkeypatch):
+    dequeued = []
+    monkeypatch.setattr(worker, "is_superseded", lambda *args: True)
+    monkeypatch.setattr(worker, "mark_dequeued", lambda tenant, task_id, started=True: dequeued.append(started))
+    assert _run(monkeypatch) == {"superseded": True}
+    assert dequeued == [False]
+
+
+def test_debounce_and_queue_wait_are_separate_stages(monkeypatch):
+    stages = {}
+
+    class RecordingTrace(worker.Trace):
+        def record(self, name, seconds):
+            stages[name] = seconds
+            super().record(name, seconds)
+
+    def stop(*args):
+        raise RuntimeError("stop")
+
+    monkeypatch.setattr(worker, "Trace", RecordingTrace)
+    monkeypatch.setattr(worker, "is_superseded", lambda *args: False)
+    monkeypatch.setattr(worker, "acquire_slot", lambda *args: True)
+    monkeypatch.setattr(worker, "mark_dequeued", lambda *args, **kwargs: None)
+    # Nothing past the stage bookkeeping is under test
+    monkeypatch.setattr(worker, "_start_review", stop)
+    now = time.time()
+    assert _apply(monkeypatch, received_at=now - 40, dispatched_at=now - 5).failed()
+    assert 34.9 < stages["debounce"] < 35.1
+    assert 4.9 < stages["queue_wait"] < 6